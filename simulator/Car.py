@@ -49,12 +49,277 @@ STEP_REWARD_GAIN = 10
 INPUT_REWARD_GAIN = -0.05
 CRASH_REWARD = -100
 
+# integration of the dynamics over one control period
+#   'odeint' - scipy LSODA with default tolerances (the original behaviour)
+#   'rk4'    - fixed-step RK4 with RK4_SUBSTEPS steps per period
+#   'exact'  - closed-form solution of the (no beta) dynamics
+# Max abs state error per 0.1 s period over random states/inputs (see
+# benchmark_integrators.py), against a 1e-13 tolerance odeint solution:
+# odeint 8e-8, rk4 5e-8 (4 substeps; 7e-7 with 2, 1.2e-5 with 1), exact 1e-12.
+# Both rk4 and exact are therefore within 1e-7 of the default odeint results.
+INTEGRATORS = ['odeint', 'rk4', 'exact']
+RK4_SUBSTEPS = 4
+
+def _region_ranges(region, right, angle, dist_s, dist_f, hall_width, next_hall_width):
+    """Ranges of all rays of cars that share the same region and turn direction.
+
+    angle holds the (wrapped) ray angles in degrees; the car states are
+    scalars, or (n, 1) columns when angle is (n, num_rays). The branches
+    below follow the if/elif chains of World.scan_lidar_loop one to one.
+    """
+
+    if right:
+        dist_l = dist_s
+        dist_r = hall_width - dist_s
+    else:
+        dist_l = hall_width - dist_s
+        dist_r = dist_s
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # Region 1 (before turn)
+        if region == 1:
+
+            if right:
+                theta_l = np.arctan(dist_s / dist_f) * 180 / np.pi
+                theta_r = -np.arctan((hall_width - dist_s) / (dist_f - next_hall_width)) * 180 / np.pi
+            else:
+                theta_l = np.arctan((hall_width - dist_s) / (dist_f - next_hall_width)) * 180 / np.pi
+                theta_r = -np.arctan(dist_s / dist_f) * 180 / np.pi
+
+            conditions = [angle <= theta_r,
+                          (angle > theta_r) & (angle <= theta_l)]
+            choices = [dist_r / np.cos((90 + angle) * np.pi / 180),
+                       dist_f / np.cos(angle * np.pi / 180)]
+            default = dist_l / np.cos((90 - angle) * np.pi / 180)
+
+        # Region 2 (during turn)
+        elif region == 2:
+
+            if right:
+                theta_l = np.arctan(dist_s / dist_f) * 180 / np.pi
+                theta_r = -np.arctan((hall_width - dist_s) / (dist_f - next_hall_width)) * 180 / np.pi - 180
+
+                conditions = [angle <= theta_r,
+                              (angle > theta_r) & (angle < -90),
+                              (angle > -90) & (angle <= theta_l)]
+                choices = [dist_r / np.cos((90 + angle) * np.pi / 180),
+                           (next_hall_width - dist_f) / np.cos((180 + angle) * np.pi / 180),
+                           dist_f / np.cos(angle * np.pi / 180)]
+            else:
+                theta_l = 180 - np.arctan((hall_width - dist_s) / (next_hall_width - dist_f)) * 180 / np.pi
+                theta_r = -np.arctan(dist_s / dist_f) * 180 / np.pi
+
+                conditions = [angle <= theta_r,
+                              (angle > theta_r) & (angle <= 90),
+                              (angle > 90) & (angle <= theta_l)]
+                choices = [dist_r / np.cos((90 + angle) * np.pi / 180),
+                           dist_f / np.cos(angle * np.pi / 180),
+                           (next_hall_width - dist_f) / np.cos((180 + angle) * np.pi / 180)]
+
+            default = dist_l / np.cos((90 - angle) * np.pi / 180)
+
+        # Region 3 (after turn)
+        else:
+
+            if right:
+                theta_l = np.arctan(dist_s / dist_f) * 180 / np.pi
+                theta_r = 180 - np.arctan(- (hall_width - dist_s) / (next_hall_width - dist_f)) * 180 / np.pi
+
+                conditions = [angle < -90,
+                              angle == -90,
+                              (angle > -90) & (angle <= theta_l),
+                              (angle > theta_l) & (angle <= theta_r)]
+                choices = [(next_hall_width - dist_f) / np.cos((180 + angle) * np.pi / 180),
+                           LIDAR_RANGE,
+                           dist_f / np.cos(angle * np.pi / 180),
+                           dist_l / np.cos((90 - angle) * np.pi / 180)]
+            else:
+                theta_l = np.arctan(- (hall_width - dist_s) / (next_hall_width - dist_f)) * 180 / np.pi - 180
+                theta_r = -np.arctan(dist_s / dist_f) * 180 / np.pi
+
+                conditions = [angle > 90,
+                              (angle < 90) & (angle >= theta_r),
+                              (angle < theta_r) & (angle >= theta_l)]
+                choices = [(next_hall_width - dist_f) / np.cos((180 + angle) * np.pi / 180),
+                           dist_f / np.cos(angle * np.pi / 180),
+                           dist_r / np.cos((90 - angle) * np.pi / 180)]
+
+            default = (next_hall_width - dist_f) / np.cos((180 - angle) * np.pi / 180)
+
+    # apply the branches from the last to the first so the first match wins
+    data = default
+    for condition, choice in zip(reversed(conditions), reversed(choices)):
+        data = np.where(condition, choice, data)
+
+    return data
+
+def lidar_scan(theta_t, heading, dist_s, dist_f, hall_width, next_hall_width, right, noise = 0):
+    """Vectorized LIDAR model (without missing rays) for one or many cars.
+
+    theta_t are the ray angles in degrees relative to the car heading. The
+    car states (heading, dist_s, dist_f, hall_width, next_hall_width and the
+    right-turn flag) are either scalars, in which case a (num_rays,) scan is
+    returned, or (N,) arrays, in which case the result is (N, num_rays).
+
+    For a single car this returns exactly the values of World.scan_lidar_loop
+    for the same RNG state (the noise is drawn in the same order), but all
+    rays are handled with whole-array operations.
+    """
+
+    single = np.ndim(dist_s) == 0
+
+    if single:
+        angle = theta_t + heading * 180 / np.pi
+    else:
+        dist_s, dist_f, heading, hall_width, next_hall_width, right =\
+                np.broadcast_arrays(dist_s, dist_f, heading, hall_width, next_hall_width, right)
+        angle = theta_t + (heading * 180 / np.pi)[:, None]
+
+    angle = np.where(angle > 180, angle - 360, angle)
+    angle = np.where(angle < -180, angle + 360, angle)
+
+    inside = (dist_s > 0) & (dist_s < hall_width)
+    before = dist_f > next_hall_width
+
+    reg1 = inside & before
+    reg2 = inside & ~before
+    reg3 = ~inside & (dist_s > hall_width) & ~before
+
+    if single:
+        if reg1 or reg2 or reg3:
+            region = 1 if reg1 else 2 if reg2 else 3
+
+            data = _region_ranges(region, right, angle, dist_s, dist_f, hall_width, next_hall_width)
+
+            # add noise
+            data = data + np.random.uniform(0, noise, size=data.shape)
+
+            data[(data > LIDAR_RANGE) | (data < 0)] = LIDAR_RANGE
+        else:
+            data = np.zeros(angle.shape)
+
+        return data
+
+    data = np.zeros(angle.shape)
+
+    for region, mask in [(1, reg1), (2, reg2), (3, reg3)]:
+        for turn in [True, False]:
+            cars = np.nonzero(mask & (right == turn))[0]
+
+            if len(cars) == 0:
+                continue
+
+            data[cars] = _region_ranges(region, turn, angle[cars],\
+                                        dist_s[cars, None], dist_f[cars, None],\
+                                        hall_width[cars, None], next_hall_width[cars, None])
+
+    in_region = (reg1 | reg2 | reg3)[:, None]
+
+    # add noise
+    data = np.where(in_region, data + np.random.uniform(0, noise, size=data.shape), data)
+
+    with np.errstate(invalid='ignore'):
+        data[in_region & ((data > LIDAR_RANGE) | (data < 0))] = LIDAR_RANGE
+
+    return data
+
+def dynamics_no_beta(x, u, delta, right):
+    """Batched version of World.bicycle_dynamics_no_beta.
+
+    x is a (N, 7) array of states [s, f, V, theta_local, x, y, theta_global];
+    u (throttle), delta (steering, in radians) and right (right-turn flag)
+    are scalars or (N,) arrays.
+    """
+
+    dXdt = np.empty_like(x)
+
+    # -V * sin(theta_local) in right turns, V * sin(theta_local) in left turns
+    dXdt[:, 0] = np.where(right, -1, 1) * x[:, 2] * np.sin(x[:, 3])
+
+    # -V * cos(theta_local)
+    dXdt[:, 1] = -x[:, 2] * np.cos(x[:, 3])
+
+    # a * u - V
+    dXdt[:, 2] = np.where(u > HYSTERESIS_CONSTANT,\
+                          CAR_ACCEL_CONST * CAR_MOTOR_CONST * (u - HYSTERESIS_CONSTANT) - CAR_ACCEL_CONST * x[:, 2],\
+                          - CAR_ACCEL_CONST * x[:, 2])
+
+    # V * tan(delta) / l
+    dXdt[:, 3] = x[:, 2] * np.tan(delta) / CAR_LENGTH
+
+    # V * cos(theta_global)
+    dXdt[:, 4] = x[:, 2] * np.cos(x[:, 6])
+
+    # V * sin(theta_global)
+    dXdt[:, 5] = x[:, 2] * np.sin(x[:, 6])
+
+    # V * tan(delta) / l
+    dXdt[:, 6] = dXdt[:, 3]
+
+    return dXdt
+
+def integrate_rk4(x, u, delta, right, time_step, substeps = RK4_SUBSTEPS):
+    """Integrates dynamics_no_beta over one control period with fixed-step RK4."""
+
+    h = time_step / substeps
+
+    for i in range(substeps):
+        k1 = dynamics_no_beta(x, u, delta, right)
+        k2 = dynamics_no_beta(x + h / 2 * k1, u, delta, right)
+        k3 = dynamics_no_beta(x + h / 2 * k2, u, delta, right)
+        k4 = dynamics_no_beta(x + h * k3, u, delta, right)
+
+        x = x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+    return x
+
+def integrate_exact(x, u, delta, right, time_step):
+    """Closed-form solution of dynamics_no_beta over one control period.
+
+    With constant throttle and steering the velocity solves a linear ODE,
+    V(t) = c + (V0 - c) * exp(-a * t), and both headings turn by
+    tan(delta) / l per meter travelled, so the car moves along a circular
+    arc (a straight line if delta = 0) whose length is the integral of V.
+    """
+
+    # steady-state velocity for this throttle
+    c = np.where(u > HYSTERESIS_CONSTANT, CAR_MOTOR_CONST * (u - HYSTERESIS_CONSTANT), 0.0)
+
+    decay = np.exp(-CAR_ACCEL_CONST * time_step)
+
+    # distance travelled during the period
+    dist = c * time_step + (x[:, 2] - c) * (1 - decay) / CAR_ACCEL_CONST
+
+    # half of the heading change and the length of the arc's chord,
+    # 2 * sin(half) / curvature, written with sinc so that it is exact at delta = 0
+    half = np.tan(delta) / CAR_LENGTH * dist / 2
+    chord = dist * np.sinc(half / np.pi)
+
+    mid_local = x[:, 3] + half
+    mid_global = x[:, 6] + half
+
+    new_x = np.empty_like(x)
+    new_x[:, 0] = x[:, 0] + np.where(right, -1, 1) * chord * np.sin(mid_local)
+    new_x[:, 1] = x[:, 1] - chord * np.cos(mid_local)
+    new_x[:, 2] = c + (x[:, 2] - c) * decay
+    new_x[:, 3] = x[:, 3] + 2 * half
+    new_x[:, 4] = x[:, 4] + chord * np.cos(mid_global)
+    new_x[:, 5] = x[:, 5] + chord * np.sin(mid_global)
+    new_x[:, 6] = x[:, 6] + 2 * half
+
+    return new_x
+
 class World:
 
     def __init__(self, hallWidths, hallLengths, turns,\
                  car_dist_s, car_dist_f, car_heading,\
                  episode_length, time_step, lidar_field_of_view,\
-                 lidar_num_rays, lidar_noise = 0, lidar_missing_rays = 0, lidar_missing_in_turn_only = False):
+                 lidar_num_rays, lidar_noise = 0, lidar_missing_rays = 0, lidar_missing_in_turn_only = False,\
+                 integrator = 'odeint'):
+
+        if integrator not in INTEGRATORS:
+            raise ValueError('unknown integrator ' + str(integrator) + ', expected one of ' + str(INTEGRATORS))
 
         # hallway parameters
         self.numHalls = len(hallWidths)
@@ -76,6 +341,7 @@ class World:
 
         # step parameters
         self.time_step = time_step
+        self.integrator = integrator
         self.cur_step = 0
         self.episode_length = episode_length
 
@@ -97,6 +363,8 @@ class World:
         self.cur_num_missing_rays = lidar_missing_rays
         self.missing_indices = np.random.choice(self.lidar_num_rays, self.cur_num_missing_rays)
 
+        self.lidar_angles = np.linspace(-self.lidar_field_of_view, self.lidar_field_of_view, self.lidar_num_rays)
+
         # parameters needed for consistency with gym environments
         self.obs_low = np.zeros(self.lidar_num_rays, )
         self.obs_high = LIDAR_RANGE * np.ones(self.lidar_num_rays, )
@@ -219,10 +487,20 @@ class World:
         x0 = [self.car_dist_s, self.car_dist_f, self.car_V, self.car_heading, self.car_global_x, self.car_global_y, self.car_global_heading]
         t = [0, self.time_step]
         
-        #new_x = odeint(self.bicycle_dynamics, x0, t, args=(throttle, delta * np.pi / 180, self.turns[self.curHall],))
-        new_x = odeint(self.bicycle_dynamics_no_beta, x0, t, args=(throttle, delta * np.pi / 180, self.turns[self.curHall],))
+        if self.integrator == 'odeint':
+            #new_x = odeint(self.bicycle_dynamics, x0, t, args=(throttle, delta * np.pi / 180, self.turns[self.curHall],))
+            new_x = odeint(self.bicycle_dynamics_no_beta, x0, t, args=(throttle, delta * np.pi / 180, self.turns[self.curHall],))
+
+            new_x = new_x[1]
+
+        else:
+            right = 'right' in self.turns[self.curHall]
+            delta_rad = np.ravel(delta * np.pi / 180)
 
-        new_x = new_x[1]
+            if self.integrator == 'rk4':
+                new_x = integrate_rk4(np.array([x0], dtype=float), throttle, delta_rad, right, self.time_step)[0]
+            else:
+                new_x = integrate_exact(np.array([x0], dtype=float), throttle, delta_rad, right, self.time_step)[0]
 
         self.car_dist_s, self.car_dist_f, self.car_V, self.car_heading, self.car_global_x, self.car_global_y, self.car_global_heading =\
                     new_x[0], new_x[1], new_x[2], new_x[3], new_x[4], new_x[5], new_x[6]
@@ -297,6 +575,27 @@ class World:
 
     def scan_lidar(self):
 
+        data = lidar_scan(self.lidar_angles, self.car_heading, self.car_dist_s, self.car_dist_f,\
+                          self.hallWidths[self.curHall], self.hallWidths[(self.curHall + 1) % self.numHalls],\
+                          'right' in self.turns[self.curHall], self.lidar_noise)
+
+        # add missing rays
+        if self.lidar_missing_in_turn_only:
+
+            # add missing rays only in Region 2 (plus an extra 1m before it)
+            if self.car_dist_s > 0 and self.car_dist_s < self.hallWidths[self.curHall] and\
+               self.car_dist_f <= self.hallWidths[(self.curHall + 1) % self.numHalls] + 1:
+
+                data[self.missing_indices] = LIDAR_RANGE
+        else:
+            # add missing rays in all regions
+            data[self.missing_indices] = LIDAR_RANGE
+
+        return data
+
+    # Reference (one ray at a time) implementation of scan_lidar
+    def scan_lidar_loop(self):
+
         car_heading_deg = self.car_heading * 180 / np.pi
 
         alpha = int(np.floor(4 * car_heading_deg))
@@ -408,7 +707,7 @@ class World:
                                 (np.cos( (angle) * np.pi / 180))
 
                     elif angle > 90 and angle <= theta_l:
-                        data[index] = (self.hallWidth - self.car_dist_f) /\
+                        data[index] = (self.hallWidths[(self.curHall + 1) % self.numHalls] - self.car_dist_f) /\
                                 (np.cos( (180 + angle) * np.pi / 180))
                     else:
                         data[index] = (dist_l) /\
@@ -707,3 +1006,233 @@ class World:
             l2y = np.array([y3, y4])
             plt.plot(l1x, l1y, 'b', linewidth=3)
             plt.plot(l2x, l2y, 'b', linewidth=3)
+
+class BatchedWorld:
+    """Simulates num_cars independent cars in the same hallways in lockstep.
+
+    The car states are kept in a (num_cars, 7) array with the same layout as
+    the World dynamics, x := [s, f, V, theta_local, x, y, theta_global],
+    plus a per-car hallway index (curHall) and step counter (cur_step). The
+    usual World attributes (car_dist_s, car_heading, ...) are exposed as
+    (num_cars,) views into the state array.
+
+    step() advances all cars at once and returns per-car observations,
+    rewards and terminal flags; cars that are terminal are not reset
+    automatically, call reset(mask) for them.
+    """
+
+    def __init__(self, num_cars, hallWidths, hallLengths, turns,\
+                 car_dist_s, car_dist_f, car_heading,\
+                 episode_length, time_step, lidar_field_of_view,\
+                 lidar_num_rays, lidar_noise = 0, lidar_missing_rays = 0, lidar_missing_in_turn_only = False,\
+                 integrator = 'odeint'):
+
+        if integrator not in INTEGRATORS:
+            raise ValueError('unknown integrator ' + str(integrator) + ', expected one of ' + str(INTEGRATORS))
+
+        self.num_cars = num_cars
+
+        # hallway parameters
+        self.numHalls = len(hallWidths)
+        self.hallWidths = np.array(hallWidths, dtype=float)
+        self.hallLengths = np.array(hallLengths, dtype=float)
+        self.turns = turns
+        self.right_turns = np.array(['right' in turn for turn in turns])
+        self.curHall = np.zeros(num_cars, dtype=int)
+
+        # car states
+        self.state = np.zeros((num_cars, 7))
+        self.state[:, 0] = car_dist_s
+        self.state[:, 1] = car_dist_f
+        self.state[:, 3] = car_heading
+        self.state[:, 4] = -self.hallWidths[0] / 2.0 + self.state[:, 0]
+        self.state[:, 5] = self.hallLengths[0] / 2.0 - self.state[:, 1]
+        self.state[:, 6] = self.state[:, 3] + np.pi / 2 #first hall goes "up" by default
+
+        # step parameters
+        self.time_step = time_step
+        self.integrator = integrator
+        self.cur_step = np.zeros(num_cars, dtype=int)
+        self.episode_length = episode_length
+
+        # lidar setup
+        self.lidar_field_of_view = lidar_field_of_view
+        self.lidar_num_rays = lidar_num_rays
+        self.lidar_angles = np.linspace(-self.lidar_field_of_view, self.lidar_field_of_view, self.lidar_num_rays)
+
+        self.lidar_noise = lidar_noise
+        self.total_lidar_missing_rays = lidar_missing_rays
+
+        self.lidar_missing_in_turn_only = lidar_missing_in_turn_only
+
+        self.cur_num_missing_rays = lidar_missing_rays
+        self.missing_indices = np.random.randint(self.lidar_num_rays, size=(num_cars, self.cur_num_missing_rays))
+
+        # parameters needed for consistency with gym environments
+        self.obs_low = np.zeros(self.lidar_num_rays, )
+        self.obs_high = LIDAR_RANGE * np.ones(self.lidar_num_rays, )
+
+        self.action_space = spaces.Box(low=-MAX_TURNING_INPUT, high=MAX_TURNING_INPUT, shape=(1,))
+        self.observation_space = spaces.Box(low=self.obs_low, high=self.obs_high)
+
+        self._max_episode_steps = episode_length
+
+    # per-car views of the state array, named as in World
+    @property
+    def car_dist_s(self):
+        return self.state[:, 0]
+
+    @property
+    def car_dist_f(self):
+        return self.state[:, 1]
+
+    @property
+    def car_V(self):
+        return self.state[:, 2]
+
+    @property
+    def car_heading(self):
+        return self.state[:, 3]
+
+    @property
+    def car_global_x(self):
+        return self.state[:, 4]
+
+    @property
+    def car_global_y(self):
+        return self.state[:, 5]
+
+    @property
+    def car_global_heading(self):
+        return self.state[:, 6]
+
+    def reset(self, mask = None, pos = None):
+        """Resets the cars selected by the boolean mask (all cars by default).
+
+        Returns the new observations of the reset cars only, i.e. a
+        (mask.sum(), lidar_num_rays) array.
+        """
+
+        if mask is None:
+            cars = np.arange(self.num_cars)
+        else:
+            cars = np.nonzero(mask)[0]
+
+        num = len(cars)
+
+        self.curHall[cars] = 0
+
+        if pos is None:
+            self.state[cars, 0] = self.hallWidths[0] / 2.0 + np.random.uniform(-0.2, 0.2, size=num)
+        else:
+            self.state[cars, 0] = pos
+
+        self.state[cars, 1] = self.hallLengths[0] / 2.0
+        self.state[cars, 2] = 0
+        self.state[cars, 3] = 0 + np.random.uniform(-0.3, 0.3, size=num)
+
+        self.state[cars, 4] = -self.hallWidths[0] / 2.0 + self.state[cars, 0]
+        self.state[cars, 5] = 0
+        self.state[cars, 6] = self.state[cars, 3] + np.pi / 2 #first hall goes "up" by default
+
+        self.missing_indices[cars] = np.random.randint(self.lidar_num_rays, size=(num, self.cur_num_missing_rays))
+
+        self.cur_step[cars] = 0
+
+        return self.scan_lidar(cars)
+
+    # x is the flattened (num_cars * 7) state, see World.bicycle_dynamics_no_beta
+    def bicycle_dynamics_no_beta(self, x, t, u, delta, right):
+        return dynamics_no_beta(x.reshape(-1, 7), u, delta, right).ravel()
+
+    def step(self, delta, throttle = CONST_THROTTLE):
+        self.cur_step += 1
+
+        # Constrain turning input
+        delta = np.clip(np.broadcast_to(np.ravel(delta), (self.num_cars,)), -MAX_TURNING_INPUT, MAX_TURNING_INPUT)
+        throttle = np.broadcast_to(np.ravel(throttle), (self.num_cars,))
+
+        right = self.right_turns[self.curHall]
+
+        # simulate dynamics
+        if self.integrator == 'odeint':
+
+            # every car only couples its own 7 states, so the jacobian is
+            # banded (this keeps the LSODA work arrays linear in num_cars)
+            t = [0, self.time_step]
+
+            new_x = odeint(self.bicycle_dynamics_no_beta, self.state.ravel(), t,\
+                           args=(throttle, delta * np.pi / 180, right,), ml=6, mu=6)
+
+            self.state = new_x[1].reshape(-1, 7)
+
+        elif self.integrator == 'rk4':
+            self.state = integrate_rk4(self.state, throttle, delta * np.pi / 180, right, self.time_step)
+
+        else:
+            self.state = integrate_exact(self.state, throttle, delta * np.pi / 180, right, self.time_step)
+
+        dist_s = self.state[:, 0]
+        dist_f = self.state[:, 1]
+        width = self.hallWidths[self.curHall]
+
+        # Compute reward
+        reward = np.full(self.num_cars, float(STEP_REWARD_GAIN))
+
+        # Region 1
+        region1 = (dist_s > 0) & (dist_s < width) & (dist_f > width)
+        reward[region1] += INPUT_REWARD_GAIN * delta[region1] * delta[region1]
+
+        # Set reward to maximum negative value if too close to a wall
+        crash = (dist_s < SAFE_DISTANCE) | (dist_f < SAFE_DISTANCE) |\
+                ((dist_s > width - SAFE_DISTANCE) & (dist_f > width - SAFE_DISTANCE))
+        reward[crash] = CRASH_REWARD
+
+        terminal = crash | (self.cur_step == self.episode_length)
+
+        # Test if a mode switch in the world has changed
+        switch = np.where(right, dist_s > LIDAR_RANGE, dist_s > width + 2)
+
+        if np.any(switch):
+            temp = dist_s[switch]
+
+            # front wall is now the left wall (right turn) or right wall (left turn)
+            self.state[switch, 3] += np.where(right[switch], np.pi / 2, -np.pi / 2)
+            self.state[switch, 0] = dist_f[switch]
+
+            #NB: this case deals with loops in the environment
+            self.curHall[switch] = (self.curHall[switch] + 1) % self.numHalls
+
+            self.state[switch, 1] = self.hallLengths[self.curHall[switch]] - temp
+
+        return self.scan_lidar(), reward, terminal, -1
+
+    def scan_lidar(self, cars = None):
+        """Lidar scans of the given cars (all cars by default), (len(cars), lidar_num_rays)."""
+
+        if cars is None:
+            cars = np.arange(self.num_cars)
+
+        hall = self.curHall[cars]
+        nextHall = (hall + 1) % self.numHalls
+
+        dist_s = self.state[cars, 0]
+        dist_f = self.state[cars, 1]
+
+        data = lidar_scan(self.lidar_angles, self.state[cars, 3], dist_s, dist_f,\
+                          self.hallWidths[hall], self.hallWidths[nextHall],\
+                          self.right_turns[hall], self.lidar_noise)
+
+        # add missing rays
+        if self.lidar_missing_in_turn_only:
+
+            # add missing rays only in Region 2 (plus an extra 1m before it)
+            missing = np.nonzero((dist_s > 0) & (dist_s < self.hallWidths[hall]) &\
+                                 (dist_f <= self.hallWidths[nextHall] + 1))[0]
+        else:
+            # add missing rays in all regions
+            missing = np.arange(len(cars))
+
+        data[missing[:, None], self.missing_indices[cars][missing]] = LIDAR_RANGE
+
+        return data
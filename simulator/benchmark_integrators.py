@@ -0,0 +1,101 @@
+'''
+Accuracy and cost of the World/BatchedWorld integrators ('odeint', 'rk4'
+and 'exact') over one 0.1 s control period.
+
+The errors are measured on random states and inputs against odeint run
+with 1e-13 tolerances; the timings are per car and control period, for a
+single World and for a BatchedWorld of num_cars cars.
+
+Example usage:
+
+python benchmark_integrators.py [num_cars]
+
+'''
+
+from Car import World, BatchedWorld, INTEGRATORS, RK4_SUBSTEPS, dynamics_no_beta, integrate_rk4, integrate_exact
+from scipy.integrate import odeint
+import numpy as np
+import timeit
+import sys
+
+def sampleInputs(num):
+    x = np.zeros((num, 7))
+    x[:, 0] = np.random.uniform(0, 5, num)
+    x[:, 1] = np.random.uniform(0, 10, num)
+    x[:, 2] = np.random.uniform(0, 2.5, num)
+    x[:, 3] = np.random.uniform(-1.5, 1.5, num)
+    x[:, 4] = np.random.uniform(-10, 10, num)
+    x[:, 5] = np.random.uniform(-10, 10, num)
+    x[:, 6] = x[:, 3] + np.pi / 2
+
+    throttle = np.random.choice([0, 3, 16, 30], num).astype(float)
+    delta = np.random.uniform(-15, 15, num) * np.pi / 180
+    right = np.random.randint(2, size=num).astype(bool)
+
+    return x, throttle, delta, right
+
+def odeintPerCar(x, throttle, delta, right, time_step, tol = None):
+    new_x = np.empty_like(x)
+
+    for i in range(len(x)):
+        f = lambda y, t: dynamics_no_beta(y[None], throttle[i], delta[i], right[i])[0]
+        new_x[i] = odeint(f, x[i], [0, time_step], rtol=tol, atol=tol)[1]
+
+    return new_x
+
+def main(argv):
+
+    num_cars = 1000
+    if len(argv) > 0:
+        num_cars = int(argv[0])
+
+    time_step = 0.1
+
+    np.random.seed(0)
+
+    x, throttle, delta, right = sampleInputs(2000)
+
+    reference = odeintPerCar(x, throttle, delta, right, time_step, 1e-13)
+
+    results = {}
+    results['odeint'] = odeintPerCar(x, throttle, delta, right, time_step)
+    results['rk4'] = integrate_rk4(x, throttle, delta, right, time_step)
+    results['exact'] = integrate_exact(x, throttle, delta, right, time_step)
+
+    print('max abs error per period (rk4 with ' + str(RK4_SUBSTEPS) + ' substeps)')
+    print('integrator   vs reference   vs default odeint')
+    for integrator in INTEGRATORS:
+        print('%-10s   %12.2e   %17.2e' % (integrator, np.abs(results[integrator] - reference).max(),\
+                                           np.abs(results[integrator] - results['odeint']).max()))
+
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
+    turns = ['right', 'right', 'right', 'right']
+
+    print('')
+    print('integrator   World (us/step)   BatchedWorld, ' + str(num_cars) + ' cars (us/car/step)')
+
+    for integrator in INTEGRATORS:
+        w = World(hallWidths, hallLengths, turns, 0.75, 9.9, 0, 70, time_step, 115, 21, integrator=integrator)
+        bw = BatchedWorld(num_cars, hallWidths, hallLengths, turns, 0.75, 9.9, 0, 70, time_step, 115, 21,\
+                          integrator=integrator)
+
+        deltas = np.random.uniform(-15, 15, (20, num_cars))
+
+        def runWorld():
+            w.reset()
+            for step in range(20):
+                w.step(deltas[step, 0])
+
+        def runBatched():
+            bw.reset()
+            for step in range(20):
+                bw.step(deltas[step])
+
+        worldTime = min(timeit.repeat(runWorld, number=1, repeat=3)) / 20
+        batchedTime = min(timeit.repeat(runBatched, number=1, repeat=3)) / 20 / num_cars
+
+        print('%-10s   %15.1f   %37.2f' % (integrator, worldTime * 1e6, batchedTime * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,87 @@
+'''
+Compares the vectorized World.scan_lidar with the reference per-ray
+World.scan_lidar_loop for the 21/41/61-ray controllers.
+
+The car states are sampled along the first hallway and through the first
+right turn so that all three regions are exercised. Both scans are run
+from the same RNG state and must return identical values.
+
+Example usage:
+
+python benchmark_lidar.py [num_states]
+
+'''
+
+from Car import World
+import numpy as np
+import timeit
+import sys
+
+def sampleStates(w, numStates):
+    states = []
+    for i in range(numStates):
+        dist_s = np.random.uniform(0.1, 4.5)
+        dist_f = np.random.uniform(0.1, 10)
+
+        # Regions 1 and 2 only exist for dist_s within the hallway
+        if dist_f > w.hallWidths[1]:
+            dist_s = np.random.uniform(0.1, w.hallWidths[0] - 0.1)
+
+        states.append((dist_s, dist_f, np.random.uniform(-0.5, 0.5)))
+
+    return states
+
+def setState(w, state):
+    w.car_dist_s, w.car_dist_f, w.car_heading = state
+
+def main(argv):
+
+    numStates = 1000
+    if len(argv) > 0:
+        numStates = int(argv[0])
+
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
+    turns = ['right', 'right', 'right', 'right']
+    lidar_field_of_view = 115
+    lidar_noise = 0.1
+
+    np.random.seed(0)
+
+    print('rays   loop (us/scan)   vectorized (us/scan)   speedup')
+
+    for lidar_num_rays in [21, 41, 61]:
+        w = World(hallWidths, hallLengths, turns, hallWidths[0] / 2.0, 9.9, 0,\
+                  70, 0.1, lidar_field_of_view, lidar_num_rays, lidar_noise)
+
+        states = sampleStates(w, numStates)
+
+        for state in states:
+            setState(w, state)
+
+            rngState = np.random.get_state()
+            loopData = w.scan_lidar_loop()
+
+            np.random.set_state(rngState)
+            vecData = w.scan_lidar()
+
+            if not np.array_equal(loopData, vecData):
+                raise ValueError('scan mismatch for state ' + str(state))
+
+        def runLoop():
+            for state in states:
+                setState(w, state)
+                w.scan_lidar_loop()
+
+        def runVectorized():
+            for state in states:
+                setState(w, state)
+                w.scan_lidar()
+
+        loopTime = min(timeit.repeat(runLoop, number=1, repeat=3)) / numStates
+        vecTime = min(timeit.repeat(runVectorized, number=1, repeat=3)) / numStates
+
+        print('%4d   %14.1f   %20.1f   %7.1fx' % (lidar_num_rays, loopTime * 1e6, vecTime * 1e6, loopTime / vecTime))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
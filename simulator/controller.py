@@ -0,0 +1,150 @@
+'''
+NumPy implementation of the (tanh) MLP controllers in ../dnns.
+
+The networks are loaded from the YAML files written by h5_to_yaml.py
+(dictionaries 'weights', 'offsets' and 'activations' indexed by layer,
+with the weights of each layer stored as a list of rows, one per neuron),
+from the .npz files written by ../train_td3/export.py or directly from
+the Keras .h5 files (this needs h5py, not Keras).
+
+Example usage:
+
+controller = MLPController.load('../dnns/TD3_L21_64x64_C1.yml')
+delta = controller.predict(w.scan_lidar())
+
+'''
+
+from Car import MAX_TURNING_INPUT
+import json
+import numpy as np
+import yaml
+
+# lidar normalization used during training
+LIDAR_MEAN = 2.5
+LIDAR_SPREAD = 5.0
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'relu': lambda x: np.maximum(x, 0),
+    'linear': lambda x: x,
+}
+
+def normalize(s):
+    return (s - LIDAR_MEAN) / LIDAR_SPREAD
+
+class MLPController:
+
+    def __init__(self, weights, offsets, activations):
+        """weights, offsets and activations are dictionaries indexed by layer (1, 2, ...)
+        in the format written by h5_to_yaml.py."""
+
+        self.layers = []
+
+        for layer in sorted(weights):
+            activation = activations[layer].lower()
+
+            if activation not in ACTIVATIONS:
+                raise ValueError('unsupported activation ' + str(activations[layer]) + ' in layer ' + str(layer))
+
+            # stored as (neurons, inputs); transposed once so forward() is x.dot(W) + b
+            W = np.ascontiguousarray(np.array(weights[layer], dtype=float).T)
+            b = np.array(offsets[layer], dtype=float)
+
+            self.layers.append((W, b, ACTIVATIONS[activation]))
+
+        self.num_inputs = self.layers[0][0].shape[0]
+        self.num_outputs = self.layers[-1][0].shape[1]
+
+    @classmethod
+    def from_yaml(cls, filename):
+        with open(filename, 'r') as f:
+            dnn = yaml.safe_load(f)
+
+        return cls(dnn['weights'], dnn['offsets'], dnn['activations'])
+
+    @classmethod
+    def from_h5(cls, filename):
+        import h5py
+
+        weights = {}
+        offsets = {}
+        activations = {}
+
+        with h5py.File(filename, 'r') as f:
+            config = f.attrs['model_config']
+            if isinstance(config, bytes):
+                config = config.decode('utf-8')
+
+            config = json.loads(config)['config']
+
+            # older Keras versions store the Sequential layers as a bare list
+            if isinstance(config, dict):
+                config = config['layers']
+
+            layer_count = 1
+            for layer in config:
+                if layer['class_name'] != 'Dense':
+                    continue
+
+                name = layer['config']['name']
+                group = f['model_weights'][name]
+
+                weightNames = [n.decode('utf-8') if isinstance(n, bytes) else n for n in group.attrs['weight_names']]
+                kernel = [group[n][()] for n in weightNames if 'kernel' in n][0]
+                bias = [group[n][()] for n in weightNames if 'bias' in n][0]
+
+                weights[layer_count] = kernel.T
+                offsets[layer_count] = bias
+                activations[layer_count] = layer['config']['activation']
+
+                layer_count += 1
+
+        return cls(weights, offsets, activations)
+
+    @classmethod
+    def from_npz(cls, filename):
+        with np.load(filename) as f:
+            activations = dict([(layer + 1, str(a)) for layer, a in enumerate(f['activations'])])
+
+            weights = dict([(layer, f['weights_' + str(layer)]) for layer in activations])
+            offsets = dict([(layer, f['offsets_' + str(layer)]) for layer in activations])
+
+        return cls(weights, offsets, activations)
+
+    @classmethod
+    def load(cls, filename):
+        if filename.endswith('.h5'):
+            return cls.from_h5(filename)
+
+        if filename.endswith('.npz'):
+            return cls.from_npz(filename)
+
+        return cls.from_yaml(filename)
+
+    def forward(self, x):
+        """Raw network output for one input (num_inputs,) or a batch (N, num_inputs)."""
+
+        a = np.asarray(x, dtype=float)
+
+        for W, b, activation in self.layers:
+            a = activation(a.dot(W) + b)
+
+        return a
+
+    def predict(self, observation):
+        """Steering input in degrees for one lidar scan or a batch of scans.
+
+        Returns a scalar for a single (single-output) scan and an (N,)
+        array for a batch of N scans.
+        """
+
+        # the network output in [-1, 1] is scaled to the steering range of the simulator
+        delta = MAX_TURNING_INPUT * self.forward(normalize(np.asarray(observation, dtype=float)))
+
+        if self.num_outputs == 1:
+            delta = delta[..., 0][()]
+
+        return delta
+
+    __call__ = predict
@@ -1,20 +1,16 @@
 from Car import World
 import numpy as np
 import random
-from keras import models
+from controller import MLPController
 import matplotlib.pyplot as plt
 import sys
 
-def normalize(s):
-    mean = [2.5]
-    spread = [5.0]
-    return (s - mean) / spread
-
 def main(argv):
 
     input_filename = argv[0]
     
-    model = models.load_model(input_filename)
+    # .yml (from h5_to_yaml.py) or .h5 controller, evaluated with NumPy
+    controller = MLPController.load(input_filename)
 
     numTrajectories = 100
 
@@ -28,7 +24,7 @@ def main(argv):
     time_step = 0.1
 
     lidar_field_of_view = 115
-    lidar_num_rays = model.get_layer(index=0).input_shape[1]
+    lidar_num_rays = controller.num_inputs
 
     # Change this to 0.1 or 0.2 to generate Figure 3 or 5 in the paper, respectively
     lidar_noise = 0.2
@@ -59,9 +55,7 @@ def main(argv):
 
         for e in range(episode_length):
 
-            observation = normalize(observation)
-
-            delta = 15 * model.predict(observation.reshape(1,len(observation)))
+            delta = controller.predict(observation)
 
             observation, reward, done, info = w.step(delta, throttle)
 
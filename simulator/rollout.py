@@ -0,0 +1,232 @@
+'''
+Parallel Monte Carlo rollouts of a controller in the hallway simulator.
+
+Episodes are split into shards that run on a pool of worker processes.
+Each worker loads the controller and builds its World once and reuses
+it through reset(); each shard seeds the simulator RNG from its own
+stream (derived from the campaign seed and the shard id), so results do
+not depend on the number of workers or the scheduling order.
+
+Per-episode results (crash flag, crash step, reward, minimum clearance)
+are streamed back to the parent as shards finish and aggregated in
+constant memory; trajectories are only kept when asked for.
+
+Example usage:
+
+python rollout.py ../dnns/TD3_L21_64x64_C1.yml 1000000 --workers 32 --output results.jsonl
+
+'''
+
+from Car import World, CRASH_REWARD, SAFE_DISTANCE
+from controller import MLPController
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import argparse
+import json
+import math
+import os
+import sys
+
+# per-process state, set up once by _initWorker
+_worker = {}
+
+def _initWorker(controllerFile, worldArgs, worldKwargs):
+    _worker['controller'] = MLPController.load(controllerFile)
+    _worker['world'] = World(*worldArgs, **worldKwargs)
+
+def wallClearance(w):
+    """Distance to the closest wall, measured like the crash check in World.step:
+    the car crashes when the clearance drops below SAFE_DISTANCE."""
+
+    width = w.hallWidths[w.curHall]
+
+    # the inner corner of the turn is reached when both distances exceed the hallway width
+    corner = max(width - w.car_dist_s, width - w.car_dist_f)
+
+    return min(w.car_dist_s, w.car_dist_f, corner)
+
+def _runShard(shard, firstEpisode, numEpisodes, seed, throttle, recordTrajectories):
+
+    np.random.seed(np.random.SeedSequence(seed, spawn_key=(shard,)).generate_state(4))
+
+    w = _worker['world']
+    controller = _worker['controller']
+
+    results = []
+
+    for episode in range(firstEpisode, firstEpisode + numEpisodes):
+
+        observation = w.reset()
+
+        rew = 0
+        crash = False
+        crashStep = -1
+        minClearance = wallClearance(w)
+
+        for e in range(w.episode_length):
+
+            delta = controller.predict(observation)
+
+            observation, reward, done, info = w.step(delta, throttle)
+
+            minClearance = min(minClearance, wallClearance(w))
+
+            if done:
+
+                if reward == CRASH_REWARD:
+                    crash = True
+                    crashStep = e
+
+                break
+
+            rew += reward
+
+        result = {'episode': episode, 'crash': crash, 'crash_step': crashStep,\
+                  'reward': float(rew), 'min_clearance': float(minClearance)}
+
+        if recordTrajectories:
+            result['x'] = [float(x) for x in w.allX]
+            result['y'] = [float(y) for y in w.allY]
+
+        results.append(result)
+
+    return results
+
+def runRollouts(controllerFile, numEpisodes, worldArgs, worldKwargs = {}, numWorkers = None,\
+                shardSize = 1000, seed = 0, throttle = 16, recordTrajectories = False):
+    """Runs numEpisodes episodes in parallel and yields one result dictionary per
+    episode, shard by shard, in completion order.
+
+    At most two shards per worker are in flight at any time, so memory stays
+    flat no matter how many episodes are requested.
+    """
+
+    if numWorkers is None:
+        numWorkers = os.cpu_count()
+
+    shards = [(shard, first, min(shardSize, numEpisodes - first))\
+              for shard, first in enumerate(range(0, numEpisodes, shardSize))]
+    shards.reverse()
+
+    with ProcessPoolExecutor(max_workers=numWorkers, initializer=_initWorker,\
+                             initargs=(controllerFile, worldArgs, worldKwargs)) as pool:
+
+        pending = set()
+
+        while shards or pending:
+
+            while shards and len(pending) < 2 * numWorkers:
+                shard, first, num = shards.pop()
+                pending.add(pool.submit(_runShard, shard, first, num, seed, throttle, recordTrajectories))
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                for result in future.result():
+                    yield result
+
+class CrashStatistics:
+    """Streaming summary of rollout results."""
+
+    def __init__(self):
+        self.numEpisodes = 0
+        self.numCrashes = 0
+        self.rewardMean = 0.0
+        self.rewardM2 = 0.0
+        self.minClearance = float('inf')
+        self.crashSteps = {}
+
+    def update(self, result):
+        self.numEpisodes += 1
+
+        # Welford's update of the reward mean and variance
+        delta = result['reward'] - self.rewardMean
+        self.rewardMean += delta / self.numEpisodes
+        self.rewardM2 += delta * (result['reward'] - self.rewardMean)
+
+        self.minClearance = min(self.minClearance, result['min_clearance'])
+
+        if result['crash']:
+            self.numCrashes += 1
+            self.crashSteps[result['crash_step']] = self.crashSteps.get(result['crash_step'], 0) + 1
+
+    def crashRate(self, z = 1.96):
+        """Crash rate with its Wilson score interval (95% by default)."""
+
+        n = self.numEpisodes
+        if n == 0:
+            return (0.0, 0.0, 1.0)
+
+        p = self.numCrashes / float(n)
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        halfWidth = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+
+        return (p, max(0.0, center - halfWidth), min(1.0, center + halfWidth))
+
+    def summary(self):
+        rate, lb, ub = self.crashRate()
+        std = math.sqrt(self.rewardM2 / self.numEpisodes) if self.numEpisodes > 0 else 0.0
+
+        lines = ['number of episodes: ' + str(self.numEpisodes),
+                 'number of crashes: ' + str(self.numCrashes),
+                 'crash rate: ' + str(rate) + ' (95% CI [' + str(lb) + ', ' + str(ub) + '])',
+                 'mean reward: ' + str(self.rewardMean) + ' (std ' + str(std) + ')',
+                 'min clearance: ' + str(self.minClearance) + ' (safe distance ' + str(SAFE_DISTANCE) + ')']
+
+        if self.crashSteps:
+            lines.append('crash steps: ' + str(sorted(self.crashSteps.items())))
+
+        return '\n'.join(lines)
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("controller")                                # .yml or .h5 controller
+    parser.add_argument("episodes", type=int)                        # Number of episodes
+    parser.add_argument("--workers", default=None, type=int)         # Worker processes (default: all cores)
+    parser.add_argument("--shard_size", default=1000, type=int)      # Episodes per task sent to a worker
+    parser.add_argument("--seed", default=0, type=int)               # Campaign seed
+    parser.add_argument("--lidar_noise", default=0.2, type=float)    # Uniform lidar noise (m)
+    parser.add_argument("--missing_rays", default=5, type=int)       # Missing lidar rays (in the turn only)
+    parser.add_argument("--integrator", default="odeint")            # odeint, rk4 or exact
+    parser.add_argument("--output", default="")                      # JSON Lines file of per-episode results
+    parser.add_argument("--trajectories", action="store_true")       # Include x/y trajectories in the output
+    args = parser.parse_args(argv)
+
+    # same setup as plot_trajectories.py
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
+    turns = ['right', 'right', 'right', 'right']
+    car_dist_s = hallWidths[0]/2.0
+    car_dist_f = 9.9
+    car_heading = 0
+    episode_length = 70
+    time_step = 0.1
+
+    lidar_field_of_view = 115
+    lidar_num_rays = MLPController.load(args.controller).num_inputs
+
+    worldArgs = (hallWidths, hallLengths, turns,\
+                 car_dist_s, car_dist_f, car_heading,\
+                 episode_length, time_step, lidar_field_of_view,\
+                 lidar_num_rays, args.lidar_noise, args.missing_rays, True)
+
+    stats = CrashStatistics()
+
+    output = open(args.output, 'w') if args.output else None
+
+    try:
+        for result in runRollouts(args.controller, args.episodes, worldArgs, {'integrator': args.integrator},\
+                                  args.workers, args.shard_size, args.seed, recordTrajectories=args.trajectories):
+            stats.update(result)
+
+            if output is not None:
+                output.write(json.dumps(result) + '\n')
+    finally:
+        if output is not None:
+            output.close()
+
+    print(stats.summary())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
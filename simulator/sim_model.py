@@ -1,19 +1,15 @@
 from Car import World
 import numpy as np
 import random
-from keras import models
+from controller import MLPController
 import sys
 
-def normalize(s):
-    mean = [2.5]
-    spread = [5.0]
-    return (s - mean) / spread
-
 def main(argv):
 
     input_filename = argv[0]
     
-    model = models.load_model(input_filename)
+    # .yml (from h5_to_yaml.py) or .h5 controller, evaluated with NumPy
+    controller = MLPController.load(input_filename)
     
     hallWidths = [1.5, 1.5, 1.5, 1.5]
     hallLengths = [20, 20, 20, 20]
@@ -26,7 +22,7 @@ def main(argv):
     time = 0
 
     lidar_field_of_view = 115
-    lidar_num_rays = model.get_layer(index=0).input_shape[1]
+    lidar_num_rays = controller.num_inputs
     lidar_noise = 0
     missing_lidar_rays = 0
     
@@ -43,9 +39,7 @@ def main(argv):
     
     for e in range(episode_length):
 
-        observation = normalize(observation)
-        
-        delta = 15 * model.predict(observation.reshape(1,len(observation)))
+        delta = controller.predict(observation)
 
         delta = np.clip(delta, -15, 15)
         
@@ -0,0 +1,168 @@
+'''
+Always-on wall-clock accounting for the training loops.
+
+A Timer keeps a running total of seconds per phase and a set of counters
+(environment steps, updates, samples). Time is attributed either with a
+span,
+
+    with timer.span('env_step'):
+        state, reward, done, _ = env.step(action)
+
+or, inside a function whose phases follow each other, with laps: mark()
+starts the clock and every lap(name) adds the time since the previous
+mark or lap to name. A span or a lap costs about a microsecond, so they
+stay in the code for good.
+
+A phase timed inside another one is named after it, parent.child (e.g.
+the laps 'train.critic' inside the span 'train'), so that its time is not
+counted twice.
+
+report() returns one row of metrics for the interval since the previous
+report: the seconds spent in every phase, the fraction of wall-clock
+spent in every top-level phase (these add up to at most 1), the share of
+its parent's time spent in every nested phase, and every counter with
+its rate per second. MetricsWriter appends the rows to a .csv or .jsonl
+file (chosen by the extension).
+
+Example usage:
+
+timer = Timer(phases=['env_step', 'train'], counters=['env_steps'])
+...
+if timer.due(30):
+    metrics.write(timer.report(t=t))
+
+Works with Python 2 as well (for ../train_ddpg).
+'''
+
+from collections import OrderedDict
+import json
+import time
+import csv
+import os
+
+clock = getattr(time, 'perf_counter', time.time)
+
+class Span(object):
+    __slots__ = ['totals', 'name', 'start']
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.totals[self.name] += clock() - self.start
+
+class Timer(object):
+
+    def __init__(self, phases=(), counters=()):
+        """phases and counters are the names reported even before they are used (in this order)."""
+
+        self.totals = OrderedDict([(name, 0.) for name in phases])
+        self.counters = OrderedDict([(name, 0) for name in counters])
+        self.spans = {}
+
+        self.last_mark = clock()
+        self.last_report = self.last_mark
+        self.reported_totals = dict(self.totals)
+        self.reported_counters = dict(self.counters)
+
+    def span(self, name):
+        span = self.spans.get(name)
+
+        if span is None:
+            self.totals.setdefault(name, 0.)
+            span = self.spans[name] = Span(self.totals, name)
+
+        return span
+
+    def mark(self):
+        self.last_mark = clock()
+
+    def lap(self, name):
+        now = clock()
+
+        if name not in self.totals:
+            self.totals[name] = 0.
+
+        self.totals[name] += now - self.last_mark
+        self.last_mark = now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def due(self, interval):
+        """Whether interval seconds have passed since the last report."""
+
+        return clock() - self.last_report >= interval
+
+    def report(self, **fields):
+        """Metrics since the previous report, after the given extra fields (e.g. t=...)."""
+
+        now = clock()
+        elapsed = max(now - self.last_report, 1e-9)
+
+        row = OrderedDict([('time', time.time()), ('elapsed', elapsed)])
+        row.update(sorted(fields.items()))
+
+        seconds = OrderedDict([(name, total - self.reported_totals.get(name, 0.)) for name, total in self.totals.items()])
+
+        for name, phase_seconds in seconds.items():
+            row[name + '_s'] = phase_seconds
+
+            if '.' in name:
+                # share of the parent phase (of wall-clock if the parent is not timed)
+                parent = seconds.get(name.rsplit('.', 1)[0], elapsed)
+                row[name + '_share'] = phase_seconds / parent if parent > 0 else 0.
+            else:
+                row[name + '_frac'] = phase_seconds / elapsed
+
+        for name, total in self.counters.items():
+            row[name] = total
+            row[name + '_per_s'] = (total - self.reported_counters.get(name, 0)) / elapsed
+
+        self.last_report = now
+        self.reported_totals = dict(self.totals)
+        self.reported_counters = dict(self.counters)
+
+        return row
+
+    def summary(self, row):
+        """One line for the console: the rates and the top-level phases taking the most time."""
+
+        rates = [name[:-len('_per_s')] + '/s: ' + str(round(value, 1))
+                 for name, value in row.items() if name.endswith('_per_s')]
+        phases = sorted([(value, name[:-len('_frac')]) for name, value in row.items() if name.endswith('_frac')],
+                        reverse=True)
+
+        return ', '.join(rates + [name + ': ' + str(int(round(100 * frac))) + '%' for frac, name in phases if frac > 0])
+
+class MetricsWriter(object):
+    """Appends metric rows to filename, a .csv (columns fixed by the first row written to the file) or a .jsonl."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.jsonl = filename.endswith('.jsonl')
+        self.fields = None
+
+        # an existing csv (e.g. after a resume) keeps its columns
+        if not self.jsonl and os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'r') as f:
+                self.fields = next(csv.reader(f))
+
+    def write(self, row):
+        with open(self.filename, 'a') as f:
+            if self.jsonl:
+                f.write(json.dumps(row) + '\n')
+                return
+
+            writer = csv.writer(f)
+
+            if self.fields is None:
+                self.fields = list(row.keys())
+                writer.writerow(self.fields)
+
+            writer.writerow([row.get(name, '') for name in self.fields])
@@ -67,7 +67,13 @@ class ActorNetwork(object):
         # to action and action with respect to parameters of neural network.  The produce is negated to perform gradient ascent
         self.actor_gradients = tf.gradients(self.scaled_out, self.network_params, -self.action_gradient)
 
-        self.optimize = tf.keras.optimizers.Adam(self.learning_rate, clipnorm=1).apply_gradients(zip(self.actor_gradients, self.network_params))
+        # (the optimizer is shared with DDPG_Update.py)
+        self.optimizer = tf.keras.optimizers.Adam(self.learning_rate, clipnorm=1)
+        self.optimize = self.optimizer.apply_gradients(zip(self.actor_gradients, self.network_params))
+
+        # Keras models of both networks, to apply them to other tensors with the same weights (see DDPG_Update.py)
+        self.model = Model(inputs = self.inputs, outputs = self.scaled_out)
+        self.target_model = Model(inputs = self.target_inputs, outputs = self.target_scaled_out)
 
         self.num_trainable_vars = len(self.network_params) + len(self.target_network_params)
 
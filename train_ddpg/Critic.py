@@ -38,8 +38,9 @@ class CriticNetwork(object):
 
         # Define loss function, which is the mean squared error the target Q-value and the current estimate
         self.loss = tf.reduce_mean(tf.squared_difference(self.predicted_q_value, self.out))
-        # Use ADAM to perform gradient descent on the loss value
-        self.optimize = tf.train.AdamOptimizer(self.learning_rate).minimize(self.loss)
+        # Use ADAM to perform gradient descent on the loss value (the optimizer is shared with DDPG_Update.py)
+        self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
+        self.optimize = self.optimizer.minimize(self.loss, var_list=self.network_params)
 
         self.action_grads = tf.gradients(self.out, self.action)
 
@@ -73,26 +74,42 @@ class CriticNetwork(object):
     # Implement critic neural network that maps states and actions to a long-term reward
     def create_critic_network(self,nn_type):
 
-        init = tf.glorot_uniform_initializer()
-
         # First layer only uses states as input.  Action is integrated into second layer
         states = tf.placeholder(tf.float32, shape = [None, self.s_dim, 1])
         actions = tf.placeholder(tf.float32, shape = [None, self.a_dim])
 
-        h1 = tf.layers.conv1d(inputs = states, filters = 32, kernel_size=4, strides=1, activation=tf.nn.tanh, kernel_initializer = init, bias_initializer = init, kernel_constraint=tf.keras.constraints.max_norm(1), bias_constraint=tf.keras.constraints.max_norm(1))
+        return states, actions, self.q_value(nn_type, states, actions)
+
+    # Q values of the nn_type network for any states and actions tensors.  The variables are created by the first
+    # call (in create_critic_network) and shared by later ones, e.g. the fused update graph of DDPG_Update.py.
+    # They are resource variables: each call reads them where it is built, so a call inside a
+    # tf.control_dependencies block sees the updates the block waits for
+    def q_value(self, nn_type, states, actions):
+
+        with tf.variable_scope('critic_' + nn_type, reuse=tf.AUTO_REUSE, use_resource=True):
+
+            init = tf.glorot_uniform_initializer()
+
+            h1 = tf.layers.conv1d(inputs = states, filters = 32, kernel_size=4, strides=1, activation=tf.nn.tanh, kernel_initializer = init, bias_initializer = init, kernel_constraint=tf.keras.constraints.max_norm(1), bias_constraint=tf.keras.constraints.max_norm(1), name='h1')
+
+            h2 = tf.layers.conv1d(inputs = h1, filters = 64, kernel_size=4, strides=1, activation=tf.nn.tanh, kernel_initializer = init, bias_initializer = init, kernel_constraint=tf.keras.constraints.max_norm(1), bias_constraint=tf.keras.constraints.max_norm(1), name='h2')
 
-        h2 = tf.layers.conv1d(inputs = h1, filters = 64, kernel_size=4, strides=1, activation=tf.nn.tanh, kernel_initializer = init, bias_initializer = init, kernel_constraint=tf.keras.constraints.max_norm(1), bias_constraint=tf.keras.constraints.max_norm(1))
+            flattened = tf.layers.flatten(inputs = h2)
 
-        flattened = tf.layers.flatten(inputs = h2)
+            h3_w_states = tf.get_variable('h3_w_states', initializer=tf.random_uniform([flattened.shape[1], 64],minval = -1/math.sqrt(self.s_dim),maxval = 1/math.sqrt(self.s_dim)))
+            h3_w_actions = tf.get_variable('h3_w_actions', initializer=tf.random_uniform([self.a_dim, 64],minval = -1/math.sqrt(self.s_dim),maxval = 1/math.sqrt(self.s_dim)))
 
-        h3_w_states = tf.Variable(tf.random_uniform([flattened.shape[1], 64],minval = -1/math.sqrt(self.s_dim),maxval = 1/math.sqrt(self.s_dim)))
-        h3_w_actions = tf.Variable(tf.random_uniform([self.a_dim, 64],minval = -1/math.sqrt(self.s_dim),maxval = 1/math.sqrt(self.s_dim)))
+            h3_b = tf.get_variable('h3_b', initializer=tf.random_uniform([64],-1/math.sqrt(64),1/math.sqrt(64)))
+            h3_in = tf.matmul(flattened, h3_w_states) + tf.matmul(actions, h3_w_actions) + h3_b
+            h3 = tf.nn.relu(h3_in)
 
-        h3_b = tf.Variable(tf.random_uniform([64],-1/math.sqrt(64),1/math.sqrt(64)))
-        h3_in = tf.matmul(flattened, h3_w_states) + tf.matmul(actions, h3_w_actions) + h3_b
-        h3 = tf.nn.relu(h3_in)
+            # Final layer outputs the Q value prediction given the state, action pair.  Written out (with the variable
+            # names of tf.layers.dense) since the actions may be the output of the Keras actor: a tf.layers layer
+            # applied to them would try to add them to a Keras functional graph, evaluating the variables it reads
+            with tf.variable_scope('q'):
+                q_kernel = tf.get_variable('kernel', shape=[64, 1], initializer=init)
+                q_bias = tf.get_variable('bias', shape=[1], initializer=init)
 
-        # Final layer outputs the Q value prediction given the state, action pair
-        q_value = tf.layers.dense(inputs = h3, units = 1, kernel_initializer = init, bias_initializer = init)
+            q_value = tf.matmul(h3, q_kernel) + q_bias
 
-        return states, actions, q_value
+        return q_value
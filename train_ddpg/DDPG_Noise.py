@@ -2,6 +2,7 @@
 # the agent to experiment with different actions.
 
 import numpy as np
+from scipy.signal import lfilter
 
 class OUNoise:
 
@@ -26,3 +27,72 @@ class OUNoise:
         self.state = x + dx
 
         return self.state
+
+
+# Ornstein-Uhlenbeck noise for num_envs environments stepped together, one (num_envs, action_dimension) array per
+# call to noise().  Every environment follows the same process as OUNoise,
+#
+#   x[k] = (1 - theta) * x[k-1] + theta * mu + sigma * z[k],
+#
+# with the normal draws z taken from its own RandomState (seeded with seed).  The noise is generated in blocks of
+# block_size steps: for every block the zero-start path y[k] = (1 - theta) * y[k-1] + theta * mu + sigma * z[k]
+# (with y[-1] = 0) is computed for all environments at once with one linear filter.  Since x - y follows the
+# homogeneous recursion, each environment only keeps an anchor step k0 and the offset d = x[k0] - y[k0], and
+#
+#   x[k] = y[k] + (1 - theta)^(k - k0) * d,
+#
+# so a step is one array operation, and resetting some environments (to mu) only moves their anchors.
+class BatchedOUNoise:
+
+    def __init__(self, num_envs, action_dimension, mu=0, theta=0.2, sigma=0.5, block_size=1024, seed=None):
+        self.num_envs = num_envs
+        self.action_dimension = action_dimension
+        self.mu = mu
+        self.theta = theta
+        self.sigma = sigma
+        self.block_size = block_size
+        self.rng = np.random.RandomState(seed)
+
+        # decay[i] = (1 - theta)^i
+        self.decay = (1. - theta) ** np.arange(block_size + 1)
+
+        self.anchor = np.full(num_envs, -1, dtype=np.int64)
+        self.offset = np.empty((num_envs, action_dimension))
+
+        self._new_block()
+        self.reset()
+
+    def _new_block(self):
+        c = self.theta * self.mu + self.sigma * self.rng.randn(self.block_size, self.num_envs, self.action_dimension)
+        self.path = lfilter([1.], [1., -(1. - self.theta)], c, axis=0)
+        self.step = 0
+
+    # The last noise of every environment (mu right after a reset)
+    @property
+    def state(self):
+        prev = self.path[self.step - 1] if self.step > 0 else 0.
+
+        return prev + self.decay[self.step - 1 - self.anchor][:, None] * self.offset
+
+    # Resets the environments selected by the boolean mask (all by default) to mu
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+
+        prev = self.path[self.step - 1][mask] if self.step > 0 else 0.
+
+        self.offset[mask] = self.mu - prev
+        self.anchor[mask] = self.step - 1
+
+    # The next noise of every environment, a (num_envs, action_dimension) array
+    def noise(self):
+        if self.step == self.block_size:
+            # continue from the last noise, as the offset of a path starting at zero before the new block
+            self.offset = self.state
+            self.anchor[:] = -1
+            self._new_block()
+
+        x = self.path[self.step] + self.decay[self.step - self.anchor][:, None] * self.offset
+        self.step += 1
+
+        return x
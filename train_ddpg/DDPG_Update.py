@@ -0,0 +1,77 @@
+"""
+This class implements a whole DDPG update as one graph operation.
+
+The update of racing_ddpg.py used to be eight session calls per minibatch (target actor, target critic, critic
+step, actor prediction, action gradients, actor step and the two target updates) plus a Python loop building the
+Bellman targets.  Here the minibatch is fed once and a single sess.run computes, in this order:
+
+  1. the Bellman targets y = r + gamma * (1 - terminal) * Q'(s2, mu'(s2)) with the target networks
+  2. a critic Adam step on mean((y - Q(s, a))^2)
+  3. an actor step along the deterministic policy gradient dQ/da * dmu/dtheta, with the critic updated by 2
+  4. the soft updates of both target networks, with the networks updated by 2 and 3
+
+The order is enforced with control dependencies, which only order the reads created inside their blocks.  The
+critic's variables are resource variables (see Critic.q_value), so the critic built again in 3 reads the weights of
+2; the soft updates read both networks and their targets with read_value() inside their block.  The TF1 variables of
+the Keras actor are read through snapshots made when they were created, which is safe only because the actor is not
+changed before its own step.  check_update.py compares one fused update with the eight separate calls.
+
+The networks are not copied: the critic variables are shared through Critic.q_value, the actor's through its Keras
+models, and the optimizers are the ones of the ActorNetwork and CriticNetwork, so the separate train/predict
+methods of both classes keep working on the same weights.
+"""
+
+import tensorflow as tf
+import numpy as np
+
+class FusedUpdate:
+
+    def __init__(self, sess, actor, critic, gamma):
+        self.sess = sess
+
+        # The minibatch, fed once per update
+        self.states = tf.placeholder(tf.float32, [None, actor.s_dim, 1])
+        self.actions = tf.placeholder(tf.float32, [None, actor.a_dim])
+        self.rewards = tf.placeholder(tf.float32, [None, 1])
+        self.terminals = tf.placeholder(tf.float32, [None, 1])
+        self.next_states = tf.placeholder(tf.float32, [None, actor.s_dim, 1])
+
+        # 1. Bellman targets with terminal masking
+        target_q = critic.q_value('target', self.next_states, actor.target_model(self.next_states))
+        y = tf.stop_gradient(self.rewards + gamma * (1. - self.terminals) * target_q)
+
+        # 2. Critic step
+        self.q = critic.q_value('non_target', self.states, self.actions)
+        critic_loss = tf.reduce_mean(tf.squared_difference(y, self.q))
+        critic_step = critic.optimizer.minimize(critic_loss, var_list=critic.network_params)
+
+        # 3. Actor step, evaluated after the critic step as in the unfused update
+        with tf.control_dependencies([critic_step]):
+            policy_actions = actor.model(self.states)
+            action_gradients = tf.gradients(critic.q_value('non_target', self.states, policy_actions), policy_actions)[0]
+
+            # Negated to perform gradient ascent on Q; the critic is held fixed
+            actor_gradients = tf.gradients(policy_actions, actor.network_params, -tf.stop_gradient(action_gradients))
+            actor_step = actor.optimizer.apply_gradients(zip(actor_gradients, actor.network_params))
+
+        # 4. Soft target updates
+        with tf.control_dependencies([actor_step]):
+            target_updates = [target.assign(tf.multiply(param.read_value(), tau) +
+                                            tf.multiply(target.read_value(), 1. - tau))
+                              for params, targets, tau in [(actor.network_params, actor.target_network_params, actor.tau),
+                                                           (critic.network_params, critic.target_network_params, critic.tau)]
+                              for param, target in zip(params, targets)]
+
+        self.update = tf.group(*target_updates)
+
+    # Runs one update on the minibatch; returns the Q values of the (state, action) pairs before the update
+    def train(self, s_batch, a_batch, r_batch, t_batch, s2_batch):
+        q, _ = self.sess.run([self.q, self.update], feed_dict={
+            self.states: s_batch,
+            self.actions: a_batch,
+            self.rewards: np.reshape(r_batch, (-1, 1)),
+            self.terminals: np.reshape(t_batch, (-1, 1)).astype(np.float32),
+            self.next_states: s2_batch
+        })
+
+        return q
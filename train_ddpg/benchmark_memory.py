@@ -0,0 +1,97 @@
+'''
+Minibatch sampling latency of the array-backed ReplayBuffer in memory.py
+at 10^4, 10^5 and 10^6 stored transitions, compared with the previous
+deque-based buffer (random.sample over a deque plus list comprehensions).
+
+The transitions have the shapes racing_ddpg.py stores: (s_dim, 1)
+states, (1,) actions, scalar rewards and terminal flags. The deque
+buffer is only filled up to --max_deque entries since it needs several
+times more memory than the arrays.
+
+Example usage:
+
+python benchmark_memory.py --s_dim 21 --batch_size 64
+
+'''
+
+from memory import ReplayBuffer
+from collections import deque
+import numpy as np
+import argparse
+import random
+import timeit
+import sys
+
+class DequeReplayBuffer(object):
+    """The previous implementation of memory.ReplayBuffer, kept as a reference."""
+
+    def __init__(self, buffer_size, random_seed=123):
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.buffer = deque()
+        random.seed(random_seed)
+
+    def add(self, s, a, r, t, s2):
+        experience = (s, a, r, t, s2)
+        if self.count < self.buffer_size:
+            self.buffer.append(experience)
+            self.count += 1
+        else:
+            self.buffer.popleft()
+            self.buffer.append(experience)
+
+    def size(self):
+        return self.count
+
+    def sample_batch(self, batch_size):
+        batch = random.sample(self.buffer, min(self.count, batch_size))
+
+        s_batch = np.array([_[0] for _ in batch])
+        a_batch = np.array([_[1] for _ in batch])
+        r_batch = np.array([_[2] for _ in batch])
+        t_batch = np.array([_[3] for _ in batch])
+        s2_batch = np.array([_[4] for _ in batch])
+
+        return s_batch, a_batch, r_batch, t_batch, s2_batch
+
+def fill(buf, numEntries, s_dim):
+    states = np.random.uniform(-0.5, 0.5, (1000, s_dim, 1))
+
+    for i in range(numEntries):
+        buf.add(states[i % 1000], np.random.uniform(-1, 1, (1,)), 1.0, i % 70 == 69, states[(i + 1) % 1000])
+
+def sampleTime(buf, batch_size, repeat):
+    return min(timeit.repeat(lambda: buf.sample_batch(batch_size), number=100, repeat=repeat)) / 100
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--s_dim", default=21, type=int)             # Lidar rays
+    parser.add_argument("--batch_size", default=64, type=int)        # MINIBATCH_SIZE in racing_ddpg.py
+    parser.add_argument("--max_deque", default=100000, type=int)     # Largest deque buffer to fill
+    parser.add_argument("--repeat", default=5, type=int)
+    args = parser.parse_args(argv)
+
+    np.random.seed(0)
+
+    print('entries   deque (us/batch)   array (us/batch)   speedup')
+
+    for numEntries in [10 ** 4, 10 ** 5, 10 ** 6]:
+        buf = ReplayBuffer(numEntries)
+        fill(buf, numEntries, args.s_dim)
+        arrayTime = sampleTime(buf, args.batch_size, args.repeat)
+        del buf
+
+        if numEntries > args.max_deque:
+            print('%7d   %16s   %16.1f' % (numEntries, '-', arrayTime * 1e6))
+            continue
+
+        buf = DequeReplayBuffer(numEntries)
+        fill(buf, numEntries, args.s_dim)
+        dequeTime = sampleTime(buf, args.batch_size, args.repeat)
+        del buf
+
+        print('%7d   %16.1f   %16.1f   %6.1fx' % (numEntries, dequeTime * 1e6, arrayTime * 1e6, dequeTime / arrayTime))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
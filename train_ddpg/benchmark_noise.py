@@ -0,0 +1,56 @@
+'''
+Cost per environment tick of the exploration noise for N environments
+stepped together: N OUNoise generators (one np.random.randn per
+generator and tick) against one BatchedOUNoise (one array operation per
+tick, the normal draws and the OU filter done once per block).
+
+Example usage:
+
+python benchmark_noise.py --block_size 1024
+
+'''
+
+from DDPG_Noise import OUNoise, BatchedOUNoise
+import numpy as np
+import argparse
+import timeit
+import sys
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--action_dim", default=1, type=int)
+    parser.add_argument("--block_size", default=1024, type=int)
+    parser.add_argument("--repeat", default=5, type=int)
+    args = parser.parse_args(argv)
+
+    print('envs   OUNoise x N (us/tick)   BatchedOUNoise (us/tick)   speedup')
+
+    for num_envs in [1, 8, 64, 512]:
+        generators = [OUNoise(args.action_dim) for _ in range(num_envs)]
+        batched = BatchedOUNoise(num_envs, args.action_dim, block_size=args.block_size, seed=0)
+
+        # every tick: noise for all environments, then a reset of ~1% of them (episode ends)
+        mask = np.zeros(num_envs, dtype=bool)
+        mask[::100] = True
+
+        def separate():
+            noise = np.array([g.noise() for g in generators])
+            for i in np.nonzero(mask)[0]:
+                generators[i].reset()
+            return noise
+
+        def vectorized():
+            noise = batched.noise()
+            batched.reset(mask)
+            return noise
+
+        number = max(10, 20000 // num_envs)
+        separate_time = min(timeit.repeat(separate, number=number, repeat=args.repeat)) / number
+        batched_time = min(timeit.repeat(vectorized, number=number * 10, repeat=args.repeat)) / (number * 10)
+
+        print('%4d   %21.1f   %24.1f   %6.1fx' % (num_envs, separate_time * 1e6, batched_time * 1e6,
+                                                  separate_time / batched_time))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+'''
+Checks that DDPG_Update.FusedUpdate makes the same update as the eight
+session calls racing_ddpg.py used to make per minibatch (target actor,
+target critic, critic step, actor prediction, action gradients, actor
+step and the two target updates).
+
+For every step, both updates start from the same weights (and optimizer
+state) and get the same random minibatch; the weights of both networks
+and their targets must then agree. The fused update continues from its
+own result, so later steps also check the optimizer state it leaves.
+
+Example usage:
+
+python check_update.py --steps 5
+
+'''
+
+from Actor import ActorNetwork
+from Critic import CriticNetwork
+from DDPG_Update import FusedUpdate
+import tensorflow as tf
+import numpy as np
+import argparse
+import sys
+
+# as in racing_ddpg.py
+ACTOR_LEARNING_RATE = 1e-3
+CRITIC_LEARNING_RATE = 5e-4
+GAMMA = 0.99
+TAU = 0.001
+
+def separate_update(actor, critic, s_batch, a_batch, r_batch, t_batch, s2_batch):
+    """The update of racing_ddpg.py before DDPG_Update.py."""
+
+    target_q = critic.predict_target(s2_batch, actor.predict_target(s2_batch))
+    y = np.where(t_batch, r_batch, r_batch + GAMMA * target_q[:, 0])
+
+    predicted_q_value, _ = critic.train(s_batch, a_batch, np.reshape(y, (-1, 1)))
+
+    a_outs = actor.predict(s_batch)
+    grads = critic.action_gradients(s_batch, a_outs)
+    actor.train(s_batch, grads[0])
+
+    actor.update_target_network()
+    critic.update_target_network()
+
+    return predicted_q_value
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state_dim", default=21, type=int)      # Lidar rays
+    parser.add_argument("--batch_size", default=128, type=int)
+    parser.add_argument("--steps", default=5, type=int)
+    parser.add_argument("--tolerance", default=1e-5, type=float)  # Largest absolute difference allowed
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(args.seed)
+    tf.set_random_seed(args.seed)
+
+    with tf.Session() as sess:
+
+        actor = ActorNetwork(sess, args.state_dim, 1, np.array([15.0]), ACTOR_LEARNING_RATE, TAU)
+        critic = CriticNetwork(sess, args.state_dim, 1, CRITIC_LEARNING_RATE, TAU, actor.get_num_trainable_vars())
+        fused = FusedUpdate(sess, actor, critic, GAMMA)
+
+        sess.run(tf.global_variables_initializer())
+
+        # the networks, their targets and the optimizer states
+        variables = tf.global_variables()
+        weights = actor.network_params + actor.target_network_params + critic.network_params + \
+                  critic.target_network_params
+
+        worst = 0.
+
+        for step in range(args.steps):
+            s_batch = rng.uniform(0, 5, (args.batch_size, args.state_dim, 1)).astype(np.float32)
+            a_batch = rng.uniform(-15, 15, (args.batch_size, 1)).astype(np.float32)
+            r_batch = rng.randn(args.batch_size).astype(np.float32)
+            t_batch = rng.rand(args.batch_size) < 0.1
+            s2_batch = rng.uniform(0, 5, (args.batch_size, args.state_dim, 1)).astype(np.float32)
+
+            start = sess.run(variables)
+            start_weights = sess.run(weights)
+
+            q_separate = separate_update(actor, critic, s_batch, a_batch, r_batch, t_batch, s2_batch)
+            after_separate = sess.run(weights)
+
+            for v, value in zip(variables, start):
+                v.load(value, sess)
+
+            q_fused = fused.train(s_batch, a_batch, r_batch, t_batch, s2_batch)
+            after_fused = sess.run(weights)
+
+            differences = [('Q values', np.max(np.abs(q_separate - q_fused)))] + \
+                          [(v.name, np.max(np.abs(a - b))) for v, a, b in zip(weights, after_separate, after_fused)]
+
+            # how far the update moved the weights, so that agreement is not trivial
+            change = max([np.max(np.abs(a - b)) for a, b in zip(sess.run(weights), start_weights)])
+
+            name, difference = max(differences, key=lambda d: d[1])
+            worst = max(worst, difference)
+            print('step ' + str(step) + ': largest difference ' + str(difference) + ' (' + name + '), largest change ' +
+                  str(change))
+
+            if change == 0:
+                raise ValueError('the update did not change the weights')
+
+            if difference > args.tolerance:
+                raise ValueError('the fused update differs from the separate one in ' + name)
+
+        print('fused and separate updates agree (largest difference ' + str(worst) + ')')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
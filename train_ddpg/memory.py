@@ -1,52 +1,103 @@
 # The replay buffer class is responsible for storing transitions.
 
-from collections import deque
 import numpy as np
-import random 
 
 class ReplayBuffer(object):
 
-    # Construct the buffer using the deque structure
-    def __init__(self, buffer_size, random_seed=123):
+    # Construct the buffer. The storage arrays are allocated on the first add, when the
+    # shapes of the state and action are known. Actions and rewards are stored as float64 (as
+    # the previous deque-based buffer returned them) and terminals as bool, whatever the types
+    # of the first transition, so e.g. an int first reward does not truncate the later ones.
+    #
+    # Every observation is stored once: within an episode the next state of a transition is the
+    # state of the following one, so each transition only keeps the ids of its two states in a
+    # ring of observations. A state that differs from the previous next state (the start of a new
+    # episode, or any transition after one that was not added) is stored as a new observation.
+    # The ring holds obs_size observations (by default 10% more than buffer_size, as in
+    # ../train_td3/utils.py). Episodes of L steps need (L + 1) / L observations per transition, so
+    # the default keeps all buffer_size transitions for episodes of 10 steps or more. With shorter
+    # episodes the oldest transitions are dropped as soon as their state is overwritten in the
+    # ring, so sampled transitions are always intact, and the buffer keeps about
+    # obs_size * L / (L + 1) of them. obs_dtype (e.g. np.float16) overrides the type the observations are stored with; the
+    # sampled states keep it.
+    def __init__(self, buffer_size, random_seed=123, obs_size=None, obs_dtype=None):
 
         self.buffer_size = buffer_size
+        self.obs_size = buffer_size + buffer_size // 10 if obs_size is None else obs_size
+        self.obs_dtype = obs_dtype
         self.count = 0
-        self.buffer = deque()
-        random.seed(random_seed)
+        self.ptr = 0
+        self.buffer = None
+        self.rng = np.random.RandomState(random_seed)
 
-    # Add transition to buffer.  If buffer has no room, pop out oldest transition.
+        # total number of observations stored so far; observation id i is in slot i % obs_size
+        self.num_obs = 0
+        self.last_s2 = None
+
+    def _allocate(self, s, a, r, t):
+        obs_dtype = np.asarray(s).dtype if self.obs_dtype is None else self.obs_dtype
+
+        self.obs = np.empty((self.obs_size,) + np.shape(s), dtype=obs_dtype)
+        self.s_id = np.empty(self.buffer_size, dtype=np.int64)
+        self.s2_id = np.empty(self.buffer_size, dtype=np.int64)
+        self.buffer = [np.empty((self.buffer_size,) + np.shape(x), dtype=dtype)
+                       for x, dtype in ((a, np.float64), (r, np.float64), (t, bool))]
+
+    def _add_obs(self, obs):
+        self.obs[self.num_obs % self.obs_size] = obs
+        self.num_obs += 1
+
+        return self.num_obs - 1
+
+    # Add transition to buffer.  If buffer has no room, overwrite the oldest transition.
     def add(self, s, a, r, t, s2):
-        experience = (s, a, r, t, s2)
-        if self.count < self.buffer_size:
-            self.buffer.append(experience)
-            self.count += 1
+
+        if self.buffer is None:
+            self._allocate(s, a, r, t)
+
+        if self.last_s2 is not None and np.array_equal(s, self.last_s2):
+            self.s_id[self.ptr] = self.num_obs - 1
         else:
-            self.buffer.popleft()
-            self.buffer.append(experience)
+            self.s_id[self.ptr] = self._add_obs(s)
+
+        self.s2_id[self.ptr] = self._add_obs(s2)
+        self.last_s2 = np.array(s2)
+
+        for storage, x in zip(self.buffer, (a, r, t)):
+            storage[self.ptr] = x
+
+        self.ptr = (self.ptr + 1) % self.buffer_size
+        self.count = min(self.count + 1, self.buffer_size)
+
+        # drop the oldest transitions if their state has been overwritten in the observation ring
+        while self.count > 0 and self.s_id[(self.ptr - self.count) % self.buffer_size] < self.num_obs - self.obs_size:
+            self.count -= 1
 
     def size(self):
         return self.count
 
     # This function will be used to generate the minibatch of transitions.  The minibatch of transitons will be used to
     # update the Q-network in the "Experimentation and Evaluation" phase of the learning cycle.
+    # Transitions are drawn uniformly with replacement (duplicates within a minibatch are rare
+    # once the buffer is much larger than the batch), so sampling costs the same at any buffer size.
     def sample_batch(self, batch_size):
-        batch = []
 
         # If there is less than minibatch size number of transitions available, sample all transitions
         if self.count < batch_size:
-            batch = random.sample(self.buffer, self.count)
+            ind = self.rng.permutation(self.count)
         else:
-            batch = random.sample(self.buffer, batch_size)
+            ind = self.rng.randint(0, self.count, size=batch_size)
+
+        ind = (self.ptr - self.count + ind) % self.buffer_size
 
-        s_batch = np.array([_[0] for _ in batch])
-        a_batch = np.array([_[1] for _ in batch])
-        r_batch = np.array([_[2] for _ in batch])
-        t_batch = np.array([_[3] for _ in batch])
-        s2_batch = np.array([_[4] for _ in batch])
+        s_batch = self.obs[self.s_id[ind] % self.obs_size]
+        s2_batch = self.obs[self.s2_id[ind] % self.obs_size]
+        a_batch, r_batch, t_batch = [storage[ind] for storage in self.buffer]
 
         # Transition includes current state, action, reward, finished boolean, and next state
         return s_batch, a_batch, r_batch, t_batch, s2_batch
 
     def clear(self):
-        self.deque.clear()
         self.count = 0
+        self.ptr = 0
+        self.last_s2 = None
@@ -16,15 +16,21 @@ from memory import ReplayBuffer
 from Actor import ActorNetwork
 from Critic import CriticNetwork
 
+# Import the single-call DDPG update
+from DDPG_Update import FusedUpdate
+
 import sys
 sys.path.append('../simulator')
 #Import environment
 from Car import World
+from timing import Timer, MetricsWriter
 import gym
 from gym import spaces
 
 import matplotlib.pyplot as plt
+import argparse
 import math
+import os
 
 from keras.models import Sequential
 from keras.layers import Dense
@@ -57,6 +63,10 @@ LR_CYCLE = 100
 
 BUFFER_SIZE = 1000000
 
+# Observations kept for the BUFFER_SIZE transitions (see memory.py): all of them are kept while
+# the stored episodes last 10 steps or more on average
+OBS_BUFFER_SIZE = BUFFER_SIZE + BUFFER_SIZE // 10
+
 MINIBATCH_SIZE = 128
 
 EXPLORATION_SIZE = 200
@@ -79,6 +89,9 @@ LIDAR_NUM_RAYS = 21
 LIDAR_NOISE = 0.1 #m
 LIDAR_MISSING_RAYS = 0
 
+# Seconds between rows of the timing metrics file (written next to the model file)
+METRICS_EVERY = 30
+
 modelfile = 'tanh' + str(l1size) + 'x' + str(l2size) +\
             '_' + str(LIDAR_NUM_RAYS) + '_missing_' + str(LIDAR_MISSING_RAYS) + '.h5'
 
@@ -90,6 +103,9 @@ def normalize(s):
 # The train function implements the two-step learning cycle.
 def train(sess, env, actor, critic, RESTORE):
 
+    # One sess.run per minibatch for the whole update (built before the variables are initialized)
+    update = FusedUpdate(sess, actor, critic, GAMMA)
+
     sess.run(tf.global_variables_initializer())
     
     # Initialize random noise generator
@@ -100,7 +116,7 @@ def train(sess, env, actor, critic, RESTORE):
     critic.update_target_network()
 
     # Initialize replay buffER
-    replay_buffer = ReplayBuffer(BUFFER_SIZE, RANDOM_SEED)
+    replay_buffer = ReplayBuffer(BUFFER_SIZE, RANDOM_SEED, obs_size=OBS_BUFFER_SIZE)
 
     totSteps = 0
     
@@ -110,6 +126,11 @@ def train(sess, env, actor, critic, RESTORE):
     actor.learning_rate = MAX_ACTOR_LEARNING_RATE
     critic.learning_rate = MAX_CRITIC_LEARNING_RATE
 
+    # wall-clock per phase of the training loop
+    timer = Timer(phases=['select_action', 'env_step', 'buffer_add', 'sample', 'update', 'evaluation'],
+                  counters=['env_steps', 'updates', 'samples'])
+    metrics = MetricsWriter(os.path.splitext(modelfile)[0] + '_metrics.csv')
+
     for i in xrange(MAX_EPISODES):
 
         s = env.reset()
@@ -132,6 +153,8 @@ def train(sess, env, actor, critic, RESTORE):
         for j in xrange(MAX_EP_STEPS):
 
             totSteps += 1
+            timer.count('env_steps')
+            timer.mark()
 
             # Begin "Experimentation and Evaluation Phase"
             
@@ -145,6 +168,7 @@ def train(sess, env, actor, critic, RESTORE):
 
             # Constrain action
             a = np.clip(a, -15, 15)
+            timer.lap('select_action')
 
             # Take step with experimental action
             s2, r, terminal, info = env.step(np.reshape(a.T,newshape=(env.action_space.shape[0],)), CONST_THROTTLE)
@@ -154,43 +178,29 @@ def train(sess, env, actor, critic, RESTORE):
             #print("reward: " + str(r))
 
             s2 = normalize(s2)
+            timer.lap('env_step')
 
             # Add transition to replay buffer if not testing episode
             if i%100 is not 49 and i%100 is not 99:
                 replay_buffer.add(np.reshape(s, (actor.s_dim, 1)), np.reshape(a, (actor.a_dim,)), r,
                                   terminal, np.reshape(s2, (actor.s_dim, 1)))
+                timer.lap('buffer_add')
 
                 # Keep adding experience to the memory until
                 # there are at least minibatch size samples
                 if replay_buffer.size() > MEMORY_WARMUP:
                     s_batch, a_batch, r_batch, t_batch, s2_batch = replay_buffer.sample_batch(MINIBATCH_SIZE)
+                    timer.count('updates')
+                    timer.count('samples', MINIBATCH_SIZE)
+                    timer.lap('sample')
 
-                    # Find target estimate to use for updating the Q-function
-                    
-                    # Predict_traget function determines Q-value of next state
-                    target_q = critic.predict_target(s2_batch, actor.predict_target(s2_batch))
-
-                    # Complete target estimate (R(t+1) + Q(s(t+1),a(t+1)))
-                    y_i = []
-                    for k in xrange(MINIBATCH_SIZE):
-                        if t_batch[k]:
-                            y_i.append(r_batch[k])
-                        else:
-                            y_i.append(r_batch[k] + GAMMA * target_q[k])
-                            
-                    # Perform gradient descent to update critic
-                    predicted_q_value, _ = critic.train(s_batch, a_batch, np.reshape(y_i, (MINIBATCH_SIZE, 1)))
+                    # Bellman targets from the target networks, gradient descent on the critic, the "Learning"
+                    # phase moving the policy parameters in the direction of the deterministic policy gradient
+                    # and the target network updates, all in one session call (see DDPG_Update.py)
+                    predicted_q_value = update.train(s_batch, a_batch, r_batch, t_batch, s2_batch)
 
                     ep_ave_max_q += np.amax(predicted_q_value, axis = 0)
-
-                    # Perform "Learning" phase by moving policy parameters in direction of deterministic policy gradient
-                    a_outs = actor.predict(s_batch)
-                    grads = critic.action_gradients(s_batch, a_outs)
-                    actor.train(s_batch, grads[0])
-                    
-                    # Update target networks                    
-                    actor.update_target_network()
-                    critic.update_target_network()
+                    timer.lap('update')
 
             s = s2
             ep_reward += r
@@ -213,6 +223,7 @@ def train(sess, env, actor, critic, RESTORE):
                     optimizer = optimizers.RMSprop(lr=0.00025, rho=0.9, epsilon=1e-06)
                     kmodel.compile(loss="mse", optimizer=optimizer)
                     kmodel.save(modelfile)
+                    timer.lap('evaluation')
 
                 else:
                     print("Training")                   
@@ -221,9 +232,16 @@ def train(sess, env, actor, critic, RESTORE):
                 q_max_array.append(ep_ave_max_q / float(j))
 
                 print('Finished in ' + str(j) + ' steps')
+
+                if timer.due(METRICS_EVERY):
+                    row = timer.report(episode=i)
+                    metrics.write(row)
+                    print(timer.summary(row))
                 
                 break
                     
+    metrics.write(timer.report(episode=i))
+
     plt.plot(q_max_array)
     plt.xlabel('Episode Number')
     plt.ylabel('Max Q-Value')
@@ -243,21 +261,51 @@ def train(sess, env, actor, critic, RESTORE):
     kmodel.summary()
     kmodel.save(modelfile)
                 
+# Command line overrides of the parameters above, for sweeps (see ../train_td3/sweep.py)
+def parse_args():
+    global RANDOM_SEED, LIDAR_NUM_RAYS, l1size, l2size, modelfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", default=RANDOM_SEED, type=int)             # TensorFlow seed
+    parser.add_argument("--lidar_num_rays", default=LIDAR_NUM_RAYS, type=int)
+    parser.add_argument("--layer_sizes", default=[l1size, l2size], type=int, nargs=2)
+    parser.add_argument("--model_file", default="")                         # Keras .h5 output, "" uses the default name
+    parser.add_argument("--threads", default=0, type=int)                   # TensorFlow intra-op threads (0: TF default)
+    args = parser.parse_args()
+
+    RANDOM_SEED = args.seed
+    LIDAR_NUM_RAYS = args.lidar_num_rays
+    l1size, l2size = args.layer_sizes
+
+    if args.model_file != "":
+        modelfile = args.model_file
+    else:
+        modelfile = 'tanh' + str(l1size) + 'x' + str(l2size) +\
+                    '_' + str(LIDAR_NUM_RAYS) + '_missing_' + str(LIDAR_MISSING_RAYS) + '.h5'
+
+    return args
+
 # Begin program                
 def main():
 
-    numHalls = 4
-    hallWidth = 1.5
-    hallLength = 20
+    args = parse_args()
+
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
     turns = ['right', 'right', 'right', 'right']
-    car_dist_s = hallWidth/2.0
-    car_dist_f = hallLength/2.0
+    car_dist_s = hallWidths[0]/2.0
+    car_dist_f = hallLengths[0]/2.0
     car_heading = 0
     time_step = 0.1
+
+    config = tf.ConfigProto()
+    if args.threads > 0:
+        config.intra_op_parallelism_threads = args.threads
+        config.inter_op_parallelism_threads = 1
     
-    with tf.Session() as sess:
+    with tf.Session(config=config) as sess:
 
-        env = World(numHalls, hallWidth, hallLength, turns,\
+        env = World(hallWidths, hallLengths, turns,\
                     car_dist_s, car_dist_f, car_heading, MAX_EP_STEPS,\
                     time_step, LIDAR_FIELD_OF_VIEW, LIDAR_NUM_RAYS,\
                     lidar_noise = LIDAR_NOISE, lidar_missing_rays = LIDAR_MISSING_RAYS)
@@ -1,13 +1,14 @@
+import sys
+sys.path.append('../simulator')
+
 import copy
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from keras.models import Sequential
-from keras.layers import Dense
-from keras import optimizers
-from keras import models
+from export import export_actor
+from timing import Timer
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -30,14 +31,12 @@ class UnitNormClipper(object):
                         w.div_(torch.norm(w, 1).expand_as(w))                        
 
 class Actor(nn.Module):
-        def __init__(self, state_dim, action_dim, max_action):
+        def __init__(self, state_dim, action_dim, max_action, layer_sizes=(64, 64)):
                 super(Actor, self).__init__()
 
-                layer_size = 64
-                
-                self.l1 = nn.Linear(state_dim, layer_size)
-                self.l2 = nn.Linear(layer_size, layer_size)
-                self.l3 = nn.Linear(layer_size, action_dim)
+                self.l1 = nn.Linear(state_dim, layer_sizes[0])
+                self.l2 = nn.Linear(layer_sizes[0], layer_sizes[1])
+                self.l3 = nn.Linear(layer_sizes[1], action_dim)
 
                 # self.l1 = nn.Conv1d(1, 16, 4)
                 # self.l2 = nn.Conv1d(16, 16, 4)
@@ -133,6 +132,71 @@ class Critic(nn.Module):
                 return q1
 
 
+class StackedCritic(nn.Module):
+        """Critic with the twin Q networks stored as one stacked ensemble: the weights
+        of layer k of both heads form a (2, inputs, outputs) tensor, so each layer of
+        both heads is a single batched matmul (baddbmm).
+
+        Opt-in (TD3(stacked_critic=True)): on CPU it is measured slower than Critic
+        (see benchmark_critic.py). It loads Critic state dicts."""
+
+        num_heads = 2
+
+        def __init__(self, state_dim, action_dim):
+                super(StackedCritic, self).__init__()
+
+                layer_size = 256
+
+                # initialized as the separate nn.Linear heads used to be (Q1: l1..l3, Q2: l4..l6)
+                heads = [[nn.Linear(state_dim + action_dim, layer_size), nn.Linear(layer_size, layer_size),
+                          nn.Linear(layer_size, 1)] for _ in range(self.num_heads)]
+
+                self.weights = nn.ParameterList([
+                        nn.Parameter(torch.stack([head[k].weight.data.t() for head in heads])) for k in range(3)])
+                self.biases = nn.ParameterList([
+                        nn.Parameter(torch.stack([head[k].bias.data.unsqueeze(0) for head in heads])) for k in range(3)])
+
+
+        def heads(self, state, action, num_heads=num_heads):
+                """Q values of the first num_heads heads, a (num_heads, batch, 1) tensor."""
+
+                sa = torch.cat([state, action], 1)
+                q = sa.unsqueeze(0).expand(num_heads, -1, -1)
+
+                for k in range(3):
+                        q = torch.baddbmm(self.biases[k][:num_heads], q, self.weights[k][:num_heads])
+
+                        if k < 2:
+                                q = F.relu(q)
+
+                return q
+
+
+        def forward(self, state, action):
+                q = self.heads(state, action)
+
+                return q[0], q[1]
+
+
+        def Q1(self, state, action):
+                return self.heads(state, action, 1)[0]
+
+
+        def load_state_dict(self, state_dict, strict=True):
+                # state dicts saved with the separate heads (l1..l3 for Q1, l4..l6 for Q2) are stacked first
+                if "l1.weight" in state_dict:
+                        layers = [["l" + str(k + 1 + 3 * h) for h in range(self.num_heads)] for k in range(3)]
+
+                        stacked = {}
+                        for k, names in enumerate(layers):
+                                stacked["weights." + str(k)] = torch.stack([state_dict[name + ".weight"].t() for name in names])
+                                stacked["biases." + str(k)] = torch.stack([state_dict[name + ".bias"].unsqueeze(0) for name in names])
+
+                        state_dict = stacked
+
+                return super(StackedCritic, self).load_state_dict(state_dict, strict)
+
+
 class TD3(object):
         def __init__(
                 self,
@@ -143,14 +207,16 @@ class TD3(object):
                 tau=0.005,
                 policy_noise=0.2,
                 noise_clip=0.5,
-                policy_freq=2
+                policy_freq=2,
+                actor_layer_sizes=(64, 64),
+                stacked_critic=False
         ):
 
-                self.actor = Actor(state_dim, action_dim, max_action).to(device)
+                self.actor = Actor(state_dim, action_dim, max_action, actor_layer_sizes).to(device)
                 self.actor_target = copy.deepcopy(self.actor)
                 self.actor_optimizer = torch.optim.Adam(self.actor.parameters(), lr=3e-4)
 
-                self.critic = Critic(state_dim, action_dim).to(device)
+                self.critic = (StackedCritic if stacked_critic else Critic)(state_dim, action_dim).to(device)
                 self.critic_target = copy.deepcopy(self.critic)
                 self.critic_optimizer = torch.optim.Adam(self.critic.parameters(), lr=3e-4)
 
@@ -163,20 +229,35 @@ class TD3(object):
 
                 self.total_it = 0
 
+                # time spent in train(), by phase: train.sample, train.critic, ... (the trainer may share its own
+                # timer, timing the whole call as "train")
+                self.timer = Timer()
+
                 self.clipper = UnitNormClipper()
 
 
         def select_action(self, state):
-                
-                state = torch.FloatTensor(state.reshape(1, -1)).to(device)
-                return self.actor(state).cpu().data.numpy().flatten()
+                """Action for one state, or an (N, action_dim) array of actions for an (N, state_dim) batch."""
+
+                state = np.asarray(state)
+                batch = torch.FloatTensor(state.reshape(-1, state.shape[-1])).to(device)
+
+                with torch.no_grad():
+                        action = self.actor(batch).cpu().numpy()
+
+                return action if state.ndim > 1 else action.flatten()
 
 
         def train(self, replay_buffer, batch_size=100):
                 self.total_it += 1
+                self.timer.count("updates")
+                self.timer.count("samples", batch_size)
+                self.timer.mark()
 
-                # Sample replay buffer 
-                state, action, next_state, reward, not_done = replay_buffer.sample(batch_size)
+                # Sample replay buffer (a PrioritizedReplayBuffer also returns importance-sampling weights and indices)
+                batch = replay_buffer.sample(batch_size)
+                state, action, next_state, reward, not_done = batch[:5]
+                self.timer.lap("train.sample")
 
                 with torch.no_grad():
                         # Select action according to policy and add clipped noise
@@ -197,12 +278,20 @@ class TD3(object):
                 current_Q1, current_Q2 = self.critic(state, action)
 
                 # Compute critic loss
-                critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q)
+                if len(batch) == 5:
+                        critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q)
+                else:
+                        weights, ind = batch[5:]
+                        critic_loss = (weights * ((current_Q1 - target_Q) ** 2 + (current_Q2 - target_Q) ** 2)).mean()
+
+                        td_error = torch.max(torch.abs(current_Q1 - target_Q), torch.abs(current_Q2 - target_Q))
+                        replay_buffer.update_priorities(ind, td_error.detach().cpu().numpy())
 
                 # Optimize the critic
                 self.critic_optimizer.zero_grad()
                 critic_loss.backward()
                 self.critic_optimizer.step()
+                self.timer.lap("train.critic")
 
                 # Delayed policy updates
                 if self.total_it % self.policy_freq == 0:
@@ -217,6 +306,7 @@ class TD3(object):
 
                         # normalize actor weights and biases
                         self.actor.apply(self.clipper)
+                        self.timer.lap("train.actor")
 
                         # Update the frozen target models
                         for param, target_param in zip(self.critic.parameters(), self.critic_target.parameters()):
@@ -225,29 +315,41 @@ class TD3(object):
                         for param, target_param in zip(self.actor.parameters(), self.actor_target.parameters()):
                                 target_param.data.copy_(self.tau * param.data + (1 - self.tau) * target_param.data)
 
+                        self.timer.lap("train.target_update")
 
-        def save(self, filename):
 
-                kmodel = Sequential()
+        def save(self, filename):
 
-                kmodel.add(Dense(units=self.actor.l1.weight.shape[0], activation='tanh', weights = [self.actor.l1.weight.data.numpy().T, self.actor.l1.bias.data.numpy()], input_dim=self.actor.l1.weight.shape[1]))
-                kmodel.add(Dense(units=self.actor.l2.weight.shape[0], activation='tanh', weights = [self.actor.l2.weight.data.numpy().T, self.actor.l2.bias.data.numpy()]))
-                kmodel.add(Dense(units=1, activation = 'tanh', weights = [self.actor.l3.weight.data.numpy().T, self.actor.l3.bias.data.numpy()]))
-                optimizer = optimizers.RMSprop(lr=0.00025, rho=0.9, epsilon=1e-06)
-                kmodel.compile(loss="mse", optimizer=optimizer)
-                
-                kmodel.save(filename + str(self.actor.l1.weight.shape[0]) +\
-                                           'x' + str(self.actor.l2.weight.shape[0]) + '.h5')
+                # actor for Verisig and the simulator (.yml and .npz), named as the Keras .h5 files were
+                export_actor(self.actor, filename + str(self.actor.l1.weight.shape[0]) +\
+                             'x' + str(self.actor.l2.weight.shape[0]))
 
-                      
-                #torch.save(self.critic.state_dict(), filename + "_critic")
-                #torch.save(self.critic_optimizer.state_dict(), filename + "_critic_optimizer")
-                #torch.save(self.actor.state_dict(), filename + "_actor")
-                #torch.save(self.actor_optimizer.state_dict(), filename + "_actor_optimizer")
+                torch.save(self.state_dict(), filename + "_td3.pt")
 
 
         def load(self, filename):
-                self.critic.load_state_dict(torch.load(filename + "_critic"))
-                self.critic_optimizer.load_state_dict(torch.load(filename + "_critic_optimizer"))
-                self.actor.load_state_dict(torch.load(filename + "_actor"))
-                self.actor_optimizer.load_state_dict(torch.load(filename + "_actor_optimizer"))
+                self.load_state_dict(torch.load(filename + "_td3.pt", map_location=device))
+
+
+        def state_dict(self):
+                """Everything train() depends on: the networks, their targets, the optimizers and total_it."""
+
+                return {
+                        "actor": self.actor.state_dict(),
+                        "actor_target": self.actor_target.state_dict(),
+                        "actor_optimizer": self.actor_optimizer.state_dict(),
+                        "critic": self.critic.state_dict(),
+                        "critic_target": self.critic_target.state_dict(),
+                        "critic_optimizer": self.critic_optimizer.state_dict(),
+                        "total_it": self.total_it,
+                }
+
+
+        def load_state_dict(self, state):
+                self.actor.load_state_dict(state["actor"])
+                self.actor_target.load_state_dict(state["actor_target"])
+                self.actor_optimizer.load_state_dict(state["actor_optimizer"])
+                self.critic.load_state_dict(state["critic"])
+                self.critic_target.load_state_dict(state["critic_target"])
+                self.critic_optimizer.load_state_dict(state["critic_optimizer"])
+                self.total_it = state["total_it"]
@@ -0,0 +1,74 @@
+'''
+CPU cost of TD3.StackedCritic (both heads of a layer in one baddbmm)
+against the default TD3.Critic (two chains of separate nn.Linear layers),
+for the critic and actor updates of TD3.train.
+
+The stacked critic is loaded from the state dict of the separate one, so
+both compute the same Q values; the benchmark checks that first.
+
+Example usage:
+
+python benchmark_critic.py --threads 1
+
+'''
+
+import torch
+import torch.nn.functional as F
+import argparse
+import timeit
+import sys
+
+import TD3
+
+def update(critic, state, action, target_Q):
+    """The critic loss and the actor loss (through Q1) of one TD3.train iteration, with their backward passes."""
+
+    current_Q1, current_Q2 = critic(state, action)
+    critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(current_Q2, target_Q)
+    critic_loss.backward()
+
+    actor_loss = -critic.Q1(state, action).mean()
+    actor_loss.backward()
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state_dim", default=21, type=int)     # Lidar rays
+    parser.add_argument("--threads", default=0, type=int)        # torch threads (0: torch default)
+    parser.add_argument("--repeat", default=5, type=int)
+    args = parser.parse_args(argv)
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+
+    separate = TD3.Critic(args.state_dim, 1)
+    stacked = TD3.StackedCritic(args.state_dim, 1)
+    stacked.load_state_dict(separate.state_dict())
+
+    state = torch.randn(64, args.state_dim)
+    action = torch.randn(64, 1)
+
+    for q_separate, q_stacked in zip(separate(state, action), stacked(state, action)):
+        if not torch.allclose(q_separate, q_stacked, atol=1e-5):
+            raise ValueError('stacked critic differs from the separate one')
+
+    print('torch threads: ' + str(torch.get_num_threads()))
+    print('batch   separate (us/update)   stacked (us/update)   speedup')
+
+    for batch_size in [100, 256, 512, 1024]:
+        state = torch.randn(batch_size, args.state_dim)
+        action = torch.randn(batch_size, 1)
+        target_Q = torch.randn(batch_size, 1)
+
+        separate_time = min(timeit.repeat(lambda: update(separate, state, action, target_Q),\
+                                          number=50, repeat=args.repeat)) / 50
+        stacked_time = min(timeit.repeat(lambda: update(stacked, state, action, target_Q),\
+                                         number=50, repeat=args.repeat)) / 50
+
+        print('%5d   %20.1f   %19.1f   %6.2fx' % (batch_size, separate_time * 1e6, stacked_time * 1e6,\
+                                                   separate_time / stacked_time))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
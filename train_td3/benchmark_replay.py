@@ -0,0 +1,68 @@
+'''
+Minibatch sampling cost of the uniform ReplayBuffer and the sum-tree
+PrioritizedReplayBuffer in utils.py, plus the priority update after each
+minibatch, as the buffers grow to 10^6 transitions.
+
+The buffers are filled with random episodes of 21-ray observations and
+random TD errors, so the priorities are spread out as during training.
+
+Example usage:
+
+python benchmark_replay.py --batch_size 256
+
+'''
+
+import numpy as np
+import torch
+import argparse
+import timeit
+import sys
+
+import utils
+
+def fill(buf, num_entries, state_dim, episode_length=70):
+    states = np.random.uniform(-0.5, 0.5, (episode_length + 1, state_dim))
+
+    for start in range(0, num_entries, episode_length):
+        num = min(episode_length, num_entries - start)
+
+        # one episode at a time, added as num environments of one step each
+        buf.add_batch(states[:num], np.random.uniform(-1, 1, (num, 1)), states[1:num + 1], np.ones(num), np.zeros(num),
+                      streams=np.arange(num) + 1)
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state_dim", default=21, type=int)         # Lidar rays
+    parser.add_argument("--batch_size", default=256, type=int)       # Batch size in racing.py
+    parser.add_argument("--repeat", default=5, type=int)
+    args = parser.parse_args(argv)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    print('entries   uniform sample (us)   prioritized sample (us)   priority update (us)')
+
+    for num_entries in [10 ** 4, 10 ** 5, 10 ** 6]:
+        uniform = utils.ReplayBuffer(args.state_dim, 1, num_entries, device=torch.device("cpu"))
+        fill(uniform, num_entries, args.state_dim)
+
+        uniform_time = min(timeit.repeat(lambda: uniform.sample(args.batch_size), number=100, repeat=args.repeat)) / 100
+        del uniform
+
+        prioritized = utils.PrioritizedReplayBuffer(args.state_dim, 1, num_entries, device=torch.device("cpu"))
+        fill(prioritized, num_entries, args.state_dim)
+        prioritized.update_priorities(np.arange(prioritized.size), np.random.exponential(size=prioritized.size))
+
+        batch = prioritized.sample(args.batch_size)
+        td_error = np.random.exponential(size=args.batch_size)
+
+        sample_time = min(timeit.repeat(lambda: prioritized.sample(args.batch_size), number=100, repeat=args.repeat)) / 100
+        update_time = min(timeit.repeat(lambda: prioritized.update_priorities(batch[6], td_error),\
+                                        number=100, repeat=args.repeat)) / 100
+        del prioritized
+
+        print('%7d   %19.1f   %23.1f   %20.1f' % (num_entries, uniform_time * 1e6, sample_time * 1e6, update_time * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,145 @@
+'''
+Background evaluation of TD3 actors during training.
+
+AsyncEvaluator runs a worker process with its own BatchedWorld of
+eval_episodes cars. submit() sends it a CPU snapshot of the actor
+weights (taken at submission, so training can keep updating the actor)
+and returns immediately; the worker runs all evaluation episodes as one
+batch, one actor forward pass per step for all cars, and sends back the
+average episode reward. poll() returns the results that are ready,
+in submission order, without blocking.
+
+Example usage (as in racing.py):
+
+evaluator = AsyncEvaluator(world_args, policy.actor, seed)
+evaluator.submit(t, policy.actor)
+for t, avg_reward in evaluator.poll():
+    evaluations.append(avg_reward)
+evaluator.close()
+
+'''
+
+import sys
+sys.path.append('../simulator')
+
+from Car import BatchedWorld
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import copy
+import queue
+
+# lidar normalization used for training and evaluation
+def normalize(s):
+    mean = [2.5]
+    spread = [5.0]
+    return (s - mean) / spread
+
+def rollout_batched(actor, env):
+    """Runs one episode per car of the BatchedWorld env, all cars stepped together.
+
+    A car stops collecting reward at its first terminal step; the batch runs
+    until every car has finished. Returns the (num_cars,) episode rewards and
+    whether each car lasted the whole episode without crashing.
+    """
+
+    state = normalize(env.reset())
+    total_reward = np.zeros(env.num_cars)
+    running = np.ones(env.num_cars, dtype=bool)
+    crashed = np.zeros(env.num_cars, dtype=bool)
+
+    while np.any(running):
+        with torch.no_grad():
+            action = actor(torch.FloatTensor(state)).numpy()
+
+        next_state, reward, done, _ = env.step(action[:, 0])
+        state = normalize(next_state)
+
+        total_reward[running] += reward[running]
+        crashed |= running & done & (env.cur_step < env.episode_length)
+        running &= ~done
+
+    return total_reward, ~crashed
+
+def eval_actor_batched(actor, env):
+    """Average reward of one episode per car of the BatchedWorld env (see rollout_batched)."""
+
+    return np.mean(rollout_batched(actor, env)[0])
+
+def evaluator(world_args, actor, eval_episodes, seed, snapshots, results):
+
+    torch.set_num_threads(1)
+
+    env = BatchedWorld(eval_episodes, *world_args)
+
+    while True:
+        snapshot = snapshots.get()
+
+        # None: the trainer is done
+        if snapshot is None:
+            break
+
+        t, actor_state = snapshot
+        actor.load_state_dict(actor_state)
+
+        # seeded by the training step, so evaluations do not depend on the ones before (e.g. across a resume)
+        np.random.seed([seed + 100, t])
+
+        results.put((t, eval_actor_batched(actor, env)))
+
+class AsyncEvaluator(object):
+
+    def __init__(self, world_args, actor, seed, eval_episodes=10):
+        self.eval_episodes = eval_episodes
+        self.pending = 0
+
+        self.snapshots = mp.Queue()
+        self.results = mp.Queue()
+
+        # the worker's own copy of the network; submit() only sends the weights
+        actor = copy.deepcopy(actor).cpu()
+
+        self.worker = mp.Process(target=evaluator,
+                                 args=(world_args, actor, eval_episodes, seed, self.snapshots, self.results))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, t, actor):
+        """Queues the evaluation of a snapshot of actor, labelled with the training step t."""
+
+        actor_state = dict([(k, v.detach().cpu().clone()) for k, v in actor.state_dict().items()])
+
+        self.snapshots.put((t, actor_state))
+        self.pending += 1
+
+    def _get(self, block):
+        t, avg_reward = self.results.get(block=block)
+        self.pending -= 1
+
+        print("---------------------------------------")
+        print("T: " + str(t) + " Evaluation over " + str(self.eval_episodes) + " episodes: " + str(avg_reward))
+        print("---------------------------------------")
+
+        return t, avg_reward
+
+    def poll(self):
+        """(t, average reward) of the evaluations finished since the last call."""
+
+        done = []
+
+        try:
+            while self.pending > 0:
+                done.append(self._get(False))
+        except queue.Empty:
+            pass
+
+        return done
+
+    def wait(self):
+        """Like poll, but waits for all submitted evaluations to finish."""
+
+        return [self._get(True) for _ in range(self.pending)]
+
+    def close(self):
+        self.snapshots.put(None)
+        self.worker.join()
@@ -0,0 +1,148 @@
+'''
+Exports a trained TD3 actor without Keras, in the formats used downstream:
+
+- YAML with the 'weights', 'offsets' and 'activations' dictionaries
+  indexed by layer (the format h5_to_yaml.py writes, read by Verisig and
+  by simulator/controller.py)
+- a compact .npz with one 'weights_<layer>' and 'offsets_<layer>' array
+  per layer and an 'activations' array (also read by controller.py)
+- optionally, a Keras .h5 file (a Sequential model of Dense layers, in the
+  layout Keras 2.3 saves, as the .h5 files in ../dnns); this only needs h5py
+
+The weights of each layer are stored as (neurons, inputs), as in the YAML
+files in ../dnns. The actor's max_action scaling is not part of the
+network: like the Keras models, the exported output is in [-1, 1].
+
+Example usage:
+
+python export.py ./checkpoints/TD3_racing_0 ../dnns/TD3_L21_64x64_C1 --h5
+
+'''
+
+import numpy as np
+import torch
+import argparse
+import json
+import os
+import sys
+
+def actor_layers(actor):
+    """(weights, offsets, activation) of the actor's layers l1, l2, l3, as float64 arrays."""
+
+    return [(layer.weight.detach().cpu().numpy().astype(float), layer.bias.detach().cpu().numpy().astype(float), 'Tanh')
+            for layer in [actor.l1, actor.l2, actor.l3]]
+
+def _yaml_list(values):
+    return '[' + ', '.join([repr(float(v)) for v in values]) + ']'
+
+def write_yaml(filename, layers):
+    """Writes layers in the flow style yaml.dump used for the files in ../dnns;
+    floats are written with repr, so they load back exactly."""
+
+    lines = ['activations: {' + ', '.join([str(i + 1) + ': ' + layer[2] for i, layer in enumerate(layers)]) + '}',
+             'offsets:']
+
+    for i, (weights, offsets, activation) in enumerate(layers):
+        lines.append('  ' + str(i + 1) + ': ' + _yaml_list(offsets))
+
+    lines.append('weights:')
+
+    for i, (weights, offsets, activation) in enumerate(layers):
+        lines.append('  ' + str(i + 1) + ':')
+        lines += ['  - ' + _yaml_list(row) for row in weights]
+
+    # written under a temporary name first, so readers never see a partial file
+    with open(filename + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    os.replace(filename + '.tmp', filename)
+
+def write_npz(filename, layers):
+    arrays = {'activations': np.array([layer[2] for layer in layers])}
+
+    for i, (weights, offsets, activation) in enumerate(layers):
+        arrays['weights_' + str(i + 1)] = weights
+        arrays['offsets_' + str(i + 1)] = offsets
+
+    with open(filename + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+
+    os.replace(filename + '.tmp', filename)
+
+def write_h5(filename, layers):
+    import h5py
+
+    names = ['dense_' + str(i + 1) for i in range(len(layers))]
+
+    config = []
+    for name, (weights, offsets, activation) in zip(names, layers):
+        layer = {'name': name, 'trainable': True, 'dtype': 'float32', 'units': weights.shape[0],
+                 'activation': activation.lower(), 'use_bias': True,
+                 'kernel_initializer': {'class_name': 'VarianceScaling',
+                                        'config': {'scale': 1.0, 'mode': 'fan_avg', 'distribution': 'uniform',
+                                                   'seed': None}},
+                 'bias_initializer': {'class_name': 'Zeros', 'config': {}},
+                 'kernel_regularizer': None, 'bias_regularizer': None, 'activity_regularizer': None,
+                 'kernel_constraint': None, 'bias_constraint': None}
+
+        if name == names[0]:
+            layer['batch_input_shape'] = [None, weights.shape[1]]
+
+        config.append({'class_name': 'Dense', 'config': layer})
+
+    with h5py.File(filename + '.tmp', 'w') as f:
+        f.attrs['keras_version'] = '2.3.1'
+        f.attrs['backend'] = 'tensorflow'
+        f.attrs['model_config'] = json.dumps({'class_name': 'Sequential',
+                                              'config': {'name': 'sequential_1', 'layers': config}})
+
+        model_weights = f.create_group('model_weights')
+        model_weights.attrs['keras_version'] = '2.3.1'
+        model_weights.attrs['backend'] = 'tensorflow'
+        model_weights.attrs['layer_names'] = [name.encode('utf-8') for name in names]
+
+        # Keras stores the kernel as (inputs, neurons), in float32
+        for name, (weights, offsets, activation) in zip(names, layers):
+            group = model_weights.create_group(name)
+            group.attrs['weight_names'] = [(name + '/kernel:0').encode('utf-8'), (name + '/bias:0').encode('utf-8')]
+
+            group.create_dataset(name + '/kernel:0', data=weights.T.astype(np.float32))
+            group.create_dataset(name + '/bias:0', data=offsets.astype(np.float32))
+
+    os.replace(filename + '.tmp', filename)
+
+def export_actor(actor, filename, h5=False):
+    """Writes filename.yml and filename.npz, and filename.h5 if h5 is set."""
+
+    layers = actor_layers(actor)
+
+    write_yaml(filename + '.yml', layers)
+    write_npz(filename + '.npz', layers)
+
+    if h5:
+        write_h5(filename + '.h5', layers)
+
+def load_actor(checkpoint, max_action=1.0):
+    """The actor saved in a checkpoint directory written by racing.py."""
+    import TD3
+
+    state = torch.load(os.path.join(checkpoint, 'policy.pt'), map_location='cpu')['actor']
+
+    actor = TD3.Actor(state['l1.weight'].shape[1], state['l3.weight'].shape[0], max_action,
+                      (state['l1.weight'].shape[0], state['l2.weight'].shape[0]))
+    actor.load_state_dict(state)
+
+    return actor
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checkpoint")                           # Checkpoint directory written by racing.py
+    parser.add_argument("output")                               # Output file name, without extension
+    parser.add_argument("--h5", action="store_true")            # Also write a Keras .h5 file
+    args = parser.parse_args(argv)
+
+    export_actor(load_actor(args.checkpoint), args.output, args.h5)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
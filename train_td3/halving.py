@@ -0,0 +1,231 @@
+'''
+Successive-halving (and Hyperband) search over racing.py hyperparameters.
+
+A bracket starts --configs random configurations of the SEARCH_SPACE
+below and trains them all to the first budget (environment steps), in
+parallel on the cores as sweep.py does. Each one is then evaluated on
+--eval_episodes episodes (the same start positions for every
+configuration, all episodes stepped as one batch) and only the best
+1/--eta continue, from their checkpoints, to the next budget, eta times
+larger, until --max_budget. With --hyperband, brackets starting at every
+budget are run one after the other, trading the number of configurations
+against how long each is trained before the first cut.
+
+Every evaluation is appended to <output>/results.jsonl (configuration,
+budget, average reward and the fraction of episodes the car finished
+without crashing); evaluations already there are not repeated, so an
+interrupted search can be started again. The best configuration's actor
+is exported to <output>/best.yml and <output>/best.npz.
+
+Example usage:
+
+python halving.py --configs 27 --eta 3 --min_budget 2e4 --max_budget 5.4e5 --threads 1
+
+'''
+
+import sys
+sys.path.append('../simulator')
+
+from Car import BatchedWorld, MAX_TURNING_INPUT
+import numpy as np
+import torch
+import argparse
+import json
+import math
+import os
+
+import export
+from evaluation import rollout_batched
+from sweep import Launcher, available_cores, job_environment, TD3_FOLDER
+
+# racing.py arguments searched over: ('uniform', low, high), ('log_uniform', low, high) or ('choice', values)
+SEARCH_SPACE = {
+    'expl_noise': ('uniform', 0.05, 0.4),
+    'policy_noise': ('uniform', 0.1, 0.4),
+    'noise_clip': ('uniform', 0.3, 0.6),
+    'tau': ('log_uniform', 1e-3, 2e-2),
+    'discount': ('choice', [0.95, 0.98, 0.99]),
+    'batch_size': ('choice', [64, 128, 256, 512]),
+    'policy_freq': ('choice', [1, 2, 3]),
+}
+
+# max_action of the racing environment
+MAX_ACTION = float(MAX_TURNING_INPUT)
+
+def sample_config(rng):
+    config = {}
+
+    for name in sorted(SEARCH_SPACE):
+        kind, values = SEARCH_SPACE[name][0], SEARCH_SPACE[name][1:]
+
+        if kind == 'uniform':
+            config[name] = float(rng.uniform(values[0], values[1]))
+        elif kind == 'log_uniform':
+            config[name] = float(np.exp(rng.uniform(np.log(values[0]), np.log(values[1]))))
+        else:
+            config[name] = values[0][rng.randint(len(values[0]))]
+
+    return config
+
+def budgets(min_budget, max_budget, eta):
+    """min_budget, eta * min_budget, ... up to max_budget (the last budget)."""
+
+    rungs = [min_budget]
+    while rungs[-1] * eta < max_budget:
+        rungs.append(rungs[-1] * eta)
+
+    if rungs[-1] < max_budget:
+        rungs.append(max_budget)
+
+    return [int(b) for b in rungs]
+
+def world_args(lidar_num_rays):
+    """The hallways and lidar of racing.py."""
+
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
+    turns = ['right', 'right', 'right', 'right']
+
+    return (hallWidths, hallLengths, turns, hallWidths[0]/2.0 - 0.1, 9.9, 0, 130, 0.1, 115, lidar_num_rays, 0.1, 0)
+
+class Search:
+
+    def __init__(self, args):
+        self.args = args
+        self.output = os.path.abspath(args.output)
+        self.results_file = os.path.join(self.output, 'results.jsonl')
+
+        # (name, budget) -> record, including the records of earlier runs
+        self.results = {}
+        if os.path.exists(self.results_file):
+            with open(self.results_file, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.results[(record['name'], record['budget'])] = record
+
+        self.cores = available_cores()
+        if args.max_jobs > 0:
+            self.cores = self.cores[:args.max_jobs * args.threads]
+
+        self.env = BatchedWorld(args.eval_episodes, *world_args(args.lidar_num_rays))
+
+    def checkpoint(self, name):
+        return os.path.join(self.output, 'runs', name, 'checkpoint')
+
+    def train(self, configs, budget):
+        """Trains (or continues) every configuration up to budget environment steps."""
+
+        launcher = Launcher(self.cores, self.args.threads, job_environment(self.args.threads),
+                            os.path.join(self.output, 'logs'))
+
+        for name, config in configs:
+            if (name, budget) in self.results:
+                continue
+
+            command = [sys.executable, os.path.join(TD3_FOLDER, 'racing.py'), '--seed', str(self.args.train_seed),
+                       '--lidar_num_rays', str(self.args.lidar_num_rays), '--threads', str(self.args.threads),
+                       '--max_timesteps', str(budget), '--save_model', '--checkpoint', self.checkpoint(name),
+                       '--resume'] + self.args.extra
+
+            for k in sorted(config):
+                command += ['--' + k, str(config[k])]
+
+            launcher.submit(name, [command], os.path.join(self.output, 'runs', name))
+
+        launcher.run()
+
+        return set([job['name'] for job in launcher.failed])
+
+    def evaluate(self, name, config, budget, failed):
+        if (name, budget) in self.results:
+            return self.results[(name, budget)]
+
+        if name in failed:
+            reward, completed = -np.inf, 0.0
+        else:
+            actor = export.load_actor(self.checkpoint(name), MAX_ACTION)
+
+            # the same start positions and lidar noise for every configuration
+            np.random.seed(self.args.eval_seed)
+            rewards, finished = rollout_batched(actor, self.env)
+            reward, completed = float(np.mean(rewards)), float(np.mean(finished))
+
+        record = {'name': name, 'budget': budget, 'reward': reward, 'completed': completed, 'config': config}
+        self.results[(name, budget)] = record
+
+        with open(self.results_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+        return record
+
+    def bracket(self, prefix, num_configs, rungs, rng):
+        """Successive halving of num_configs new configurations over the given budgets."""
+
+        configs = [(prefix + '_' + str(i), sample_config(rng)) for i in range(num_configs)]
+
+        for k, budget in enumerate(rungs):
+            print('--- ' + prefix + ': ' + str(len(configs)) + ' configurations to ' + str(budget) + ' steps')
+
+            failed = self.train(configs, budget)
+            records = [self.evaluate(name, config, budget, failed) for name, config in configs]
+            records.sort(key=lambda r: r['reward'], reverse=True)
+
+            for r in records:
+                print('  ' + r['name'] + ': reward ' + str(round(r['reward'], 2)) +
+                      ', completed ' + str(round(100 * r['completed'])) + '%')
+
+            if k + 1 < len(rungs):
+                keep = max(1, len(configs) // self.args.eta)
+                configs = [(r['name'], r['config']) for r in records[:keep]]
+
+        return records[0]
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs", default=27, type=int)            # Configurations in the (first) bracket
+    parser.add_argument("--eta", default=3, type=int)                 # 1/eta of the configurations continue, with eta times the budget
+    parser.add_argument("--min_budget", default=2e4, type=float)      # Environment steps of the first rung
+    parser.add_argument("--max_budget", default=5.4e5, type=float)    # Environment steps of the last rung
+    parser.add_argument("--hyperband", action="store_true")           # Run one bracket per starting budget
+    parser.add_argument("--lidar_num_rays", default=21, type=int)
+    parser.add_argument("--eval_episodes", default=20, type=int)
+    parser.add_argument("--eval_seed", default=100, type=int)
+    parser.add_argument("--train_seed", default=0, type=int)          # racing.py --seed of every configuration
+    parser.add_argument("--seed", default=0, type=int)                # Seed of the configuration sampling
+    parser.add_argument("--threads", default=1, type=int)             # Cores (and library threads) per job
+    parser.add_argument("--max_jobs", default=0, type=int)            # Jobs at a time (0: as many as the cores allow)
+    parser.add_argument("--output", default="./halving")
+    parser.add_argument("extra", nargs=argparse.REMAINDER)            # After --: more arguments for racing.py
+    args = parser.parse_args(argv)
+
+    args.extra = [a for a in args.extra if a != '--']
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    torch.set_num_threads(args.threads)
+
+    search = Search(args)
+    rng = np.random.RandomState(args.seed)
+    rungs = budgets(args.min_budget, args.max_budget, args.eta)
+
+    if args.hyperband:
+        # bracket s starts at rungs[s] and halves h = s_max - s times; with --configs in
+        # bracket 0, bracket s gets configs * (s_max + 1) / (h + 1) / eta^s configurations
+        s_max = len(rungs) - 1
+        brackets = [('b' + str(s), int(math.ceil(args.configs * float(s_max + 1) / (s_max - s + 1) / args.eta ** s)),
+                     rungs[s:]) for s in range(s_max + 1)]
+    else:
+        brackets = [('c', args.configs, rungs)]
+
+    best = max([search.bracket(prefix, num_configs, bracket_rungs, rng)
+                for prefix, num_configs, bracket_rungs in brackets], key=lambda r: r['reward'])
+
+    print('best: ' + best['name'] + ' ' + json.dumps(best['config']) + ', reward ' + str(round(best['reward'], 2)) +
+          ', completed ' + str(round(100 * best['completed'])) + '%')
+
+    export.export_actor(export.load_actor(search.checkpoint(best['name'])), os.path.join(args.output, 'best'))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
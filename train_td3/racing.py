@@ -1,7 +1,7 @@
 import sys
 sys.path.append('../simulator')
 
-from Car import World
+from Car import BatchedWorld
 import numpy as np
 import torch
 import gym
@@ -10,34 +10,18 @@ import os
 
 import utils
 import TD3
+from evaluation import normalize, AsyncEvaluator
+from timing import Timer, MetricsWriter
 
-def normalize(s):
-    mean = [2.5]
-    spread = [5.0]
-    return (s - mean) / spread
+# BatchedWorld state needed to continue the episodes in progress after a resume
+ENV_STATE = ["state", "curHall", "cur_step", "missing_indices"]
 
-# Runs policy for X episodes and returns average reward
-# A fixed seed is used for the eval environment
-def eval_policy(policy, env, seed, eval_episodes=10):
-    eval_env = env
-    #eval_env.seed(seed + 100)
+def get_env_state(env):
+    return dict([(k, np.copy(getattr(env, k))) for k in ENV_STATE])
 
-    avg_reward = 0.
-    for _ in range(eval_episodes):
-        state, done = eval_env.reset(), False
-
-        while not done:
-            action = policy.select_action(np.array(normalize(state)))
-            state, reward, done, _ = eval_env.step(action)
-            avg_reward += reward
-
-    avg_reward /= eval_episodes
-
-    print("---------------------------------------")
-    #print(f"Evaluation over {eval_episodes} episodes: {avg_reward:.3f}")
-    print("Evaluation over " + str(eval_episodes) + " episodes: " + str(avg_reward))
-    print("---------------------------------------")
-    return avg_reward
+def set_env_state(env, env_state):
+    for k in ENV_STATE:
+        setattr(env, k, np.copy(env_state[k]))
 
 
 if __name__ == "__main__":
@@ -49,15 +33,30 @@ if __name__ == "__main__":
     parser.add_argument("--start_timesteps", default=1e4, type=int) # Time steps initial random policy is used
     parser.add_argument("--eval_freq", default=5e3, type=int)       # How often (time steps) we evaluate
     parser.add_argument("--max_timesteps", default=1e5, type=int)   # Max time steps to run environment
-    parser.add_argument("--expl_noise", default=0.1)                # Std of Gaussian exploration noise
+    parser.add_argument("--expl_noise", default=0.1, type=float)    # Std of Gaussian exploration noise
     parser.add_argument("--batch_size", default=256, type=int)      # Batch size for both actor and critic
-    parser.add_argument("--discount", default=0.99)                 # Discount factor
-    parser.add_argument("--tau", default=0.005)                     # Target network update rate
-    parser.add_argument("--policy_noise", default=0.2)              # Noise added to target policy during critic update
-    parser.add_argument("--noise_clip", default=0.5)                # Range to clip target policy noise
+    parser.add_argument("--discount", default=0.99, type=float)     # Discount factor
+    parser.add_argument("--tau", default=0.005, type=float)         # Target network update rate
+    parser.add_argument("--policy_noise", default=0.2, type=float)  # Noise added to target policy during critic update
+    parser.add_argument("--noise_clip", default=0.5, type=float)    # Range to clip target policy noise
     parser.add_argument("--policy_freq", default=2, type=int)       # Frequency of delayed policy updates
     parser.add_argument("--save_model", action="store_true")        # Save model and optimizer parameters
     parser.add_argument("--load_model", default="")                 # Model load file name, "" doesn't load, "default" uses file_name
+    parser.add_argument("--num_envs", default=1, type=int)          # Cars simulated in lockstep (one BatchedWorld)
+    parser.add_argument("--utd_ratio", default=1.0, type=float)     # Gradient updates per environment step
+    parser.add_argument("--prioritized", action="store_true")       # Prioritized experience replay
+    parser.add_argument("--per_alpha", default=0.6, type=float)     # Priority exponent
+    parser.add_argument("--per_beta", default=0.4, type=float)      # Initial importance-sampling exponent (annealed to 1)
+    parser.add_argument("--checkpoint_freq", default=5e4, type=int) # How often (time steps) a full training checkpoint is written (0: never)
+    parser.add_argument("--checkpoint", default="")                 # Checkpoint directory, "" uses ./checkpoints/file_name
+    parser.add_argument("--resume", action="store_true")            # Continue from the checkpoint if there is one
+    parser.add_argument("--eval_episodes", default=10, type=int)    # Episodes per evaluation (run as one batch in the background)
+    parser.add_argument("--lidar_num_rays", default=21, type=int)   # Lidar rays (the observation size)
+    parser.add_argument("--layer_sizes", default=[64, 64], type=int, nargs=2) # Actor hidden layer sizes
+    parser.add_argument("--stacked_critic", action="store_true")    # Both critic heads as one batched matmul per layer (slower on CPU)
+    parser.add_argument("--threads", default=0, type=int)           # Torch intra-op threads (0: torch default)
+    parser.add_argument("--metrics_every", default=30., type=float) # Seconds between rows of the timing metrics file
+    parser.add_argument("--metrics_format", default="csv", choices=["csv", "jsonl"])
     args = parser.parse_args()
 
     #file_name = f"{args.policy}_{args.env}_{args.seed}"
@@ -73,6 +72,10 @@ if __name__ == "__main__":
     if args.save_model and not os.path.exists("./models"):
         os.makedirs("./models")
 
+    checkpoint = args.checkpoint if args.checkpoint != "" else "./checkpoints/" + file_name
+    if args.checkpoint_freq > 0 and not os.path.exists(os.path.dirname(os.path.abspath(checkpoint))):
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint)))
+
     hallWidths = [1.5, 1.5, 1.5, 1.5]
     hallLengths = [20, 20, 20, 20]
     turns = ['right', 'right', 'right', 'right']
@@ -84,19 +87,16 @@ if __name__ == "__main__":
     time = 0
 
     lidar_field_of_view = 115
-    lidar_num_rays = 21
+    lidar_num_rays = args.lidar_num_rays
     lidar_noise = 0.1 #m
     missing_lidar_rays = 0
     
-    env = World(hallWidths, hallLengths, turns,\
-                car_dist_s, car_dist_f, car_heading,\
-                episode_length, time_step, lidar_field_of_view,\
-                lidar_num_rays, lidar_noise, missing_lidar_rays)
-
-    test_env = World(hallWidths, hallLengths, turns,\
-                     car_dist_s, car_dist_f, car_heading,\
-                     episode_length, time_step, lidar_field_of_view,\
-                     lidar_num_rays, lidar_noise, missing_lidar_rays)    
+    world_args = (hallWidths, hallLengths, turns,\
+                  car_dist_s, car_dist_f, car_heading,\
+                  episode_length, time_step, lidar_field_of_view,\
+                  lidar_num_rays, lidar_noise, missing_lidar_rays)
+
+    env = BatchedWorld(args.num_envs, *world_args)
         
 
     #env = gym.make(args.env)
@@ -105,6 +105,9 @@ if __name__ == "__main__":
     #env.seed(args.seed)
     torch.manual_seed(args.seed)
     np.random.seed(args.seed)
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
     
     state_dim = env.observation_space.shape[0]
     action_dim = env.action_space.shape[0] 
@@ -124,6 +127,8 @@ if __name__ == "__main__":
         kwargs["policy_noise"] = args.policy_noise * max_action
         kwargs["noise_clip"] = args.noise_clip * max_action
         kwargs["policy_freq"] = args.policy_freq
+        kwargs["actor_layer_sizes"] = args.layer_sizes
+        kwargs["stacked_critic"] = args.stacked_critic
         policy = TD3.TD3(**kwargs)
     elif args.policy == "OurDDPG":
         policy = OurDDPG.DDPG(**kwargs)
@@ -133,62 +138,138 @@ if __name__ == "__main__":
     if args.load_model != "":
         policy_file = file_name if args.load_model == "default" else args.load_model
         #policy.load(f"./models/{policy_file}")
-        policy.load("./models/'" + str(policy_file))
+        policy.load("./models/" + str(policy_file))
+
+    if args.prioritized:
+        replay_buffer = utils.PrioritizedReplayBuffer(state_dim, action_dim, alpha=args.per_alpha, beta=args.per_beta)
+    else:
+        replay_buffer = utils.ReplayBuffer(state_dim, action_dim)
 
-    replay_buffer = utils.ReplayBuffer(state_dim, action_dim)
+    # evaluations run in a background process on snapshots of the actor
+    evaluator = AsyncEvaluator(world_args, policy.actor, args.seed, args.eval_episodes)
+
+    # wall-clock per phase, written next to the results; TD3.train splits "train" into train.sample,
+    # train.critic, train.actor and train.target_update
+    timer = Timer(phases=["select_action", "env_step", "buffer_add", "train", "train.sample", "train.critic",
+                          "train.actor", "train.target_update", "evaluation", "checkpoint"],
+                  counters=["env_steps", "updates", "samples"])
+    policy.timer = timer
+    metrics = MetricsWriter("./results/" + str(file_name) + "_metrics." + args.metrics_format)
     
-    # Evaluate untrained policy
-    evaluations = [eval_policy(policy, test_env, args.seed)]
+    if args.resume and utils.checkpoint_exists(checkpoint):
+        training = utils.load_checkpoint(checkpoint, policy, replay_buffer)
 
-    state, done = env.reset(), False
-    state = normalize(state)
-    episode_reward = 0
-    episode_timesteps = 0
-    episode_num = 0
+        set_env_state(env, training["env"])
+        evaluations, state, episode_reward, episode_num, t, updates_due, next_eval, next_checkpoint =\
+            [training[k] for k in ["evaluations", "state", "episode_reward", "episode_num", "t", "updates_due",
+                                   "next_eval", "next_checkpoint"]]
 
-    for t in range(int(args.max_timesteps)):
-        
-        episode_timesteps += 1
+        print("Resuming from " + checkpoint + " at T: " + str(t))
+    else:
+        # Evaluate untrained policy
+        evaluations = []
+        evaluator.submit(0, policy.actor)
+
+        # all cars are stepped together; t counts environment steps (num_envs per tick)
+        state = normalize(env.reset())
+        episode_reward = np.zeros(args.num_envs)
+        episode_num = 0
+
+        t = 0
+        updates_due = 0.
+        next_eval = args.eval_freq
+        next_checkpoint = args.checkpoint_freq
+
+    while t < int(args.max_timesteps):
 
         # Select action randomly or according to policy
-        if t < args.start_timesteps:
-            action = env.action_space.sample()
-        else:
-            action = (
-                policy.select_action(np.array(state))
-                + np.random.normal(0, max_action * args.expl_noise, size=action_dim)
-            ).clip(-max_action, max_action)
+        with timer.span("select_action"):
+            if t < args.start_timesteps:
+                action = np.random.uniform(-max_action, max_action, size=(args.num_envs, action_dim))
+            else:
+                action = (
+                    policy.select_action(state)
+                    + np.random.normal(0, max_action * args.expl_noise, size=(args.num_envs, action_dim))
+                ).clip(-max_action, max_action)
 
         # Perform action
-        next_state, reward, done, _ = env.step(action)
-        next_state = normalize(next_state)
-        done_bool = float(done) if episode_timesteps < env._max_episode_steps else 0
+        with timer.span("env_step"):
+            next_state, reward, done, _ = env.step(action[:, 0])
+            next_state = normalize(next_state)
+            done_bool = (done & (env.cur_step < env._max_episode_steps)).astype(float)
 
         # Store data in replay buffer
-        replay_buffer.add(state, action, next_state, reward, done_bool)
+        with timer.span("buffer_add"):
+            replay_buffer.add_batch(state, action, next_state, reward, done_bool)
 
         state = next_state
         episode_reward += reward
+        t += args.num_envs
+        timer.count("env_steps", args.num_envs)
+
+        # Train agent after collecting sufficient data, utd_ratio updates per environment step
+        if t > args.start_timesteps:
+            updates_due += args.utd_ratio * args.num_envs
+
+            if args.prioritized:
+                replay_buffer.beta = args.per_beta + (1. - args.per_beta) * min(1., float(t) / args.max_timesteps)
+
+            with timer.span("train"):
+                while updates_due >= 1:
+                    policy.train(replay_buffer, args.batch_size)
+                    updates_due -= 1
+
+        if np.any(done): 
+            for i in np.nonzero(done)[0]:
+                #print(f"Total T: {t+1} Episode Num: {episode_num+1} Episode T: {episode_timesteps} Reward: {episode_reward:.3f}")
+                print("Total T: " + str(t) + " Episode Num: " + str(episode_num+1) +
+                      " Episode T: " + str(env.cur_step[i]) +" Reward: " + str(episode_reward[i]))
+                episode_num += 1
+
+            # Reset the cars that finished
+            with timer.span("env_step"):
+                state[done] = normalize(env.reset(done))
+            episode_reward[done] = 0
+
+        # Evaluate episode (the results are collected below when they are ready)
+        # the time the trainer spends on evaluation: submitting snapshots, saving the model and waiting at checkpoints
+        with timer.span("evaluation"):
+            if t >= next_eval:
+                next_eval += args.eval_freq
+                evaluator.submit(t, policy.actor)
+                policy.save("./models/tanh_" +\
+                            str(env.observation_space.shape[0]) + "_m" + str(missing_lidar_rays) + '_')
+
+            # the checkpoint includes every evaluation submitted before it
+            checkpoint_due = args.checkpoint_freq > 0 and (t >= next_checkpoint or t >= int(args.max_timesteps))
+            finished = evaluator.wait() if checkpoint_due else evaluator.poll()
+
+            if finished:
+                evaluations += [avg_reward for _, avg_reward in finished]
+                np.save("./results/" + str(file_name), evaluations)
+
+        # Full checkpoint, also written when training ends
+        if checkpoint_due:
+            while next_checkpoint <= t:
+                next_checkpoint += args.checkpoint_freq
+
+            with timer.span("checkpoint"):
+                utils.save_checkpoint(checkpoint, policy, replay_buffer,
+                                      {"env": get_env_state(env), "evaluations": evaluations, "state": state,
+                                       "episode_reward": episode_reward, "episode_num": episode_num, "t": t,
+                                       "updates_due": updates_due, "next_eval": next_eval,
+                                       "next_checkpoint": next_checkpoint})
+
+        if timer.due(args.metrics_every):
+            row = timer.report(t=t)
+            metrics.write(row)
+            print("T: " + str(t) + " " + timer.summary(row))
+
+    finished = evaluator.wait()
+    if finished:
+        evaluations += [avg_reward for _, avg_reward in finished]
+        np.save("./results/" + str(file_name), evaluations)
+
+    evaluator.close()
 
-        # Train agent after collecting sufficient data
-        if t >= args.start_timesteps:
-            policy.train(replay_buffer, args.batch_size)
-
-        if done: 
-            # +1 to account for 0 indexing. +0 on ep_timesteps since it will increment +1 even if done=True
-            #print(f"Total T: {t+1} Episode Num: {episode_num+1} Episode T: {episode_timesteps} Reward: {episode_reward:.3f}")
-            print("Total T: " + str(t+1) + " Episode Num: " + str(episode_num+1) +
-                  " Episode T: " + str(episode_timesteps) +" Reward: " + str(episode_reward))
-            # Reset environment
-            state, done = env.reset(), False
-            episode_reward = 0
-            episode_timesteps = 0
-            episode_num += 1 
-
-        # Evaluate episode
-        if (t + 1) % args.eval_freq == 0:
-            evaluations.append(eval_policy(policy, test_env, args.seed))
-            np.save("./results/" + str(file_name), evaluations)
-            policy.save("./models/tanh_" +\
-                        str(env.observation_space.shape[0]) + "_m" + str(missing_lidar_rays) + '_')
-            
+    metrics.write(timer.report(t=t))
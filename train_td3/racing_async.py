@@ -0,0 +1,284 @@
+'''
+Asynchronous actor/learner TD3 training on the hallway simulator.
+
+Collector processes step their own BatchedWorld of --envs_per_collector
+cars with a local copy of the actor and push chunks of transitions
+through a queue. The learner (this process) adds them to the replay
+buffer and runs TD3.train continuously, publishing its actor weights to
+the collectors (through shared memory) every --sync_every updates.
+
+Every --report_every seconds the learner prints the environment steps
+and gradient updates per second and the staleness of the data it
+received: how many updates the learner had made past the weights that
+collected it. Evaluations run in a background process
+(evaluation.AsyncEvaluator, as in racing.py), so neither the learner nor
+the collectors stop for them.
+
+Example usage:
+
+python racing_async.py --collectors 4 --envs_per_collector 8 --max_timesteps 1e6
+
+'''
+
+import sys
+sys.path.append('../simulator')
+
+from Car import BatchedWorld
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import argparse
+import copy
+import queue
+import time
+import os
+
+import utils
+import TD3
+from evaluation import normalize, AsyncEvaluator
+
+def collector(worker_id, num_envs, world_args, shared_actor, actor_version, total_steps, start_timesteps,
+              expl_noise, chunk_length, transitions, stop, seed):
+
+    torch.set_num_threads(1)
+    torch.manual_seed(seed + worker_id)
+    np.random.seed(seed + worker_id)
+
+    env = BatchedWorld(num_envs, *world_args)
+    max_action = float(env.action_space.high[0])
+    action_dim = env.action_space.shape[0]
+
+    # transitions of car i are added to the replay buffer as stream worker_id * num_envs + i
+    streams = worker_id * num_envs + np.arange(num_envs)
+
+    actor = copy.deepcopy(shared_actor)
+    version = -1
+
+    state = normalize(env.reset())
+    episode_reward = np.zeros(num_envs)
+
+    while not stop.is_set():
+
+        # pick up the latest weights published by the learner
+        if actor_version.value != version:
+            with actor_version.get_lock():
+                version = actor_version.value
+                actor.load_state_dict(shared_actor.state_dict())
+
+        chunk = [[] for _ in range(5)]
+        episode_rewards = []
+
+        for step in range(chunk_length):
+
+            if total_steps.value < start_timesteps:
+                action = np.random.uniform(-max_action, max_action, size=(num_envs, action_dim))
+            else:
+                with torch.no_grad():
+                    action = actor(torch.FloatTensor(state)).numpy()
+
+                action = (action + np.random.normal(0, max_action * expl_noise, size=(num_envs, action_dim)))\
+                         .clip(-max_action, max_action)
+
+            next_state, reward, done, _ = env.step(action[:, 0])
+            next_state = normalize(next_state)
+            done_bool = (done & (env.cur_step < env._max_episode_steps)).astype(float)
+
+            for data, x in zip(chunk, (state, action, next_state, reward, done_bool)):
+                data.append(x)
+
+            state = next_state.copy()
+            episode_reward += reward
+
+            if np.any(done):
+                episode_rewards += list(episode_reward[done])
+                state[done] = normalize(env.reset(done))
+                episode_reward[done] = 0
+
+        with total_steps.get_lock():
+            total_steps.value += chunk_length * num_envs
+
+        transitions.put((streams, [np.array(data) for data in chunk], version, episode_rewards))
+
+def publish(policy, shared_actor, actor_version):
+    with actor_version.get_lock():
+        for param, shared_param in zip(policy.actor.parameters(), shared_actor.parameters()):
+            shared_param.data.copy_(param.data)
+
+        actor_version.value += 1
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", default=0, type=int)              # Sets PyTorch and Numpy seeds
+    parser.add_argument("--start_timesteps", default=1e4, type=int) # Time steps initial random policy is used
+    parser.add_argument("--eval_freq", default=5e4, type=int)       # How often (time steps) we evaluate
+    parser.add_argument("--max_timesteps", default=1e6, type=float) # Max time steps to run environment
+    parser.add_argument("--expl_noise", default=0.1, type=float)    # Std of Gaussian exploration noise
+    parser.add_argument("--batch_size", default=256, type=int)      # Batch size for both actor and critic
+    parser.add_argument("--discount", default=0.99, type=float)     # Discount factor
+    parser.add_argument("--tau", default=0.005, type=float)         # Target network update rate
+    parser.add_argument("--policy_noise", default=0.2, type=float)  # Noise added to target policy during critic update
+    parser.add_argument("--noise_clip", default=0.5, type=float)    # Range to clip target policy noise
+    parser.add_argument("--policy_freq", default=2, type=int)       # Frequency of delayed policy updates
+    parser.add_argument("--collectors", default=2, type=int)        # Collector processes
+    parser.add_argument("--envs_per_collector", default=8, type=int) # Cars per collector (one BatchedWorld)
+    parser.add_argument("--chunk_length", default=10, type=int)     # Steps per collector message
+    parser.add_argument("--sync_every", default=100, type=int)      # Updates between actor weight publications
+    parser.add_argument("--max_utd_ratio", default=1.0, type=float) # Learner waits for data above this many updates per step (0: never)
+    parser.add_argument("--report_every", default=10.0, type=float) # Seconds between throughput reports
+    parser.add_argument("--eval_episodes", default=10, type=int)    # Episodes per evaluation (run as one batch in the background)
+    parser.add_argument("--lidar_num_rays", default=21, type=int)   # Lidar rays (the observation size)
+    args = parser.parse_args()
+
+    file_name = 'TD3_racing_async_' + str(args.seed)
+
+    if not os.path.exists("./results"):
+        os.makedirs("./results")
+
+    if not os.path.exists("./models"):
+        os.makedirs("./models")
+
+    hallWidths = [1.5, 1.5, 1.5, 1.5]
+    hallLengths = [20, 20, 20, 20]
+    turns = ['right', 'right', 'right', 'right']
+    car_dist_s = hallWidths[0]/2.0 - 0.1
+    car_dist_f = 9.9
+    car_heading = 0
+    episode_length = 130
+    time_step = 0.1
+
+    lidar_field_of_view = 115
+    lidar_num_rays = args.lidar_num_rays
+    lidar_noise = 0.1 #m
+    missing_lidar_rays = 0
+
+    world_args = (hallWidths, hallLengths, turns,\
+                  car_dist_s, car_dist_f, car_heading,\
+                  episode_length, time_step, lidar_field_of_view,\
+                  lidar_num_rays, lidar_noise, missing_lidar_rays)
+
+    # only for the observation and action spaces; the collectors and the evaluator have their own worlds
+    env = BatchedWorld(1, *world_args)
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    state_dim = env.observation_space.shape[0]
+    action_dim = env.action_space.shape[0]
+    max_action = float(env.action_space.high[0])
+
+    policy = TD3.TD3(state_dim, action_dim, max_action, discount=args.discount, tau=args.tau,
+                     policy_noise=args.policy_noise * max_action, noise_clip=args.noise_clip * max_action,
+                     policy_freq=args.policy_freq)
+
+    replay_buffer = utils.ReplayBuffer(state_dim, action_dim)
+
+    # the collectors read the actor weights from shared CPU memory
+    shared_actor = copy.deepcopy(policy.actor).cpu()
+    shared_actor.share_memory()
+
+    actor_version = mp.Value('l', 0)
+    total_steps = mp.Value('l', 0)
+    stop = mp.Event()
+    transitions = mp.Queue(maxsize=4 * args.collectors)
+
+    collectors = [mp.Process(target=collector,
+                             args=(i, args.envs_per_collector, world_args, shared_actor, actor_version, total_steps,
+                                   args.start_timesteps, args.expl_noise, args.chunk_length, transitions, stop,
+                                   args.seed + 1))
+                  for i in range(args.collectors)]
+
+    for p in collectors:
+        p.start()
+
+    # number of learner updates at which each actor version was published
+    published_at = {0: 0}
+
+    # evaluations run in a background process on snapshots of the actor
+    evaluator = AsyncEvaluator(world_args, policy.actor, args.seed, args.eval_episodes)
+    evaluator.submit(0, policy.actor)
+
+    evaluations = []
+    next_eval = args.eval_freq
+
+    env_steps = 0
+    report_time = time.time()
+    report_steps = 0
+    report_updates = 0
+    staleness = []
+    episode_rewards = []
+
+    while env_steps < args.max_timesteps:
+
+        # wait for data until there is enough to train on, or while the learner is ahead of max_utd_ratio
+        warm = replay_buffer.size >= max(args.start_timesteps, args.batch_size)
+        throttled = args.max_utd_ratio > 0 and policy.total_it >= args.max_utd_ratio * env_steps
+
+        try:
+            while True:
+                streams, chunk, version, rewards = transitions.get(block=not warm or throttled, timeout=1.0)
+
+                for step in range(len(chunk[0])):
+                    replay_buffer.add_batch(*[data[step] for data in chunk], streams=streams)
+
+                env_steps += chunk[0].size // state_dim
+                staleness.append(policy.total_it - published_at[version])
+                episode_rewards += rewards
+
+                warm = replay_buffer.size >= max(args.start_timesteps, args.batch_size)
+                throttled = args.max_utd_ratio > 0 and policy.total_it >= args.max_utd_ratio * env_steps
+        except queue.Empty:
+            pass
+
+        if warm and not throttled:
+            policy.train(replay_buffer, args.batch_size)
+
+            if policy.total_it % args.sync_every == 0:
+                publish(policy, shared_actor, actor_version)
+                published_at[actor_version.value] = policy.total_it
+
+        if time.time() - report_time >= args.report_every:
+            elapsed = time.time() - report_time
+
+            print("env steps: " + str(env_steps) + ", updates: " + str(policy.total_it) +
+                  ", env steps/s: " + str(round((env_steps - report_steps) / elapsed, 1)) +
+                  ", updates/s: " + str(round((policy.total_it - report_updates) / elapsed, 1)) +
+                  ", staleness (updates): " + str(round(np.mean(staleness), 1) if staleness else 0) +
+                  ", episodes: " + str(len(episode_rewards)) +
+                  ", avg reward: " + str(round(np.mean(episode_rewards), 3) if episode_rewards else 0))
+
+            report_time = time.time()
+            report_steps = env_steps
+            report_updates = policy.total_it
+            staleness = []
+            episode_rewards = []
+
+        # Evaluate in the background (the learner and the collectors keep running meanwhile)
+        if env_steps >= next_eval:
+            next_eval += args.eval_freq
+            evaluator.submit(env_steps, policy.actor)
+            policy.save("./models/tanh_" + str(state_dim) + "_m" + str(missing_lidar_rays) + '_')
+
+        finished = evaluator.poll()
+        if finished:
+            evaluations += [avg_reward for _, avg_reward in finished]
+            np.save("./results/" + str(file_name), evaluations)
+
+    stop.set()
+
+    # the collectors may be blocked on a full queue
+    while any(p.is_alive() for p in collectors):
+        try:
+            transitions.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    for p in collectors:
+        p.join()
+
+    finished = evaluator.wait()
+    if finished:
+        evaluations += [avg_reward for _, avg_reward in finished]
+        np.save("./results/" + str(file_name), evaluations)
+
+    evaluator.close()
@@ -0,0 +1,231 @@
+'''
+Trains a grid of racing controllers in parallel, one process per job.
+
+A sweep is the product of the algorithms, lidar ray counts, hidden layer
+sizes and seeds given on the command line. Each job is named as the
+controllers in ../dnns, <ALG>_L<rays>_<h1>x<h2>_C<k>, where C<k> is the
+k-th seed of the list, and leaves <output>/<name>.h5 and <output>/<name>.yml:
+
+- TD3 jobs run racing.py with a checkpoint directory in <output>/runs and
+  then export.py on the final checkpoint (.yml, .npz and .h5)
+- DDPG jobs run ../train_ddpg/racing_ddpg.py (which saves the Keras .h5)
+  and then ../train_ddpg/h5_to_yaml.py, with --ddpg_python (TensorFlow 1)
+
+The jobs are scheduled on the available cores: each running job gets
+--threads cores of its own, its CPU affinity is set to them and its
+torch / TensorFlow / OpenMP / MKL thread pools are sized to match, so
+--threads x jobs never oversubscribes the CPU. Jobs whose .h5 and .yml
+already exist are skipped, so an interrupted sweep can be started again;
+TD3 jobs also resume from their last checkpoint. The output of each job
+goes to <output>/logs/<name>.log.
+
+Example usage:
+
+python sweep.py --algs TD3 --rays 21 41 61 --layers 64x64 128x128 --seeds 0 1 2 --threads 2
+
+'''
+
+import subprocess
+import argparse
+import time
+import sys
+import os
+
+TD3_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DDPG_FOLDER = os.path.join(os.path.dirname(TD3_FOLDER), 'train_ddpg')
+SIMULATOR_FOLDER = os.path.join(os.path.dirname(TD3_FOLDER), 'simulator')
+
+# environment variables sizing the thread pools of the libraries the jobs use
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+def run_name(alg, rays, layers, copy):
+    return alg + '_L' + str(rays) + '_' + str(layers[0]) + 'x' + str(layers[1]) + '_C' + str(copy)
+
+def parse_layers(layers):
+    h1, h2 = layers.split('x')
+
+    return int(h1), int(h2)
+
+def available_cores():
+    """The cores this process may run on (all of them where affinity is not supported)."""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+def job_commands(alg, rays, layers, seed, name, args):
+    """The commands of one job, run one after the other in <output>/runs/<name>."""
+
+    output = os.path.join(os.path.abspath(args.output), name)
+    layer_args = [str(layers[0]), str(layers[1])]
+
+    if alg == 'TD3':
+        checkpoint = os.path.join(os.path.abspath(args.output), 'runs', name, 'checkpoint')
+
+        return [[sys.executable, os.path.join(TD3_FOLDER, 'racing.py'), '--seed', str(seed),
+                 '--lidar_num_rays', str(rays), '--layer_sizes'] + layer_args +
+                ['--threads', str(args.threads), '--max_timesteps', str(args.max_timesteps),
+                 '--save_model', '--checkpoint', checkpoint, '--resume'] + args.extra,
+                [sys.executable, os.path.join(TD3_FOLDER, 'export.py'), checkpoint, output, '--h5']]
+
+    return [[args.ddpg_python, os.path.join(DDPG_FOLDER, 'racing_ddpg.py'), '--seed', str(seed),
+             '--lidar_num_rays', str(rays), '--layer_sizes'] + layer_args +
+            ['--threads', str(args.threads), '--model_file', output + '.h5'] + args.extra,
+            [args.ddpg_python, os.path.join(DDPG_FOLDER, 'h5_to_yaml.py'), output + '.h5', output + '.yml']]
+
+def job_environment(threads):
+    env = dict(os.environ)
+
+    for var in THREAD_VARIABLES:
+        env[var] = str(threads)
+
+    # racing.py and racing_ddpg.py find the simulator through a path relative to their working directory
+    env['PYTHONPATH'] = os.pathsep.join([SIMULATOR_FOLDER] + [p for p in [env.get('PYTHONPATH')] if p])
+    env['MPLBACKEND'] = 'Agg'
+
+    return env
+
+class Launcher:
+    """Runs jobs (lists of commands run in sequence) on disjoint blocks of cores."""
+
+    def __init__(self, cores, threads, env, logFolder, pollInterval = 1.0):
+        self.threads = threads
+        self.env = env
+        self.logFolder = logFolder
+        self.pollInterval = pollInterval
+
+        # one slot per block of threads cores
+        self.free = [cores[i:i + threads] for i in range(0, len(cores) - threads + 1, threads)]
+
+        if not self.free:
+            raise ValueError(str(threads) + ' threads per job, but only ' + str(len(cores)) + ' cores available')
+
+        self.queue = []
+        self.running = []
+        self.failed = []
+
+        if not os.path.exists(logFolder):
+            os.makedirs(logFolder)
+
+    def submit(self, name, commands, workdir):
+        self.queue.append({'name': name, 'commands': list(commands), 'workdir': workdir})
+
+    def _start(self, job, slot):
+        command = job['commands'].pop(0)
+        job['slot'] = slot
+
+        if not os.path.exists(job['workdir']):
+            os.makedirs(job['workdir'])
+
+        def pin():
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, slot)
+
+        with open(os.path.join(self.logFolder, job['name'] + '.log'), 'a') as log:
+            log.write('$ ' + ' '.join(command) + '\n')
+            log.flush()
+
+            job['process'] = subprocess.Popen(command, cwd=job['workdir'], env=self.env, stdout=log,\
+                                              stderr=subprocess.STDOUT, preexec_fn=pin)
+
+        if job not in self.running:
+            job['start'] = time.time()
+            self.running.append(job)
+
+    def poll(self):
+        """Starts queued jobs on free slots; returns the jobs that finished since the last call."""
+
+        finished = []
+
+        for job in list(self.running):
+            returncode = job['process'].poll()
+
+            if returncode is None:
+                continue
+
+            # the next command of the job keeps its slot
+            if returncode == 0 and job['commands']:
+                self._start(job, job['slot'])
+                continue
+
+            self.running.remove(job)
+            self.free.append(job['slot'])
+
+            job['returncode'] = returncode
+            job['runtime'] = time.time() - job['start']
+            finished.append(job)
+
+            if returncode != 0:
+                self.failed.append(job)
+
+        while self.queue and self.free:
+            self._start(self.queue.pop(0), self.free.pop(0))
+
+        return finished
+
+    def run(self):
+        while self.queue or self.running:
+            for job in self.poll():
+                status = 'done' if job['returncode'] == 0 else 'FAILED (exit code ' + str(job['returncode']) + ')'
+                print(job['name'] + ': ' + status + ' in ' + str(round(job['runtime'], 1)) + ' s, ' +
+                      str(len(self.queue) + len(self.running)) + ' jobs left')
+
+            time.sleep(self.pollInterval)
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algs", default=["TD3"], nargs="+", choices=["TD3", "DDPG"])
+    parser.add_argument("--rays", default=[21], type=int, nargs="+")         # Lidar ray counts
+    parser.add_argument("--layers", default=["64x64"], nargs="+")            # Hidden layer sizes, <h1>x<h2>
+    parser.add_argument("--seeds", default=[0], type=int, nargs="+")         # Seed of C1, C2, ...
+    parser.add_argument("--threads", default=1, type=int)                    # Cores (and library threads) per job
+    parser.add_argument("--max_jobs", default=0, type=int)                   # Jobs at a time (0: as many as the cores allow)
+    parser.add_argument("--max_timesteps", default=1e5, type=float)          # racing.py --max_timesteps
+    parser.add_argument("--output", default="./sweep")
+    parser.add_argument("--ddpg_python", default="python2")                  # Interpreter with TensorFlow 1 and Keras
+    parser.add_argument("--dry_run", action="store_true")                    # Print the jobs without running them
+    parser.add_argument("extra", nargs=argparse.REMAINDER)                   # After --: more arguments for every job
+    args = parser.parse_args(argv)
+
+    args.extra = [a for a in args.extra if a != '--']
+    args.max_timesteps = int(args.max_timesteps)
+
+    cores = available_cores()
+    if args.max_jobs > 0:
+        cores = cores[:args.max_jobs * args.threads]
+
+    launcher = Launcher(cores, args.threads, job_environment(args.threads), os.path.join(args.output, 'logs'))
+
+    for alg in args.algs:
+        for rays in args.rays:
+            for layers in [parse_layers(l) for l in args.layers]:
+                for copy, seed in enumerate(args.seeds):
+                    name = run_name(alg, rays, layers, copy + 1)
+
+                    if all([os.path.exists(os.path.join(args.output, name + ext)) for ext in ['.h5', '.yml']]):
+                        print(name + ': already trained')
+                        continue
+
+                    commands = job_commands(alg, rays, layers, seed, name, args)
+
+                    if args.dry_run:
+                        print(name + ':\n' + '\n'.join(['  ' + ' '.join(c) for c in commands]))
+                        continue
+
+                    launcher.submit(name, commands, os.path.join(os.path.abspath(args.output), 'runs', name))
+
+    print(str(len(launcher.queue)) + ' jobs, ' + str(len(launcher.free)) + ' at a time on ' +
+          str(len(cores)) + ' cores (' + str(args.threads) + ' per job)')
+
+    launcher.run()
+
+    if launcher.failed:
+        print('failed: ' + ', '.join([job['name'] for job in launcher.failed]))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
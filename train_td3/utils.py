@@ -1,40 +1,423 @@
-import numpy as np
-import torch
-
-
-class ReplayBuffer(object):
-	def __init__(self, state_dim, action_dim, max_size=int(1e6)):
-		self.max_size = max_size
-		self.ptr = 0
-		self.size = 0
-
-		self.state = np.zeros((max_size, state_dim))
-		self.action = np.zeros((max_size, action_dim))
-		self.next_state = np.zeros((max_size, state_dim))
-		self.reward = np.zeros((max_size, 1))
-		self.not_done = np.zeros((max_size, 1))
-
-		self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-
-	def add(self, state, action, next_state, reward, done):
-		self.state[self.ptr] = state
-		self.action[self.ptr] = action
-		self.next_state[self.ptr] = next_state
-		self.reward[self.ptr] = reward
-		self.not_done[self.ptr] = 1. - done
-
-		self.ptr = (self.ptr + 1) % self.max_size
-		self.size = min(self.size + 1, self.max_size)
-
-
-	def sample(self, batch_size):
-		ind = np.random.randint(0, self.size, size=batch_size)
-
-		return (
-			torch.FloatTensor(self.state[ind]).to(self.device),
-			torch.FloatTensor(self.action[ind]).to(self.device),
-			torch.FloatTensor(self.next_state[ind]).to(self.device),
-			torch.FloatTensor(self.reward[ind]).to(self.device),
-			torch.FloatTensor(self.not_done[ind]).to(self.device)
-		)
\ No newline at end of file
+import numpy as np
+import torch
+import pickle
+import shutil
+import os
+
+
+class ReplayBuffer(object):
+	"""Replay buffer stored as tensors on the training device.
+
+	Every observation is stored once: within an episode the next_state of
+	a transition is the state of the following one, so each transition
+	only keeps the ids of its state and next_state in a ring of
+	observations. A state that differs from the previous next_state (the
+	start of a new episode) is stored as a new observation. The ring holds
+	obs_size observations (by default 10% more than max_size, as in
+	../train_ddpg/memory.py). Episodes of L steps need (L + 1) / L
+	observations per transition, so the default keeps all max_size
+	transitions for episodes of 10 steps or more. With shorter episodes
+	the oldest transitions are dropped as soon as their state is
+	overwritten, so sampled transitions are always intact, and the buffer
+	keeps about obs_size * L / (L + 1) of them.
+
+	obs_dtype=torch.float16 halves the observation memory again, which the
+	normalized lidar scans tolerate; samples are always float32.
+
+	With share_memory=True the tensors stay on the CPU in shared memory,
+	so that other processes can read and write them without copies; the
+	sampled batches are then moved to the device.
+	"""
+	def __init__(self, state_dim, action_dim, max_size=int(1e6), device=None, share_memory=False,
+				 obs_size=None, obs_dtype=torch.float32):
+		self.max_size = max_size
+		self.obs_size = max_size + max_size // 10 if obs_size is None else obs_size
+		self.ptr = 0
+		self.size = 0
+
+		# total number of observations stored so far; observation id i is in slot i % obs_size
+		self.num_obs = 0
+
+		# previous next_state (and its id, -1 if none) of every environment stream adding transitions
+		self.last_next_state = np.zeros((0, state_dim))
+		self.last_next_id = np.zeros(0, dtype=np.int64)
+
+		if device is None:
+			device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+		self.device = device
+		self.storage_device = torch.device("cpu") if share_memory else device
+
+		self.obs = torch.zeros((self.obs_size, state_dim), dtype=obs_dtype, device=self.storage_device)
+		self.state_id = torch.zeros(max_size, dtype=torch.int64, device=self.storage_device)
+		self.next_state_id = torch.zeros(max_size, dtype=torch.int64, device=self.storage_device)
+		self.action = torch.zeros((max_size, action_dim), device=self.storage_device)
+		self.reward = torch.zeros((max_size, 1), device=self.storage_device)
+		self.not_done = torch.zeros((max_size, 1), device=self.storage_device)
+
+		if share_memory:
+			for storage in [self.obs, self.state_id, self.next_state_id, self.action, self.reward, self.not_done]:
+				storage.share_memory_()
+
+		# on the CPU, add() writes through NumPy views of the tensors, which is much cheaper per row
+		self.storage = [self.obs, self.state_id, self.next_state_id, self.action, self.reward, self.not_done]
+		if self.storage_device.type == "cpu":
+			self.storage = [storage.numpy() for storage in self.storage]
+
+
+	def _write(self, storage, ind, values):
+		if self.storage_device.type == "cpu":
+			storage[ind] = values
+		else:
+			storage[torch.as_tensor(ind, device=self.storage_device)] = torch.as_tensor(
+				np.asarray(values, dtype=np.float32), device=self.storage_device).to(storage.dtype)
+
+
+	def _track_streams(self, num_streams):
+		if num_streams > len(self.last_next_id):
+			num_new = num_streams - len(self.last_next_id)
+			self.last_next_state = np.concatenate([self.last_next_state, np.zeros((num_new, self.last_next_state.shape[1]))])
+			self.last_next_id = np.concatenate([self.last_next_id, np.full(num_new, -1, dtype=np.int64)])
+
+
+	def _continues(self, stream_ids):
+		# a stream continues its episode only if its previous next_state is still in the observation ring
+		return (self.last_next_id[stream_ids] >= 0) & (self.last_next_id[stream_ids] >= self.num_obs - self.obs_size)
+
+
+	def add(self, state, action, next_state, reward, done):
+		if self.storage_device.type != "cpu":
+			self.add_batch([state], [action], [next_state], [reward], [done])
+			return
+
+		# single environment on the CPU: same as add_batch, without the per-call array overhead
+		obs_storage, state_id_storage, next_state_id_storage, action_storage, reward_storage, not_done_storage = self.storage
+
+		self._track_streams(1)
+
+		if self._continues(0) and np.array_equal(np.ravel(state), self.last_next_state[0]):
+			state_id = int(self.last_next_id[0])
+		else:
+			state_id = self.num_obs
+			obs_storage[state_id % self.obs_size] = np.ravel(state)
+			self.num_obs += 1
+
+		next_state_id = self.num_obs
+		obs_storage[next_state_id % self.obs_size] = np.ravel(next_state)
+		self.num_obs += 1
+
+		self.last_next_state[0] = np.ravel(next_state)
+		self.last_next_id[0] = next_state_id
+
+		state_id_storage[self.ptr] = state_id
+		next_state_id_storage[self.ptr] = next_state_id
+		action_storage[self.ptr] = action
+		reward_storage[self.ptr] = reward
+		not_done_storage[self.ptr] = 1. - done
+
+		self.ptr = (self.ptr + 1) % self.max_size
+		self.size = min(self.size + 1, self.max_size)
+
+		# drop the oldest transitions if their state has been overwritten in the observation ring
+		while self.size > 0 and int(state_id_storage[(self.ptr - self.size) % self.max_size]) < self.num_obs - self.obs_size:
+			self.size -= 1
+
+
+	def add_batch(self, state, action, next_state, reward, done, streams=None):
+		"""Adds one transition per environment: row i of every argument comes
+		from environment streams[i] (i by default), whose episode continues
+		across calls as long as its state equals its previous next_state."""
+		obs_storage, state_id_storage, next_state_id_storage, action_storage, reward_storage, not_done_storage = self.storage
+
+		state = np.asarray(state).reshape(len(state), -1)
+		next_state = np.asarray(next_state).reshape(len(next_state), -1)
+		num = len(state)
+
+		streams = np.arange(num) if streams is None else np.asarray(streams)
+		self._track_streams(streams.max() + 1)
+
+		# continuing episodes reuse the previous next_state of their environment
+		cont = self._continues(streams) & np.all(state == self.last_next_state[streams], axis=1)
+
+		new = np.nonzero(~cont)[0]
+
+		state_id = np.empty(num, dtype=np.int64)
+		if len(new) < num:
+			state_id[cont] = self.last_next_id[streams[cont]]
+		state_id[new] = self.num_obs + np.arange(len(new))
+		next_state_id = self.num_obs + len(new) + np.arange(num)
+
+		self._write(obs_storage, state_id[new] % self.obs_size, state[new])
+		self._write(obs_storage, next_state_id % self.obs_size, next_state)
+		self.num_obs += len(new) + num
+
+		self.last_next_state[streams] = next_state
+		self.last_next_id[streams] = next_state_id
+
+		ind = (self.ptr + np.arange(num)) % self.max_size
+
+		self._write(state_id_storage, ind, state_id)
+		self._write(next_state_id_storage, ind, next_state_id)
+		self._write(action_storage, ind, np.asarray(action).reshape(num, -1))
+		self._write(reward_storage, ind, np.asarray(reward, dtype=float).reshape(num, 1))
+		self._write(not_done_storage, ind, 1. - np.asarray(done, dtype=float).reshape(num, 1))
+
+		self.ptr = (self.ptr + num) % self.max_size
+		self.size = min(self.size + num, self.max_size)
+
+		# drop the oldest transitions if their state has been overwritten in the observation ring
+		while self.size > 0 and int(state_id_storage[(self.ptr - self.size) % self.max_size]) < self.num_obs - self.obs_size:
+			self.size -= 1
+
+
+	def _gather(self, ind):
+		state_slot = self.state_id.index_select(0, ind) % self.obs_size
+		next_state_slot = self.next_state_id.index_select(0, ind) % self.obs_size
+
+		return (
+			self.obs.index_select(0, state_slot).to(self.device, torch.float32),
+			self.action.index_select(0, ind).to(self.device),
+			self.obs.index_select(0, next_state_slot).to(self.device, torch.float32),
+			self.reward.index_select(0, ind).to(self.device),
+			self.not_done.index_select(0, ind).to(self.device)
+		)
+
+
+	def sample(self, batch_size):
+		ind = (self.ptr - self.size + torch.randint(0, self.size, (batch_size,), device=self.storage_device)) % self.max_size
+
+		return self._gather(ind)
+
+
+	def state_dict(self):
+		# only the observation slots written so far; the transition arrays are small next to them
+		num_obs = min(self.num_obs, self.obs_size)
+
+		return {
+			"obs": self.obs[:num_obs].cpu().numpy(),
+			"state_id": self.state_id.cpu().numpy(),
+			"next_state_id": self.next_state_id.cpu().numpy(),
+			"action": self.action.cpu().numpy(),
+			"reward": self.reward.cpu().numpy(),
+			"not_done": self.not_done.cpu().numpy(),
+			"last_next_state": self.last_next_state,
+			"last_next_id": self.last_next_id,
+			"ptr": self.ptr,
+			"size": self.size,
+			"num_obs": self.num_obs,
+		}
+
+
+	def load_state_dict(self, state):
+		# copied in place, so that NumPy views and shared memory stay valid
+		self.obs[:len(state["obs"])] = torch.as_tensor(state["obs"])
+		for name in ["state_id", "next_state_id", "action", "reward", "not_done"]:
+			getattr(self, name).copy_(torch.as_tensor(state[name]))
+
+		self.last_next_state = np.array(state["last_next_state"])
+		self.last_next_id = np.array(state["last_next_id"])
+		self.ptr = int(state["ptr"])
+		self.size = int(state["size"])
+		self.num_obs = int(state["num_obs"])
+
+
+class SumTree(object):
+	"""Binary tree of sums over capacity non-negative priorities, stored in
+	one array: node i has children 2i and 2i+1, the root is node 1 and
+	priority j is leaf num_leaves + j. Updates and lookups take O(log n)
+	and are vectorized over batches of indices."""
+	def __init__(self, capacity):
+		self.num_leaves = 1
+		while self.num_leaves < capacity:
+			self.num_leaves *= 2
+
+		self.tree = np.zeros(2 * self.num_leaves)
+
+
+	def total(self):
+		return self.tree[1]
+
+
+	def update(self, ind, priority):
+		node = np.asarray(ind) + self.num_leaves
+		if node.size == 0:
+			return
+
+		self.tree[node] = priority
+
+		# duplicate parents just get the same sum written twice, cheaper than np.unique at every level
+		node = node // 2
+		while node[0] > 0:
+			self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+			node //= 2
+
+
+	def find(self, value):
+		"""Indices j such that the sum of priorities before j is <= value < that sum plus priority j."""
+		value = np.array(value, dtype=float)
+		node = np.ones(len(value), dtype=np.int64)
+
+		while node[0] < self.num_leaves:
+			left = self.tree[2 * node]
+			right = value >= left
+
+			value -= left * right
+			node = 2 * node + right
+
+		return node - self.num_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+	"""ReplayBuffer sampling transition i with probability p_i^alpha / sum_j p_j^alpha,
+	where p_i is the last TD error of transition i (new transitions get the
+	largest priority so far, so every transition is sampled at least once).
+
+	sample() also returns the importance-sampling weights (N * P(i))^-beta,
+	normalized by their maximum in the batch, and the sampled indices,
+	which are passed back to update_priorities() with the new TD errors.
+	"""
+	def __init__(self, state_dim, action_dim, max_size=int(1e6), alpha=0.6, beta=0.4, eps=1e-6, **kwargs):
+		super(PrioritizedReplayBuffer, self).__init__(state_dim, action_dim, max_size, **kwargs)
+
+		self.alpha = alpha
+		self.beta = beta
+		self.eps = eps
+		self.max_priority = 1.
+		self.tree = SumTree(max_size)
+		self.rng = np.random.RandomState(np.random.randint(2 ** 31))
+
+
+	def _prioritize_new(self, ptr, num, tail):
+		# transitions dropped from the tail (their observations were overwritten) are never sampled again
+		dropped = (self.ptr - self.size - tail) % self.max_size
+		self.tree.update((tail + np.arange(dropped)) % self.max_size, 0.)
+
+		ind = (ptr + np.arange(num)) % self.max_size
+		live = (ind - (self.ptr - self.size)) % self.max_size < self.size
+		self.tree.update(ind[live], self.max_priority ** self.alpha)
+
+
+	def add(self, state, action, next_state, reward, done):
+		ptr, tail = self.ptr, (self.ptr - self.size) % self.max_size
+		super(PrioritizedReplayBuffer, self).add(state, action, next_state, reward, done)
+		self._prioritize_new(ptr, 1, tail)
+
+
+	def add_batch(self, state, action, next_state, reward, done, streams=None):
+		ptr, tail = self.ptr, (self.ptr - self.size) % self.max_size
+		super(PrioritizedReplayBuffer, self).add_batch(state, action, next_state, reward, done, streams)
+		self._prioritize_new(ptr, len(state), tail)
+
+
+	def sample(self, batch_size):
+		# one value per equal segment of the total priority (stratified sampling)
+		total = self.tree.total()
+		value = (np.arange(batch_size) + self.rng.uniform(size=batch_size)) * (total / batch_size)
+		ind = self.tree.find(np.minimum(value, total * (1 - 1e-12)))
+
+		prob = self.tree.tree[ind + self.tree.num_leaves] / total
+		weights = (self.size * prob) ** -self.beta
+		weights /= weights.max()
+
+		batch = self._gather(torch.as_tensor(ind, device=self.storage_device))
+
+		return batch + (torch.FloatTensor(weights).reshape(-1, 1).to(self.device), ind)
+
+
+	def update_priorities(self, ind, td_error):
+		priority = np.abs(np.ravel(td_error)) + self.eps
+
+		self.max_priority = max(self.max_priority, float(priority.max()))
+		self.tree.update(ind, priority ** self.alpha)
+
+
+	def state_dict(self):
+		state = super(PrioritizedReplayBuffer, self).state_dict()
+		state.update({"tree": self.tree.tree, "max_priority": self.max_priority, "beta": self.beta,
+					  "rng": self.rng.get_state()})
+
+		return state
+
+
+	def load_state_dict(self, state):
+		super(PrioritizedReplayBuffer, self).load_state_dict(state)
+
+		self.tree.tree[:] = state["tree"]
+		self.max_priority = float(state["max_priority"])
+		self.beta = float(state["beta"])
+		self.rng.set_state(state["rng"])
+
+
+def save_checkpoint(path, policy, replay_buffer, training_state):
+	"""Writes a training checkpoint to the directory path: the policy state
+	(policy.pt), the replay buffer arrays (buffer.npz) and everything else,
+	i.e. training_state, the rest of the buffer state and the NumPy and
+	PyTorch RNG states (training.pkl).
+
+	The checkpoint is written to path.tmp and then moved into place, with
+	the previous checkpoint kept as path.old until the move is done, so a
+	crash at any point leaves at least one complete checkpoint.
+	"""
+	tmp_path = path + ".tmp"
+	old_path = path + ".old"
+
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+
+	torch.save(policy.state_dict(), os.path.join(tmp_path, "policy.pt"))
+
+	buffer_state = replay_buffer.state_dict()
+	arrays = dict([(k, v) for k, v in buffer_state.items() if isinstance(v, np.ndarray)])
+	others = dict([(k, v) for k, v in buffer_state.items() if not isinstance(v, np.ndarray)])
+
+	with open(os.path.join(tmp_path, "buffer.npz"), "wb") as f:
+		np.savez(f, **arrays)
+
+	rng_state = {"numpy": np.random.get_state(), "torch": torch.get_rng_state().numpy()}
+	if torch.cuda.is_available():
+		rng_state["cuda"] = [state.numpy() for state in torch.cuda.get_rng_state_all()]
+
+	with open(os.path.join(tmp_path, "training.pkl"), "wb") as f:
+		pickle.dump({"training": training_state, "buffer": others, "rng": rng_state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+	if os.path.exists(path):
+		if os.path.exists(old_path):
+			shutil.rmtree(old_path)
+		os.rename(path, old_path)
+
+	os.rename(tmp_path, path)
+
+	if os.path.exists(old_path):
+		shutil.rmtree(old_path)
+
+
+def checkpoint_exists(path):
+	return os.path.exists(path) or os.path.exists(path + ".old")
+
+
+def load_checkpoint(path, policy, replay_buffer):
+	"""Restores policy, replay_buffer and the RNG states from the checkpoint
+	written by save_checkpoint and returns its training_state."""
+	if not os.path.exists(path):
+		path = path + ".old"
+
+	policy.load_state_dict(torch.load(os.path.join(path, "policy.pt"), map_location="cpu"))
+
+	with open(os.path.join(path, "training.pkl"), "rb") as f:
+		checkpoint = pickle.load(f)
+
+	buffer_state = dict(checkpoint["buffer"])
+	with np.load(os.path.join(path, "buffer.npz")) as arrays:
+		for k in arrays.files:
+			buffer_state[k] = arrays[k]
+
+	replay_buffer.load_state_dict(buffer_state)
+
+	rng_state = checkpoint["rng"]
+	np.random.set_state(rng_state["numpy"])
+	torch.set_rng_state(torch.as_tensor(rng_state["torch"]))
+	if "cuda" in rng_state and torch.cuda.is_available():
+		torch.cuda.set_rng_state_all([torch.as_tensor(state) for state in rng_state["cuda"]])
+
+	return checkpoint["training"]
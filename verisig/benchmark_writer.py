@@ -0,0 +1,80 @@
+'''
+Per-cell cost of writing the Flow* model of the composed system for the
+21/41/61-ray plants: writeComposedSystem, which streams the whole
+automaton into the file of every cell, against a ComposedSystemTemplate
+rendered once per sweep, which only writes the init block of each cell.
+
+Both writers must produce identical files.
+
+Example usage:
+
+python benchmark_writer.py [num_cells]
+
+'''
+
+from verisig_multi_runner import ComposedSystemTemplate, writeComposedSystem, cellInitProps
+from six.moves import cPickle as pickle
+import tempfile
+import shutil
+import timeit
+import yaml
+import os
+import sys
+
+def main(argv):
+
+    numCells = 20
+    if len(argv) > 0:
+        numCells = int(argv[0])
+
+    numSteps = 70
+    safetyProps = 'unsafe\n{\tcont_m2\n\t{\n\t\ty1 <= 0.3\n\n\t}\n}'
+
+    cells = [{'y1': [0.65 + i * 0.005, 0.655 + i * 0.005], 'y4': [0, 0], 'y3': [0, 0]} for i in range(numCells)]
+
+    folder = tempfile.mkdtemp()
+
+    print('rays   writeComposedSystem (ms/cell)   template (ms/cell)   template setup (ms)   speedup')
+
+    try:
+        for numRays in [21, 41, 61]:
+
+            with open('../dnns/TD3_L' + str(numRays) + '_64x64_C1.yml', 'rb') as f:
+                dnn = yaml.safe_load(f)
+
+            with open('../plant_models/dynamics_' + str(numRays) + '.pickle', 'rb') as f:
+                plant = pickle.load(f)
+
+            with open('../plant_models/glue_' + str(numRays) + '.pickle', 'rb') as f:
+                glue = pickle.load(f)
+
+            def runFull():
+                for i, cell in enumerate(cells):
+                    writeComposedSystem(os.path.join(folder, 'full_' + str(i)), cellInitProps(cell),\
+                                        dnn, plant, glue, safetyProps, numSteps)
+
+            def runTemplate():
+                template = ComposedSystemTemplate(dnn, plant, glue, safetyProps, numSteps)
+
+                for i, cell in enumerate(cells):
+                    template.write(os.path.join(folder, 'template_' + str(i)), cellInitProps(cell))
+
+            def setupTemplate():
+                ComposedSystemTemplate(dnn, plant, glue, safetyProps, numSteps)
+
+            fullTime = min(timeit.repeat(runFull, number=1, repeat=3)) / numCells
+            templateTime = min(timeit.repeat(runTemplate, number=1, repeat=3)) / numCells
+            setupTime = min(timeit.repeat(setupTemplate, number=1, repeat=3))
+
+            for i in range(numCells):
+                with open(os.path.join(folder, 'full_' + str(i))) as f1, open(os.path.join(folder, 'template_' + str(i))) as f2:
+                    if f1.read() != f2.read():
+                        raise ValueError('model mismatch for cell ' + str(cells[i]))
+
+            print('%4d   %29.2f   %18.2f   %19.2f   %7.1fx' % (numRays, fullTime * 1e3, templateTime * 1e3,\
+                                                               setupTime * 1e3, fullTime / templateTime))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,49 +1,330 @@
-import re
+'''
+Summarizes Flow* verification logs: one record per verification instance
+(cell id, log file, verdict, total time, DNN time, number of branches)
+and percentiles/totals over all instances.
+
+The logs are read line by line, so they can be the per-job logs written
+by verisig_multi_runner.py (a folder or a list of files) or one large
+concatenated log; in the latter case a new instance starts whenever a
+field of the current one is printed again. The id of an instance is its
+initial set, as printed by Flow* in the "Initial conditions" block at the
+end of the instance (the log file name, followed by :N in a concatenated
+log, if the block is missing). As in verisig_multi_runner.parseLog, a
+SAFE result after "Computation not completed" is reported as unknown.
+
+The records are streamed to --output (CSV, or JSON Lines if the name
+ends in .jsonl/.json). The percentiles are exact for up to EXACT_LIMIT
+instances, whose values are kept in memory; past that, memory stops
+growing and the percentiles become P^2 estimates (Jain and Chlamtac,
+1985), which are only accurate for many values.
+
+Example usage:
+
+python parser.py ../flowstar_logs --output records.csv
+
+'''
+
+from verisig_multi_runner import ANSI_ESCAPE, FLOWSTAR_RESULTS, VERIFIED, UNSAFE, UNKNOWN, TIMEOUT, ERROR
+import argparse
+import csv
+import json
+import os
 import sys
 
-def main(argv):
+FIELDS = ['id', 'log', 'status', 'total_time', 'dnn_time', 'branches']
 
-    input_filename = argv[0]
+PERCENTILES = [50, 90, 99]
 
-    totalTime = 0
-    totalDnnTime = 0
-    totalNumBranches = 0
-    numRuns = 0
-    
-    with open(input_filename, 'r') as f:
+# values per field kept for exact percentiles, before switching to P^2 estimates
+EXACT_LIMIT = 5000
+
+def parseLine(line):
+    """Returns the (field, value) printed on a Flow* log line, or None."""
+
+    line = ANSI_ESCAPE.sub('', line)
+
+    if 'Computation not completed' in line:
+        return ('completed', False)
+
+    if 'Computation completed' in line:
+        return ('completed', True)
+
+    if 'Initial conditions' in line:
+        return ('init', [])
+
+    if 'Result of the safety verification' in line:
+        result = line.split(':')[-1].strip()
+        return ('status', FLOWSTAR_RESULTS.get(result, ERROR))
+
+    if 'Total time cost' in line:
+        return ('total_time', float(line.split(':')[1].split()[0]))
+
+    if 'dnn runtime' in line:
+        return ('dnn_time', float(line.split(':')[1].split()[0]))
+
+    if 'total branches' in line:
+        return ('branches', int(float(line.split(':')[1].split()[0])))
+
+    return None
+
+def newRecord(recordId, logFile):
+    record = dict([(field, None) for field in FIELDS])
+    record['id'] = recordId
+    record['log'] = logFile
+    record['status'] = ERROR
+
+    return record
+
+def finishRecord(record, fields):
+    """record, with the id taken from its initial set and the verdict of an incomplete computation made unknown."""
+
+    if fields.get('init'):
+        record['id'] = ' '.join(fields['init'])
+
+    if fields.get('completed') is False and record['status'] == VERIFIED:
+        record['status'] = UNKNOWN
+
+    return record
+
+def iterInstances(filename):
+    """Yields one record per verification instance in filename.
+
+    A log with no instance at all (e.g. a job that was killed) still yields
+    one record with status ERROR, so every job shows up in the output.
+    """
+
+    name = os.path.basename(filename)
+    if name.endswith('.log'):
+        name = name[:-len('.log')]
+
+    count = 0
+    record = newRecord(name, filename)
+    # the fields printed so far for the current instance, including the ones not in the record
+    seen = {}
+    inInit = False
+
+    with open(filename, 'r') as f:
         for line in f:
-            m = re.search('seconds', line)
+            # the initial set is printed one interval per line after "Initial conditions:"
+            if inInit:
+                interval = ANSI_ESCAPE.sub('', line).strip()
 
-            if m is not None:
+                if interval.startswith('['):
+                    seen['init'].append(interval)
+                    continue
 
-                items = line.split()
-                curTime = items[3]
-                curTime = float(curTime[0:len(curTime)-4])
+                inInit = False
 
-                totalTime += curTime
+            parsed = parseLine(line)
 
-            dnn = re.search('dnn', line)
+            if parsed is None:
+                continue
 
-            if dnn is not None:
-                items = line.split()
-                curTime = float(items[2])
+            field, value = parsed
 
-                totalDnnTime += curTime
+            if field in seen:
+                yield finishRecord(record, seen)
 
-                numRuns += 1
+                count += 1
+                record = newRecord(name + ':' + str(count), filename)
+                seen = {}
+
+            if field in record:
+                record[field] = value
+
+            seen[field] = value
+            inInit = field == 'init'
+
+    if seen or count == 0:
+        yield finishRecord(record, seen)
+
+def iterLogFiles(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.log'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def percentile(values, p):
+    """Percentile of sorted values, linearly interpolated between the closest ranks."""
+
+    if not values:
+        return float('nan')
+
+    pos = (len(values) - 1) * p / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+class P2Quantile:
+    """Streaming estimate of the p-th percentile with the P^2 algorithm: five markers at the
+    minimum, p/2, p, (1 + p)/2 and the maximum, whose heights are adjusted with a
+    piecewise-parabolic fit as the values arrive. Exact for up to five values."""
 
-            branch = re.search('branches', line)
+    def __init__(self, p):
+        self.p = p / 100.0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4]
+        self.increments = [0, self.p / 2, self.p, (1 + self.p) / 2, 1]
 
-            if branch is not None:
-                items = line.split()
-                curBranches = float(items[2])
+    def add(self, x):
+        q = self.heights
 
-                totalNumBranches += curBranches
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+
+                parabolic = q[i] + float(d) / (n[i + 1] - n[i - 1]) * \
+                    ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+                     (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1]))
+
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+
+                n[i] += d
+
+    def value(self):
+        if len(self.heights) < 5:
+            return percentile(self.heights, self.p * 100)
+
+        return self.heights[2]
+
+class Summary:
+    """Count, total, maximum and the PERCENTILES of a stream of values: exact while there are
+    at most exactLimit values, P^2 estimates (in constant memory) afterwards."""
+
+    def __init__(self, exactLimit=EXACT_LIMIT):
+        self.count = 0
+        self.total = 0
+        self.max = None
+        self.exactLimit = exactLimit
+        self.values = []
+        self.quantiles = None
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        self.max = x if self.max is None else max(self.max, x)
+
+        if self.quantiles is None:
+            self.values.append(x)
+
+            if len(self.values) <= self.exactLimit:
+                return
+
+            # too many values to keep: estimate from here on, starting from the values so far
+            self.quantiles = [P2Quantile(p) for p in PERCENTILES]
+            x = self.values
+            self.values = None
+        else:
+            x = [x]
+
+        for quantile in self.quantiles:
+            for value in x:
+                quantile.add(value)
+
+    def percentiles(self):
+        """The PERCENTILES, in order (nan without values)."""
+
+        if self.quantiles is None:
+            values = sorted(self.values)
+            return [percentile(values, p) for p in PERCENTILES]
+
+        return [quantile.value() for quantile in self.quantiles]
+
+class RecordWriter:
+
+    def __init__(self, filename):
+        self.file = open(filename, 'w')
+        self.jsonLines = filename.endswith('.jsonl') or filename.endswith('.json')
+
+        if not self.jsonLines:
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, record):
+        if self.jsonLines:
+            self.file.write(json.dumps(record) + '\n')
+        else:
+            self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs='+')                    # log files or folders of .log files
+    parser.add_argument("--output", default="")               # per-instance records (.csv or .jsonl)
+    args = parser.parse_args(argv)
+
+    writer = RecordWriter(args.output) if args.output else None
+
+    summaries = dict([(field, Summary()) for field in ['total_time', 'dnn_time', 'branches']])
+    counts = {}
+    numRuns = 0
+
+    try:
+        for filename in iterLogFiles(args.logs):
+            for record in iterInstances(filename):
+                numRuns += 1
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+
+                for field in summaries:
+                    if record[field] is not None:
+                        summaries[field].add(record[field])
+
+                if writer is not None:
+                    writer.write(record)
+    finally:
+        if writer is not None:
+            writer.close()
 
     print('number of instances: ' + str(numRuns))
-    print('average total runtime: ' + str(totalTime / numRuns))
-    print('average NN runtime: ' + str(totalDnnTime / numRuns))
-    print('average number of paths: ' + str(totalNumBranches / numRuns))
+    print('verdicts: ' + ', '.join([str(counts.get(status, 0)) + ' ' + status\
+                                    for status in [VERIFIED, UNSAFE, UNKNOWN, TIMEOUT, ERROR]]))
+
+    for field, label in [('total_time', 'total runtime'), ('dnn_time', 'NN runtime'), ('branches', 'number of paths')]:
+        summary = summaries[field]
+
+        if summary.count == 0:
+            continue
+
+        line = label + ': total ' + str(summary.total) + ', mean ' + str(summary.total / float(summary.count))
+        for p, value in zip(PERCENTILES, summary.percentiles()):
+            line += ', p' + str(p) + ' ' + str(value)
+
+        print(line + ', max ' + str(summary.max) + ' (' + str(summary.count) + ' instances)')
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,30 @@
+import numpy as np
+
+from parser import PERCENTILES, Summary
+
+def summarize(values, **kwargs):
+    summary = Summary(**kwargs)
+
+    for x in values:
+        summary.add(x)
+
+    return summary
+
+def test_exact_percentiles_for_small_samples():
+    rng = np.random.RandomState(0)
+
+    for n in [1, 2, 3, 5, 7, 10, 40, 100]:
+        for values in [rng.lognormal(size=n), rng.uniform(size=n)]:
+            summary = summarize(values)
+
+            assert np.allclose(summary.percentiles(), np.percentile(values, PERCENTILES), rtol=0, atol=1e-12)
+            assert summary.count == n
+            assert np.isclose(summary.total, np.sum(values))
+            assert summary.max == np.max(values)
+
+def test_estimated_percentiles_past_the_limit():
+    values = np.random.RandomState(1).uniform(size=20000)
+    summary = summarize(values, exactLimit=1000)
+
+    assert summary.values is None
+    assert np.allclose(summary.percentiles(), np.percentile(values, PERCENTILES), rtol=0, atol=0.01)
@@ -23,10 +23,27 @@ Example usage:
 
 python verisig_multi_runner.py ../dnns/TD3_L21_64x64_C1.yml ../plant_models/dynamics_21.pickle ../plant_models/glue_21.pickle
 
+The Flow* jobs (one per initial cell) run at most --workers at a time,
+each with its own log file in --log_folder. --timeout kills jobs that
+run longer than the given number of seconds and --retries restarts jobs
+that timed out or failed.
+
+Verdicts are cached in --cache_folder, keyed by a hash of the composed
+model, the DNN file and the Flow* binary, so re-running an interrupted
+or repeated sweep only runs Flow* on the cells that are missing.
+
 '''
 
 from six.moves import cPickle as pickle
+from six.moves import StringIO
+import argparse
+import hashlib
+import heapq
+import json
+import multiprocessing
 import os
+import re
+import signal
 import time
 import subprocess
 from subprocess import PIPE
@@ -436,94 +453,569 @@ def getInputLBUB(state, bounds, weights, offsets):
        -- key 'reset' maps to a list of resets that can be parsed by Flow*
 5. safetyProps is assumed to be a string containing a 
    logic formula that can be parsed by Flow*'''
-def writeComposedSystem(filename, initProps, dnn, plant, glueTrans, safetyProps, numSteps):
+def writeComposedHead(stream, dnn, plant, glueTrans, numSteps):
+    """Writes the composed system up to its initial condition (state
+    variables, settings, modes and jumps); returns the number of DNN inputs
+    and of neuron states, which writeInitCond needs."""
 
-    with open(filename, 'w') as stream:
+    stream.write('hybrid reachability\n')
+    stream.write('{\n')
 
-        stream.write('hybrid reachability\n')
-        stream.write('{\n')
+    #encode variable names--------------------------------------------------
+    stream.write('\t' + 'state var ')
 
-        #encode variable names--------------------------------------------------
-        stream.write('\t' + 'state var ')
+    numNeurStates = getNumStates(dnn['offsets'])
+    numNeurLayers = 1
+    numSysStates = len(plant[1]['dynamics'])
+    numInputs = len(dnn['weights'][1][0])
 
-        numNeurStates = getNumStates(dnn['offsets'])
-        numNeurLayers = 1
-        numSysStates = len(plant[1]['dynamics'])
-        numInputs = len(dnn['weights'][1][0])
+    neurStates = []
+    for i in range(numNeurStates):
+        fName = 'f' + str(i + 1)
+        neurStates.append(fName)
+        
+    if 'states' in plant[1]:
+        for index in range(len(plant[1]['states'])):
+            if not plant[1]['states'][index] in neurStates:
+                stream.write(plant[1]['states'][index] + ', ')
+    else:
+        for state in plant[1]['dynamics']:
+            if 'clock' in state:
+                continue
+            stream.write(state + ', ')
 
-        neurStates = []
-        for i in range(numNeurStates):
-            fName = 'f' + str(i + 1)
-            neurStates.append(fName)
-            
-        if 'states' in plant[1]:
-            for index in range(len(plant[1]['states'])):
-                if not plant[1]['states'][index] in neurStates:
-                    stream.write(plant[1]['states'][index] + ', ')
-        else:
-            for state in plant[1]['dynamics']:
-                if 'clock' in state:
-                    continue
-                stream.write(state + ', ')
+    for i in range(numNeurStates):
+        stream.write('f' + str(i + 1) + ', ')
+    
+    stream.write('clock\n\n')
 
-        for i in range(numNeurStates):
-            stream.write('f' + str(i + 1) + ', ')
-        
-        stream.write('clock\n\n')
-
-        #settings---------------------------------------------------------------
-        stream.write('\tsetting\n')
-        stream.write('\t{\n')
-        stream.write('\t\tadaptive steps {min 1e-6, max 0.005}\n') # F1/10 case study (HSCC)
-        stream.write('\t\ttime ' + str(numSteps * (0.1)) + '\n') #F1/10 case study (HSCC)
-        stream.write('\t\tremainder estimation 1e-1\n')
-        stream.write('\t\tidentity precondition\n')
-        stream.write('\t\tgnuplot octagon f1, f2\n')
-        stream.write('\t\tfixed orders 4\n')
-        stream.write('\t\tcutoff 1e-12\n')
-        stream.write('\t\tprecision 100\n')
-        stream.write('\t\toutput autosig\n')
-        stream.write('\t\tmax jumps ' + str((numNeurLayers + 2 + 10 + 5 * numInputs) * numSteps) + '\n') #F1/10 case study (HSCC)
-        stream.write('\t\tprint off\n')
-        stream.write('\t}\n\n')
-
-        #encode modes-----------------------------------------------------------------------------------------------
-        stream.write('\tmodes\n')
-        stream.write('\t{\n')
-
-        writeDnnModes(stream, dnn['weights'], dnn['offsets'], dnn['activations'], plant[1]['dynamics'])
-        writePlantModes(stream, plant, numNeurStates, numNeurLayers)
-
-        #close modes brace
-        stream.write('\t}\n')
-
-        #encode jumps----------------------------------------------------------------------------------------------
-        stream.write('\tjumps\n')
-        stream.write('\t{\n')
-
-        writeDnnJumps(stream, dnn['weights'], dnn['offsets'], dnn['activations'], plant[1]['dynamics'])
-        writeDnn2PlantJumps(stream, glueTrans['dnn2plant'], numNeurStates, numNeurLayers, dnn['activations'][len(dnn['activations'])], plant)
-        writePlantJumps(stream, plant, numNeurStates, numNeurLayers)
-        writePlant2DnnJumps(stream, glueTrans['plant2dnn'], plant[1]['dynamics'], numNeurStates, numNeurLayers)
-        
-        #close jumps brace
-        stream.write('\t}\n')
+    #settings---------------------------------------------------------------
+    stream.write('\tsetting\n')
+    stream.write('\t{\n')
+    stream.write('\t\tadaptive steps {min 1e-6, max 0.005}\n') # F1/10 case study (HSCC)
+    stream.write('\t\ttime ' + str(numSteps * (0.1)) + '\n') #F1/10 case study (HSCC)
+    stream.write('\t\tremainder estimation 1e-1\n')
+    stream.write('\t\tidentity precondition\n')
+    stream.write('\t\tgnuplot octagon f1, f2\n')
+    stream.write('\t\tfixed orders 4\n')
+    stream.write('\t\tcutoff 1e-12\n')
+    stream.write('\t\tprecision 100\n')
+    stream.write('\t\toutput autosig\n')
+    stream.write('\t\tmax jumps ' + str((numNeurLayers + 2 + 10 + 5 * numInputs) * numSteps) + '\n') #F1/10 case study (HSCC)
+    stream.write('\t\tprint off\n')
+    stream.write('\t}\n\n')
+
+    #encode modes-----------------------------------------------------------------------------------------------
+    stream.write('\tmodes\n')
+    stream.write('\t{\n')
+
+    writeDnnModes(stream, dnn['weights'], dnn['offsets'], dnn['activations'], plant[1]['dynamics'])
+    writePlantModes(stream, plant, numNeurStates, numNeurLayers)
+
+    #close modes brace
+    stream.write('\t}\n')
+
+    #encode jumps----------------------------------------------------------------------------------------------
+    stream.write('\tjumps\n')
+    stream.write('\t{\n')
+
+    writeDnnJumps(stream, dnn['weights'], dnn['offsets'], dnn['activations'], plant[1]['dynamics'])
+    writeDnn2PlantJumps(stream, glueTrans['dnn2plant'], numNeurStates, numNeurLayers, dnn['activations'][len(dnn['activations'])], plant)
+    writePlantJumps(stream, plant, numNeurStates, numNeurLayers)
+    writePlant2DnnJumps(stream, glueTrans['plant2dnn'], plant[1]['dynamics'], numNeurStates, numNeurLayers)
+    
+    #close jumps brace
+    stream.write('\t}\n')
+
+    return numInputs, numNeurStates
+
+class ComposedSystemTemplate:
+    """The composed system of writeComposedSystem, rendered once for a
+    (dnn, plant, glueTrans, safetyProps, numSteps) tuple.
+
+    Only the initial condition changes from one cell to the next, so the
+    state variables, settings, modes and jumps are kept as one string and
+    write() only renders the init block around them.
+    """
+
+    def __init__(self, dnn, plant, glueTrans, safetyProps, numSteps):
+
+        stream = StringIO()
+
+        self.numInputs, self.numNeurStates = writeComposedHead(stream, dnn, plant, glueTrans, numSteps)
+
+        self.head = stream.getvalue()
+
+        #encode unsafe set after the top level brace
+        self.tail = '}\n' + safetyProps
+
+    def render(self, initProps):
+
+        stream = StringIO()
+
+        #encode initial condition----------------------------------------------------------------------------------
+        writeInitCond(stream, initProps, self.numInputs, self.numNeurStates, 'm3') #F1/10 (HSCC)
+
+        return self.head + stream.getvalue() + self.tail
+
+    def write(self, filename, initProps):
+
+        with open(filename, 'w') as stream:
+            stream.write(self.render(initProps))
+
+def writeComposedSystem(filename, initProps, dnn, plant, glueTrans, safetyProps, numSteps):
+    """Writes the composed system for one initial condition straight to
+    filename. A sweep renders a ComposedSystemTemplate once instead;
+    benchmark_writer.py checks that both write the same file."""
+
+    with open(filename, 'w') as stream:
+
+        numInputs, numNeurStates = writeComposedHead(stream, dnn, plant, glueTrans, numSteps)
 
         #encode initial condition----------------------------------------------------------------------------------
         writeInitCond(stream, initProps, numInputs, numNeurStates, 'm3') #F1/10 (HSCC)
-        
+
         #close top level brace
         stream.write('}\n')
-        
+
         #encode unsafe set------------------------------------------------------------------------------------------
         stream.write(safetyProps)
 
 
+# verdicts reported for each Flow* job
+VERIFIED = 'verified'
+UNSAFE = 'unsafe'
+UNKNOWN = 'unknown'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+FLOWSTAR_RESULTS = {'SAFE': VERIFIED, 'UNSAFE': UNSAFE, 'UNKNOWN': UNKNOWN}
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+def parseLog(logFile):
+    """Returns the verdict printed by Flow* in logFile (ERROR if there is none)
+    with the Flow* time, number of branches and DNN time (None if missing).
+
+    When the reachability computation stops early Flow* prints "Computation
+    not completed" and may still report SAFE for the part it computed; such
+    a run proves nothing and is reported as UNKNOWN."""
+
+    stats = {'status': ERROR, 'flowstar_time': None, 'branches': None, 'dnn_time': None}
+    completed = True
+
+    with open(logFile, 'r') as f:
+        for line in f:
+            line = ANSI_ESCAPE.sub('', line)
+
+            if 'Computation not completed' in line:
+                completed = False
+
+            elif 'Result of the safety verification' in line:
+                result = line.split(':')[-1].strip()
+                if result in FLOWSTAR_RESULTS:
+                    stats['status'] = FLOWSTAR_RESULTS[result]
+
+            elif 'Total time cost' in line:
+                stats['flowstar_time'] = float(line.split()[3])
+
+            elif 'total branches' in line:
+                stats['branches'] = int(line.split()[2])
+
+            elif 'dnn runtime' in line:
+                stats['dnn_time'] = float(line.split()[2])
+
+    if not completed and stats['status'] == VERIFIED:
+        stats['status'] = UNKNOWN
+
+    return stats
+
+def parseVerdict(logFile):
+    """Returns the verdict printed by Flow* in logFile (ERROR if there is none)."""
+
+    return parseLog(logFile)['status']
+
+def hashFile(filename, h = None):
+    if h is None:
+        h = hashlib.sha256()
+
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h
+
+class ResultCache:
+    """Verdicts of finished Flow* jobs, one <key>.json file per job in folder.
+
+    The key of a job hashes the contents of its model file and of every
+    file named in its command (the Flow* binary and the DNN), and the other
+    arguments of the command. File paths are not part of the key, so the
+    same files reached from another working directory or through another
+    path hit the same entries, and a stored verdict is only reused when
+    none of the contents changed. Timeouts and errors are not stored.
+    """
+
+    CACHED_RESULTS = [VERIFIED, UNSAFE, UNKNOWN]
+
+    # part of every key; bumped when parseLog changes what it reports, so older verdicts are not reused
+    VERSION = b'2'
+
+    def __init__(self, folder = '../flowstar_cache'):
+        self.folder = folder
+
+        # file hashes by (path, size, mtime), so the binary is hashed once per sweep
+        self.fileHashes = {}
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _fileHash(self, filename):
+        st = os.stat(filename)
+        fileId = (os.path.abspath(filename), st.st_size, st.st_mtime)
+
+        if fileId not in self.fileHashes:
+            self.fileHashes[fileId] = hashFile(filename).hexdigest()
+
+        return self.fileHashes[fileId]
+
+    def key(self, command, modelFile):
+        h = hashlib.sha256(self.VERSION + b'\0')
+
+        for arg in command:
+            # a file by its contents only; other existing paths (e.g. folders) normalized
+            if os.path.isfile(arg):
+                h.update(b'file:' + self._fileHash(arg).encode('utf-8') + b'\0')
+            elif os.path.exists(arg):
+                h.update(b'path:' + os.path.realpath(arg).encode('utf-8') + b'\0')
+            else:
+                h.update(b'arg:' + arg.encode('utf-8') + b'\0')
+
+        h.update(b'\0')
+
+        return hashFile(modelFile, h).hexdigest()
+
+    def get(self, key):
+        filename = os.path.join(self.folder, key + '.json')
+
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def put(self, key, result):
+        if result['status'] not in self.CACHED_RESULTS:
+            return
+
+        record = dict([(k, result[k]) for k in ['id', 'status', 'runtime', 'flowstar_time', 'branches', 'dnn_time']])
+
+        # written under a temporary name first so an interrupted sweep never leaves a partial entry
+        filename = os.path.join(self.folder, key + '.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(record, f)
+
+        os.rename(filename + '.tmp', filename)
+
+class JobPool:
+    """Runs Flow* jobs with at most numWorkers processes at a time.
+
+    Every job reads its model from a file on stdin and writes its stdout
+    and stderr to <logFolder>/<jobId>.log. Jobs running longer than timeout
+    seconds are killed (with their whole process group). Jobs that time out
+    or fail without a verdict are restarted up to retries times. With a
+    ResultCache, jobs whose verdict is already cached are not run at all.
+    """
+
+    def __init__(self, numWorkers, timeout = None, retries = 0, logFolder = '../flowstar_logs', pollInterval = 0.5,\
+                 cache = None):
+        self.numWorkers = numWorkers
+        self.timeout = timeout
+        self.retries = retries
+        self.logFolder = logFolder
+        self.pollInterval = pollInterval
+        self.cache = cache
+
+        self.queue = []
+        self.running = []
+        self.results = []
+        self.cached = []
+        self.numSubmitted = 0
+
+        if not os.path.exists(logFolder):
+            os.makedirs(logFolder)
+
+    def submit(self, jobId, command, modelFile, info = None):
+        """Queues command (a list of arguments) with modelFile as stdin; info is
+        passed through to the result of the job."""
+
+        job = {'id': jobId, 'command': command, 'model': modelFile,\
+               'info': info, 'attempts': 0, 'order': self.numSubmitted, 'key': None}
+        self.numSubmitted += 1
+
+        if self.cache is not None:
+            job['key'] = self.cache.key(command, modelFile)
+
+            record = self.cache.get(job['key'])
+            if record is not None:
+                result = {'id': jobId, 'status': record['status'], 'returncode': None,\
+                          'runtime': record['runtime'], 'attempts': 0, 'log': None, 'info': info,\
+                          'order': job['order'], 'flowstar_time': record['flowstar_time'],\
+                          'branches': record['branches'], 'dnn_time': record['dnn_time'], 'cached': True}
+
+                # returned by the next poll(), like the results of jobs that ran
+                self.results.append(result)
+                self.cached.append(result)
+                return
+
+        self.queue.append(job)
+
+    def pending(self):
+        return len(self.queue) + len(self.running) + len(self.cached)
+
+    def _start(self, job):
+        job['attempts'] += 1
+        job['log'] = os.path.join(self.logFolder, str(job['id']) + '.log')
+
+        with open(job['model'], 'r') as stdin, open(job['log'], 'w') as log:
+            # own process group so that a timeout kills Flow* and anything it spawned
+            job['process'] = subprocess.Popen(job['command'], stdin=stdin, stdout=log,\
+                                              stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+
+        job['start'] = time.time()
+        self.running.append(job)
+
+    def _finish(self, job, stats):
+        runtime = time.time() - job['start']
+
+        if stats['status'] in [TIMEOUT, ERROR] and job['attempts'] <= self.retries:
+            self.queue.insert(0, job)
+            return None
+
+        result = {'id': job['id'], 'status': stats['status'], 'returncode': job['process'].returncode,\
+                  'runtime': runtime, 'attempts': job['attempts'], 'log': job['log'], 'info': job['info'],\
+                  'order': job['order'], 'flowstar_time': stats['flowstar_time'],\
+                  'branches': stats['branches'], 'dnn_time': stats['dnn_time'], 'cached': False}
+        self.results.append(result)
+
+        if self.cache is not None:
+            self.cache.put(job['key'], result)
+
+        return result
+
+    def poll(self):
+        """Starts queued jobs on free workers and collects finished ones.
+        Returns the results of the jobs that finished since the last call."""
+
+        finished = self.cached
+        self.cached = []
+
+        for job in list(self.running):
+            stats = None
+
+            if job['process'].poll() is not None:
+                stats = parseLog(job['log'])
+
+            elif self.timeout is not None and time.time() - job['start'] > self.timeout:
+                try:
+                    os.killpg(job['process'].pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+                job['process'].wait()
+                stats = {'status': TIMEOUT, 'flowstar_time': None, 'branches': None, 'dnn_time': None}
+
+            if stats is not None:
+                self.running.remove(job)
+
+                result = self._finish(job, stats)
+                if result is not None:
+                    finished.append(result)
+
+        while self.queue and len(self.running) < self.numWorkers:
+            self._start(self.queue.pop(0))
+
+        return finished
+
+    def wait(self):
+        """Barrier: runs all submitted jobs to completion and returns all results."""
+
+        self.poll()
+
+        while self.pending() > 0:
+            time.sleep(self.pollInterval)
+            self.poll()
+
+        return self.results
+
+def printReport(results):
+
+    counts = {}
+
+    for result in sorted(results, key=lambda r: r['order']):
+        line = str(result['id']) + ': ' + result['status'] + ' (' + '%.1f' % result['runtime'] + ' s'
+
+        if result['attempts'] > 1:
+            line += ', ' + str(result['attempts']) + ' attempts'
+
+        if result['cached']:
+            line += ', cached'
+
+        if result['info'] is not None:
+            line += ', ' + str(result['info'])
+
+        print(line + ')')
+
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    print('total: ' + ', '.join([str(counts.get(status, 0)) + ' ' + status\
+                                 for status in [VERIFIED, UNSAFE, UNKNOWN, TIMEOUT, ERROR]]))
+
+# initial-state variables that cells can partition: distance to the side
+# wall (y1), heading (y4) and velocity (y3)
+CELL_VARS = ['y1', 'y4', 'y3']
+
+def cellInitProps(cell):
+    """Flow* initial set of a cell, a dictionary mapping each of CELL_VARS to an [lb, ub] interval."""
+
+    return ['y1 in [' + str(cell['y1'][0]) + ', ' + str(cell['y1'][1]) + ']',\
+            'y2 in [9.9, 9.9]',\
+            'y3 in [' + str(cell['y3'][0]) + ', ' + str(cell['y3'][1]) + ']',\
+            'y4 in [' + str(cell['y4'][0]) + ', ' + str(cell['y4'][1]) + ']',\
+            'k in [0, 0]', 'u in [0, 0]', 'angle in [0, 0]', 'temp1 in [0, 0]', 'temp2 in [0, 0]',\
+            'theta_l in [0, 0]', 'theta_r in [0, 0]'] #F1/10
+
+def cellString(cell):
+    return ', '.join([var + ' in [' + str(cell[var][0]) + ', ' + str(cell[var][1]) + ']'\
+                      for var in CELL_VARS if cell[var][1] > cell[var][0]])
+
+def cellVolume(cell):
+    volume = 1.0
+
+    # point dimensions are never split, so they are left out of the volume
+    for var in CELL_VARS:
+        if cell[var][1] > cell[var][0]:
+            volume *= cell[var][1] - cell[var][0]
+
+    return volume
+
+def bisectCell(cell, minWidths):
+    """Splits cell in half along the dimension that is widest relative to its
+    minimum width. Returns [] if every half would be narrower than minWidths."""
+
+    splitVar = None
+    bestRatio = 0
+
+    for var in CELL_VARS:
+        width = cell[var][1] - cell[var][0]
+
+        if width <= 0 or width / 2.0 < minWidths[var]:
+            continue
+
+        ratio = width / minWidths[var] if minWidths[var] > 0 else float('inf')
+        if ratio > bestRatio:
+            splitVar = var
+            bestRatio = ratio
+
+    if splitVar is None:
+        return []
+
+    lb, ub = cell[splitVar]
+    mid = (lb + ub) / 2.0
+
+    lower = dict(cell)
+    upper = dict(cell)
+    lower[splitVar] = [lb, mid]
+    upper[splitVar] = [mid, ub]
+
+    return [lower, upper]
+
+def runAdaptive(pool, submitCell, initialCells, minWidths):
+    """Verifies initialCells, bisecting every cell that is not verified
+    (unsafe, unknown or timed out) until the cells reach minWidths.
+
+    Pending cells are kept in a priority queue ordered by depth, so all
+    cells of one size are tried before any of their halves and the runs
+    concentrate on the boundary between verified and unverified regions.
+    submitCell(name, cell) writes the cell's model, submits it to pool and
+    returns the job id.
+    Returns the results of the final (not bisected) cells.
+    """
+
+    heap = []
+    count = 0
+
+    for cell in initialCells:
+        heapq.heappush(heap, (0, count, cell))
+        count += 1
+
+    jobs = {}
+    leaves = []
+
+    while heap or pool.pending() > 0:
+
+        while heap and pool.pending() < pool.numWorkers:
+            depth, order, cell = heapq.heappop(heap)
+
+            jobId = submitCell('cell_' + str(order), cell)
+            jobs[jobId] = (depth, cell)
+
+        finished = pool.poll()
+
+        for result in finished:
+            depth, cell = jobs.pop(result['id'])
+
+            children = []
+            if result['status'] in [UNSAFE, UNKNOWN, TIMEOUT]:
+                children = bisectCell(cell, minWidths)
+
+            for child in children:
+                heapq.heappush(heap, (depth + 1, count, child))
+                count += 1
+
+            if not children:
+                result['cell'] = cell
+                leaves.append(result)
+
+        if not finished:
+            time.sleep(pool.pollInterval)
+
+    return leaves
+
+def printVolumeReport(leaves):
+
+    total = sum([cellVolume(result['cell']) for result in leaves])
+
+    for status in [VERIFIED, UNSAFE, UNKNOWN, TIMEOUT, ERROR]:
+        volume = sum([cellVolume(result['cell']) for result in leaves if result['status'] == status])
+        print(status + ' volume: ' + '%.1f' % (100 * volume / total) + '%')
+
 def main(argv):
 
-    dnnYaml = argv[0]
-    plantPickle = argv[1]
-    gluePickle = argv[2]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dnn")                                             # DNN controller (.yml)
+    parser.add_argument("plant")                                           # plant model (.pickle)
+    parser.add_argument("glue")                                            # glue transitions (.pickle)
+    parser.add_argument("--workers", default=multiprocessing.cpu_count(), type=int) # Flow* processes at a time
+    parser.add_argument("--timeout", default=None, type=float)             # per-job wall-clock limit (s)
+    parser.add_argument("--retries", default=0, type=int)                  # restarts of timed out/failed jobs
+    parser.add_argument("--log_folder", default="../flowstar_logs")        # one log file per job
+    parser.add_argument("--cache_folder", default="../flowstar_cache")     # verdicts of finished jobs
+    parser.add_argument("--no_cache", action="store_true")                 # always run Flow*
+    parser.add_argument("--adaptive", action="store_true")                 # bisect unverified cells instead of a fixed sweep
+    parser.add_argument("--y1", nargs=2, default=[0.65, 0.85], type=float) # initial distance to the side wall (both modes)
+    parser.add_argument("--heading", nargs=2, default=[0, 0], type=float)  # initial heading y4 (rad)
+    parser.add_argument("--velocity", nargs=2, default=[0, 0], type=float) # initial velocity y3
+    parser.add_argument("--coarse_cells", default=4, type=int)             # initial y1 cells in adaptive mode
+    parser.add_argument("--min_widths", nargs=3, default=[0.005, 0.005, 0.01], type=float) # y1, y4, y3
+    args = parser.parse_args(argv)
+
+    dnnYaml = args.dnn
+    plantPickle = args.plant
+    gluePickle = args.glue
     
     with open(dnnYaml, 'rb') as f:
 
@@ -547,27 +1039,55 @@ def main(argv):
     
     modelFile = modelFolder + '/testDnn'
 
-    curLBPos = 0.65
-    posOffset = 0.005
+    template = ComposedSystemTemplate(dnn, plant, glue, safetyProps, numSteps)
 
-    count = 1
+    def submitCell(jobId, cell):
+        curModelFile = modelFile + '_' + jobId + '.model'
+
+        template.write(curModelFile, cellInitProps(cell))
+
+        pool.submit('testDnn_' + jobId, ['../flowstar/flowstar', dnnYaml], curModelFile, cellString(cell))
+
+        return 'testDnn_' + jobId
+
+    cache = None if args.no_cache else ResultCache(args.cache_folder)
 
-    while curLBPos < 0.85:
+    pool = JobPool(args.workers, args.timeout, args.retries, args.log_folder, cache=cache)
 
-        initProps = ['y1 in [' + str(curLBPos) + ', ' + str(curLBPos + posOffset) + ']',\
-                     'y2 in [9.9, 9.9]', 'y3 in [0, 0]', 'y4 in [0, 0]', 'k in [0, 0]',\
-                     'u in [0, 0]', 'angle in [0, 0]', 'temp1 in [0, 0]', 'temp2 in [0, 0]',\
-                     'theta_l in [0, 0]', 'theta_r in [0, 0]'] #F1/10
+    if args.adaptive:
 
-        curModelFile = modelFile + '_' + str(count) + '.model'
+        lb, ub = args.y1
+        width = (ub - lb) / args.coarse_cells
 
-        writeComposedSystem(curModelFile, initProps, dnn, plant, glue, safetyProps, numSteps)
+        initialCells = [{'y1': [lb + i * width, lb + (i + 1) * width],\
+                         'y4': list(args.heading), 'y3': list(args.velocity)} for i in range(args.coarse_cells)]
 
-        args = '../flowstar/flowstar ' + dnnYaml + ' < ' + curModelFile
-        run = subprocess.Popen(args, shell=True, stdin=PIPE)
+        minWidths = dict(zip(['y1', 'y4', 'y3'], args.min_widths))
+
+        leaves = runAdaptive(pool, submitCell, initialCells, minWidths)
+
+        printReport(leaves)
+        printVolumeReport(leaves)
+
+        return
+
+    # fixed sweep: y1 cells of width posOffset over --y1, with the --heading and --velocity ranges
+    curLBPos, maxPos = args.y1
+    posOffset = 0.005
+
+    count = 1
+
+    while curLBPos < maxPos:
+
+        cell = {'y1': [curLBPos, curLBPos + posOffset], 'y4': list(args.heading), 'y3': list(args.velocity)}
+
+        submitCell(str(count), cell)
+        pool.poll()
 
         curLBPos += posOffset
         count += 1
 
+    printReport(pool.wait())
+
 if __name__ == '__main__':
     main(sys.argv[1:])